@@ -0,0 +1,83 @@
+"""
+Checks that ``openspi.triage.triage_spectra`` flags noise-only spectra as
+'blank', including noise on a sloping, curved or drifting baseline, and that
+it does not flag the spectra in ``test_files/`` (with or without such a
+baseline added).
+
+Usage::
+
+    python benchmarks/check_triage.py --seed 0
+
+Exits with status 1 if any spectrum gets the wrong label.
+
+"""
+import os
+import sys
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from openspi.triage import triage_spectra  # noqa: E402
+from synthetic import load_templates  # noqa: E402
+
+
+def baselines(wavenumber, scale):
+    """
+    Returns named smooth baselines over ``wavenumber``, each with an amplitude
+    of about ``scale``.
+    """
+    x = (wavenumber - wavenumber.min()) / np.ptp(wavenumber)
+
+    return {
+        "flat": np.zeros_like(x),
+        "sloping": scale * x,
+        "curved": scale * 4 * (x - 0.5) ** 2,
+        "drifting": scale * np.sin(2 * np.pi * x),
+        "wavy": scale * (np.sin(4 * np.pi * x) + 0.5 * (x - 0.5) ** 2),
+    }
+
+
+def check_cases(templates, rng):
+    """
+    Returns a list of (case, expected, label) for noise-only spectra on each
+    baseline, which should be 'blank', and for each template on each
+    baseline, which should not be flagged.
+    """
+    cases = []
+    _, _, wavenumber, _ = templates[0]
+
+    for baseline_name, baseline in baselines(wavenumber, 0.5).items():
+        noise = rng.normal(0, 0.01, len(wavenumber))
+        labels, _ = triage_spectra(noise + baseline)
+        cases.append((f"noise on a {baseline_name} baseline", "blank", labels[0]))
+
+    for name, _, wavenumber, intensity in templates:
+        scale = np.ptp(intensity)
+        for baseline_name, baseline in baselines(wavenumber, scale).items():
+            labels, _ = triage_spectra(intensity + baseline)
+            cases.append((f"{name} on a {baseline_name} baseline", "", labels[0]))
+
+    return cases
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the triage of blank and real spectra.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    cases = check_cases(load_templates(), rng)
+
+    failed = False
+    for case, expected, label in cases:
+        ok = label == expected
+        failed = failed or not ok
+        print(f"{case:<50} {label or 'matched':<10} {'' if ok else 'expected ' + (expected or 'matched')}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Measures how long it takes to import the parts of openspi in a fresh Python
+process, and checks that R (rpy2) and the other slow imports are not loaded
+by modules that do not need them.
+
+Usage::
+
+    python benchmarks/import_time.py --output import_time.json --max-seconds 1.5
+
+Exits with status 1 if an import loads rpy2, or if ``--max-seconds`` is given
+and an import takes longer.
+
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+
+MODULES = [
+    "openspi",
+    "openspi.core",
+    "openspi.ingest",
+    "openspi.utils",
+    "openspi.store",
+    "openspi.matching",
+    "openspi.preprocess",
+]
+
+# Modules that should only be imported when they are used
+DEFERRED = ["rpy2.robjects", "scipy.signal", "openpyxl"]
+
+_SCRIPT = """
+import sys, time, json
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps({{"seconds": seconds, "loaded": [m for m in {deferred!r} if m in sys.modules]}}))
+"""
+
+
+def time_import(module, repeat=5):
+    """
+    Imports ``module`` in ``repeat`` fresh interpreters and returns the fastest
+    time and the deferred modules it loaded.
+    """
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [root, os.environ.get("PYTHONPATH")])))
+
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, "-c", _SCRIPT.format(module=module, deferred=DEFERRED)],
+            capture_output=True,
+            text=True,
+            env=env,
+            check=True,
+        ).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+
+    return {
+        "seconds": min(run["seconds"] for run in runs),
+        "loaded": runs[0]["loaded"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the import time of openspi modules.")
+    parser.add_argument("--output", default=None, help="A JSON file to write the results to.")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--max-seconds", type=float, default=None,
+                        help="Fail if any import takes longer than this.")
+    args = parser.parse_args()
+
+    results = {}
+    failed = False
+    for module in MODULES:
+        result = time_import(module, args.repeat)
+        results[module] = result
+
+        problems = []
+        if "rpy2.robjects" in result["loaded"]:
+            problems.append("starts R")
+        if args.max_seconds is not None and result["seconds"] > args.max_seconds:
+            problems.append(f"slower than {args.max_seconds} s")
+        failed = failed or bool(problems)
+
+        loaded = ", ".join(result["loaded"]) or "none"
+        print(f"{module:<20} {result['seconds']:.3f} s  deferred modules loaded: {loaded}  {' '.join(problems)}")
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,315 @@
+"""
+Times each stage of the pipeline on synthetic plates of increasing size and
+writes the results as JSON, so that runs can be compared.
+
+Usage::
+
+    python benchmarks/run_benchmarks.py --sizes 10 100 1000 --output bench.json
+
+The stages are timed separately:
+
+* ``ingest_csv``: ``process_csv`` on every file (the first half of
+  ``process_csv_folder``)
+* ``zip``: zipping the processed folder (the second half)
+* ``ingest_arrays``: ``read_spectra_folder`` (the in-memory path)
+* ``r_startup`` and ``load_lib``: loading the R packages and the library,
+  timed once per run
+* ``r_read``, ``process_spec``, ``match_spec`` and ``pandas_conversion``:
+  the steps of ``r_script``
+* ``native_process`` and ``native_match``: ``process_spectra`` and
+  ``SpectralLibrary.match``
+* ``rank_matches``: the ranking and summary tables of ``sort_export``
+* ``sort_export``: ``sort_export`` including writing the Excel workbook
+
+R stages are marked as skipped when rpy2 is not installed. If R is installed
+but fails to start or to load the library, the R stages are marked as errors
+and the script exits with status 1 after writing the results. The native stages
+use the library given with ``--library``, otherwise the R library, otherwise
+a small library built from the files in ``test_files/``.
+
+"""
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import contextlib
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from synthetic import load_templates, make_plate  # noqa: E402
+
+
+def _run_stage(stages, name, function, *args, **kwargs):
+    """
+    Runs one stage with its output silenced and records its wall time. Returns
+    the value returned by ``function``, or None if it failed.
+    """
+    start = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            value = function(*args, **kwargs)
+    except Exception as e:
+        stages[name] = {"status": "error", "error": f"{type(e).__name__}: {e}"}
+        return None
+
+    stages[name] = {"status": "ok", "seconds": time.perf_counter() - start}
+    return value
+
+
+def _skip(stages, names, reason):
+    for name in names:
+        stages[name] = {"status": "skipped", "reason": reason}
+
+
+def _fail(stages, names, reason):
+    for name in names:
+        stages[name] = {"status": "error", "error": reason}
+
+
+def start_r():
+    """
+    Starts R and loads the OpenSpecy packages and the default library
+    (``LIBRARY_NAME``) the same way as ``OpenSpecySession``, timing each
+    step.
+
+    Returns
+    -------
+    pipeline : rpy2 object
+        The R pipeline built by ``OpenSpecySession``, or None if R is not
+        available.
+    library : rpy2 object
+        The filtered library, or None.
+    stages : dict
+        The ``r_startup`` and ``load_lib`` timings.
+
+    """
+    stages = {}
+    try:
+        import rpy2.robjects as ro
+    except Exception as e:
+        _skip(stages, ["r_startup", "load_lib"], f"R is not available ({type(e).__name__}: {e})")
+        return None, None, stages
+
+    from openspi.session import _R_PACKAGES, _R_FILTER_LIBRARY, _R_PIPELINE, LIBRARIES, LIBRARY_NAME
+
+    _run_stage(stages, "r_startup", lambda: ro.r(_R_PACKAGES))
+    if stages["r_startup"]["status"] != "ok":
+        _fail(stages, ["load_lib"], "R startup failed")
+        return None, None, stages
+
+    lib_type, spectrum_type = LIBRARIES[LIBRARY_NAME]
+    library = _run_stage(
+        stages, "load_lib", lambda: ro.r(_R_FILTER_LIBRARY)(ro.r["load_lib"](lib_type), spectrum_type)
+    )
+    if stages["load_lib"]["status"] != "ok":
+        return None, None, stages
+
+    return ro.r(_R_PIPELINE)(library), library, stages
+
+
+def template_library(templates, range_min, range_max):
+    """
+    Builds a small ``SpectralLibrary`` from the template spectra, processed
+    the same way as the spectra they are matched against.
+    """
+    from openspi.ingest import stack_spectra
+    from openspi.matching import SpectralLibrary
+    from openspi.preprocess import process_spectra
+
+    names = [name for name, _, _, _ in templates]
+    wavenumber, intensities = stack_spectra(
+        [(wn, intensity) for _, _, wn, intensity in templates], names
+    )
+    wavenumber, spectra = process_spectra(wavenumber, intensities, wavenumber, range_min, range_max)
+
+    metadata = pd.DataFrame(
+        {
+            "sample_name": names,
+            "spectrum_identity": names,
+            "material_class": names,
+            "plastic_or_not": ["plastic"] * len(names),
+            "sn": np.arange(len(names)),
+        }
+    )
+
+    return SpectralLibrary(wavenumber, spectra, metadata)
+
+
+def benchmark_size(n_spectra, workdir, templates, pipeline, library, range_min, range_max, seed, r_error = None):
+    """
+    Runs every per-plate stage on a synthetic plate of ``n_spectra`` spectra.
+    If ``r_error`` is set, R failed to start and the R stages are marked as
+    errors.
+    """
+    from openspi.core import process_csv, sort_export
+    from openspi.ingest import read_spectra_folder
+    from openspi.preprocess import process_spectra
+    from openspi.utils import rank_matches
+
+    stages = {}
+    folder_path = os.path.join(workdir, f"plate_{n_spectra}")
+    shutil.rmtree(folder_path, ignore_errors=True)
+    make_plate(folder_path, n_spectra, seed, templates=templates)
+
+    # Read into arrays first, as process_csv rewrites the files in place
+    arrays = _run_stage(stages, "ingest_arrays", read_spectra_folder, folder_path, range_min, range_max)
+
+    _run_stage(
+        stages,
+        "ingest_csv",
+        lambda: [
+            process_csv(os.path.join(folder_path, name), range_min, range_max)
+            for name in sorted(os.listdir(folder_path))
+        ],
+    )
+    zip_path = _run_stage(
+        stages, "zip", shutil.make_archive, folder_path, format="zip", root_dir=folder_path
+    )
+
+    df_top_matches = None
+    r_stages = ["r_read", "process_spec", "match_spec", "pandas_conversion"]
+    if r_error is not None:
+        _fail(stages, r_stages, r_error)
+    elif pipeline is None:
+        _skip(stages, r_stages, "R is not available")
+    else:
+        from openspi.session import r_frame_to_pandas
+        from openspi.utils import reformat_path
+
+        files = _run_stage(stages, "r_read", pipeline.rx2("read_file"), reformat_path(zip_path))
+        processed = _run_stage(
+            stages, "process_spec", pipeline.rx2("process"), files, range_min, range_max, False, "none", False
+        )
+        r_matches = _run_stage(stages, "match_spec", pipeline.rx2("match"), processed, 5)
+
+        df_top_matches = _run_stage(stages, "pandas_conversion", r_frame_to_pandas, r_matches)
+
+    if arrays is None:
+        _skip(stages, ["native_process", "native_match"], "ingest_arrays failed")
+    else:
+        wavenumber, intensities, file_names = arrays
+        processed = _run_stage(
+            stages, "native_process", process_spectra, wavenumber, intensities, library.wavenumber, range_min, range_max
+        )
+        if processed is not None:
+            df_native = _run_stage(stages, "native_match", library.match, processed[0], processed[1], file_names, 5)
+            if df_top_matches is None:
+                df_top_matches = df_native
+
+    if df_top_matches is None:
+        _skip(stages, ["rank_matches", "sort_export"], "No matches to export")
+    else:
+        df_truncated = df_top_matches.sort_values(by=["file_name.y"])[
+            ["file_name.y", "spectrum_identity", "material_class", "match_val", "sn", "plastic_or_not"]
+        ]
+        _run_stage(stages, "rank_matches", rank_matches, df_truncated)
+        _run_stage(
+            stages, "sort_export", sort_export, df_top_matches, os.path.join(workdir, f"plate_{n_spectra}.xlsx"), 5
+        )
+
+    return stages
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time each stage of the openspi pipeline.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000],
+                        help="The numbers of spectra per synthetic plate (10 to 100000).")
+    parser.add_argument("--output", default="bench_output.json", help="The JSON file to write.")
+    parser.add_argument("--library", default=None, help="A .npz library saved with SpectralLibrary.save.")
+    parser.add_argument("--workdir", default=None, help="Where to write the plates. Default is a temporary folder.")
+    parser.add_argument("--range-min", type=int, default=650)
+    parser.add_argument("--range-max", type=int, default=4000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    from openspi.__version__ import __version__
+    from openspi.matching import SpectralLibrary
+
+    templates = load_templates()
+    pipeline, r_library, startup = start_r()
+
+    # R is installed but did not start: report it as an error, not a skip
+    r_error = None
+    failed = [name for name, stage in startup.items() if stage["status"] == "error"]
+    if failed:
+        r_error = f"{failed[0]} failed: {startup[failed[0]].get('error')}"
+        print(f"R failed to start ({r_error})")
+
+    if args.library is not None:
+        library, library_source = SpectralLibrary.load(args.library), args.library
+    elif r_library is not None:
+        from openspi.session import OpenSpecySession
+
+        from openspi.session import LIBRARY_NAME
+
+        # Reuse the library already loaded by start_r, with the per-library
+        # state that OpenSpecySession.__init__ sets up
+        session = OpenSpecySession.__new__(OpenSpecySession)
+        session.library, session._pipeline = r_library, pipeline
+        session.library_name = LIBRARY_NAME
+        session.snapshot_dir = None
+        session._variants = {LIBRARY_NAME: (r_library, pipeline)}
+        session._native_libraries = {}
+        session._library_indexes = {}
+        session._sub_libraries = {}
+        library, library_source = SpectralLibrary.from_session(session), "openspecy"
+    else:
+        library, library_source = template_library(templates, args.range_min, args.range_max), "test_files"
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="openspi_bench_")
+    results = []
+    for n_spectra in args.sizes:
+        print(f"Benchmarking {n_spectra} spectra...")
+        stages = benchmark_size(
+            n_spectra, workdir, templates, pipeline, library, args.range_min, args.range_max, args.seed, r_error
+        )
+        for name, stage in stages.items():
+            detail = f"{stage['seconds']:.3f} s" if stage["status"] == "ok" else stage["status"]
+            print(f"  {name:<18} {detail}")
+        results.append({"n_spectra": n_spectra, "stages": stages})
+
+    report = {
+        "openspi_version": __version__,
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "library": library_source,
+        "range": [args.range_min, args.range_max],
+        "seed": args.seed,
+        "startup": startup,
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    if args.workdir is None:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"Results written to {args.output}")
+
+    errors = [
+        (name, stage["error"])
+        for stages in [startup] + [result["stages"] for result in results]
+        for name, stage in stages.items()
+        if stage["status"] == "error"
+    ]
+    if errors:
+        for name, error in dict(errors).items():
+            print(f"  {name} failed: {error}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+Generates synthetic plates of spectra for benchmarking, by perturbing the
+spectra in ``test_files/``.
+
+Usage::
+
+    python benchmarks/synthetic.py OUTPUT_FOLDER N_SPECTRA [--seed SEED]
+
+"""
+import os
+import sys
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from openspi.ingest import list_csv_files, _header_length, _read_lines  # noqa: E402
+
+
+TEST_FILES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "test_files")
+
+
+def load_templates(folder_path=TEST_FILES):
+    """
+    Reads the template spectra and the instrument header of each file.
+
+    Parameters
+    ----------
+    folder_path : str
+        The folder containing the template .csv files.
+
+    Returns
+    -------
+    templates : list
+        A list of (name, header_lines, wavenumber, intensity) tuples.
+
+    """
+    templates = []
+    for name in list_csv_files(folder_path):
+        lines = _read_lines(os.path.join(folder_path, name))
+        n_header = _header_length(lines)
+        data = np.loadtxt(lines[n_header:], delimiter=",", usecols=(0, 1), ndmin=2)
+        templates.append((os.path.splitext(name)[0], lines[:n_header], data[:, 0], data[:, 1]))
+
+    return templates
+
+
+def well_name(index):
+    """
+    Returns a 384-well plate position (A01-P24) for a running index, with the
+    plate number for indices past the first plate, e.g. 'p002_C05'.
+    """
+    plate, well = divmod(index, 384)
+    row, column = divmod(well, 24)
+
+    return f"p{plate + 1:03d}_{'ABCDEFGHIJKLMNOP'[row]}{column + 1:02d}"
+
+
+def perturb(intensity, rng, noise=0.005):
+    """
+    Returns a perturbed copy of a spectrum: scaled by 0.8-1.2, with a random
+    linear baseline and Gaussian noise of ``noise`` times its range added.
+    """
+    span = np.ptp(intensity)
+    x = np.linspace(-1, 1, len(intensity))
+
+    return (
+        intensity * rng.uniform(0.8, 1.2)
+        + span * rng.uniform(-0.05, 0.05) * (1 + x * rng.uniform(-1, 1))
+        + rng.normal(0, noise * span, len(intensity))
+    )
+
+
+def make_plate(folder_path, n_spectra, seed=0, noise=0.005, templates=None):
+    """
+    Writes ``n_spectra`` synthetic .csv files, each a perturbed copy of one of
+    the template spectra, with the same instrument header and wavenumber axis
+    as its template. The output is the same for the same seed.
+
+    Parameters
+    ----------
+    folder_path : str
+        The folder to write the files to. It is created if it does not exist.
+    n_spectra : int
+        The number of files to write.
+    seed : int
+        The random seed.
+    noise : float
+        The standard deviation of the added noise, relative to the range of
+        each template spectrum.
+    templates : list
+        Optional. The output of ``load_templates``.
+
+    Returns
+    -------
+    file_names : list
+        The names of the files written.
+
+    """
+    if templates is None:
+        templates = load_templates()
+
+    os.makedirs(folder_path, exist_ok=True)
+    rng = np.random.default_rng(seed)
+
+    file_names = []
+    for index in range(n_spectra):
+        name, header, wavenumber, intensity = templates[index % len(templates)]
+        values = perturb(intensity, rng, noise)
+
+        file_name = f"{well_name(index)}_{name}.csv"
+        body = "\n".join(f"{w:g},{v:.2f}" for w, v in zip(wavenumber, values))
+        with open(os.path.join(folder_path, file_name), "w", newline="") as f:
+            f.write("\n".join(header) + "\n" + body + "\n")
+
+        file_names.append(file_name)
+
+    return file_names
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic plate of spectra.")
+    parser.add_argument("folder_path", help="The folder to write the .csv files to.")
+    parser.add_argument("n_spectra", type=int, help="The number of spectra (e.g. 10 to 100000).")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--noise", type=float, default=0.005)
+    args = parser.parse_args()
+
+    make_plate(args.folder_path, args.n_spectra, args.seed, args.noise)
+    print(f"{args.n_spectra} spectra written to {args.folder_path}")
+
+
+if __name__ == "__main__":
+    main()
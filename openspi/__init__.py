@@ -1 +1,8 @@
-from .core import process_csv, process_csv_folder, r_script, sort_export, openspi_main
\ No newline at end of file
+from .core import process_csv, process_csv_folder, r_script, r_script_in_memory, match_native, iter_matches, sort_export, openspi_main
+from .ingest import read_spectrum, read_spectra_folder, IngestStats
+from .session import OpenSpecySession, register_library
+from .matching import SpectralLibrary
+from .cache import ResultCache
+from .store import SpectralStore
+from .trace import Tracer
+from .batch import run_batch
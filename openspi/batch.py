@@ -0,0 +1,455 @@
+import os
+import sys
+import json
+import time
+import argparse
+
+import pandas as pd
+
+from .core import export_path, export_outputs, match_source, sort_export, SUMMARY_COLUMNS
+from .errors import OutputExistsError, SourceError
+from .library_index import parse_filter
+from .session import OpenSpecySession
+
+
+# The parameters that can be set for each source in a manifest, and their
+# defaults (the same as openspi_main)
+DEFAULTS = {
+    "range_min": None,
+    "range_max": None,
+    "export_xlsx": None,
+    "export_dir": None,
+    "nrel_version": False,
+    "adj_intens": False,
+    "adj_intens_type": 'none',
+    "subtr_baseline": False,
+    "in_memory": False,
+    "matcher": 'r',
+    "processor": 'r',
+    "search": 'exhaustive',
+    "chunk_size": None,
+    "memory_limit_mb": None,
+    "threads": None,
+    "library_name": None,
+    "io_workers": None,
+    "table_format": None,
+    "excel_sheets": 'all',
+    "columns": None,
+    "triage": False,
+    "library_filter": None,
+}
+
+_BOOLEAN_FIELDS = ["nrel_version", "adj_intens", "subtr_baseline", "in_memory"]
+
+ON_EXISTS = ('skip', 'overwrite', 'error')
+
+
+def _to_bool(value):
+    if isinstance(value, str):
+        if value.strip().lower() in ('true', 'yes', 'y', '1'):
+            return True
+        if value.strip().lower() in ('false', 'no', 'n', '0', ''):
+            return False
+        raise ValueError(f"Not a boolean value: {value}")
+    return bool(value)
+
+
+def load_manifest(manifest_path):
+    """
+    Reads a manifest of sources and their parameters.
+
+    A .csv manifest has one row per source, with a ``source_path`` column and
+    optionally any of the columns in ``DEFAULTS``; empty cells use the default.
+    A .json manifest is either a list of objects with the same keys, or an
+    object with ``"sources"`` (that list) and ``"defaults"`` (values used for
+    every source that does not set them). Relative paths are relative to the
+    folder of the manifest.
+
+    Parameters
+    ----------
+    manifest_path : str
+        The full path to the .csv or .json manifest.
+
+    Returns
+    -------
+    entries : list
+        One dict of parameters per source, in manifest order.
+
+    """
+    if manifest_path.endswith(".json"):
+        with open(manifest_path, "r") as f:
+            manifest = json.load(f)
+        if isinstance(manifest, dict):
+            defaults = manifest.get("defaults", {})
+            entries = [{**defaults, **entry} for entry in manifest["sources"]]
+        else:
+            entries = list(manifest)
+    elif manifest_path.endswith(".csv"):
+        df = pd.read_csv(manifest_path, dtype=str, keep_default_na=False)
+        entries = [
+            {key: value for key, value in row.items() if value != ""}
+            for row in df.to_dict(orient="records")
+        ]
+    else:
+        raise ValueError("The manifest must be a .csv or .json file.")
+
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    for entry in entries:
+        for key in ("source_path", "export_dir"):
+            if entry.get(key) is not None:
+                entry[key] = os.path.join(base_dir, entry[key])
+
+    return entries
+
+
+def _entry_params(entry, defaults):
+    """
+    Combines one manifest entry with the batch defaults and checks the
+    values.
+    """
+    params = {**DEFAULTS, **defaults, **entry}
+    source_path = params.pop("source_path", None)
+    if source_path is None:
+        raise ValueError("Manifest entry has no source_path.")
+
+    unknown = set(params) - set(DEFAULTS)
+    if unknown:
+        raise ValueError(f"Unknown manifest field(s): {', '.join(sorted(unknown))}")
+    if params["range_min"] is None or params["range_max"] is None:
+        raise ValueError("range_min and range_max must be set in the manifest or the batch defaults.")
+
+    params["range_min"] = float(params["range_min"])
+    params["range_max"] = float(params["range_max"])
+    for key in _BOOLEAN_FIELDS:
+        params[key] = _to_bool(params[key])
+    if params["chunk_size"] is not None:
+        params["chunk_size"] = int(params["chunk_size"])
+    if params["memory_limit_mb"] is not None:
+        params["memory_limit_mb"] = float(params["memory_limit_mb"])
+    if params["threads"] is not None:
+        params["threads"] = int(params["threads"])
+    if params["io_workers"] is not None:
+        params["io_workers"] = int(params["io_workers"])
+    if params["columns"] is not None:
+        # The summary columns are always kept, as sort_export needs them
+        columns = params["columns"]
+        if isinstance(columns, str):
+            columns = [column.strip() for column in columns.split(",") if column.strip()]
+        params["columns"] = list(dict.fromkeys(SUMMARY_COLUMNS + list(columns)))
+    # A .json manifest may give the triage thresholds as an object
+    if not isinstance(params["triage"], dict):
+        params["triage"] = _to_bool(params["triage"])
+    if params["library_filter"] is not None:
+        # A filter name, a JSON object in a .csv manifest, or an object in a
+        # .json manifest
+        params["library_filter"] = parse_filter(params["library_filter"])
+
+    return source_path, params
+
+
+def run_batch(
+        entries,
+        on_exists = 'skip',
+        session = None,
+        library_snapshot = None,
+        library = None,
+        cache = None,
+        fail_fast = False,
+        summary_path = None,
+        tracer = None,
+        snapshot_dir = None,
+        **defaults):
+    """
+    Runs many sources (folders, .csv files or spectral stores) in one process,
+    sharing one warm R session and library between them. Unlike
+    ``openspi_main``, nothing prompts for input or exits: existing output files
+    are handled by ``on_exists``, and a source that fails is recorded as a
+    ``SourceError`` while the rest of the batch continues.
+
+    Parameters
+    ----------
+    entries : list or str
+        The sources to run, as a list of dicts with a ``'source_path'`` key and
+        any of the parameters in ``DEFAULTS``, or the path to a manifest (see
+        ``load_manifest``).
+    on_exists : str
+        What to do when the output .xlsx file already exists: 'skip'
+        (default), 'overwrite', or 'error' (the source fails with an
+        ``OutputExistsError``).
+    session : OpenSpecySession
+        Optional. The R session to use. If not specified, one session is
+        started the first time a source needs R and is used for the rest of
+        the batch.
+    library_snapshot : str
+        Optional. Passed to ``OpenSpecySession`` when the session is started.
+    library : SpectralLibrary
+        Optional. The library used by sources with ``processor='native'``. If
+        not specified, the library of the session is used.
+    cache : ResultCache
+        Optional. Passed to ``openspi_main`` for every source.
+    fail_fast : bool
+        If True, the first failure is raised as a ``SourceError`` instead of
+        being recorded.
+    summary_path : str
+        Optional. The full path to a .json file to write the summary to.
+    tracer : Tracer
+        Optional. Records a timing span for every source (see
+        ``openspi.trace``).
+    snapshot_dir : str
+        Optional. Passed to ``OpenSpecySession`` when the session is started,
+        so every library named by a source is loaded once and kept on disk.
+    **defaults
+        Values for any of the parameters in ``DEFAULTS`` that are used for
+        every source that does not set them (e.g. ``range_min=650``).
+
+    Returns
+    -------
+    summary : dict
+        The number of sources that were matched, skipped and failed, the
+        total number of spectra and seconds, the throughput, a list of the
+        failures and a list of the results of every source.
+
+    """
+    if on_exists not in ON_EXISTS:
+        raise ValueError(f"Unknown on_exists: {on_exists}. Options are 'skip', 'overwrite', or 'error'.")
+    if isinstance(entries, str):
+        entries = load_manifest(entries)
+
+    warm = {"session": session}
+
+    def get_warm_session():
+        if warm["session"] is None:
+            warm["session"] = OpenSpecySession(library_snapshot=library_snapshot, snapshot_dir=snapshot_dir)
+        return warm["session"]
+
+    results = []
+    batch_start = time.perf_counter()
+
+    for number, entry in enumerate(entries, start=1):
+        source_path = entry.get("source_path")
+        print(f"[{number}/{len(entries)}] {source_path}")
+        result = {"source_path": source_path, "status": None, "output": None, "n_spectra": 0}
+        start = time.perf_counter()
+        stage = 'prepare'
+
+        try:
+            source_path, params = _entry_params(entry, defaults)
+            target_file_path = export_path(
+                source_path, params["export_xlsx"], params["export_dir"], params["nrel_version"]
+            )
+            outputs = export_outputs(target_file_path, params["table_format"], params["excel_sheets"])
+            result["output"] = outputs[0]
+
+            existing = [path for path in outputs if os.path.exists(path)]
+            if existing:
+                if on_exists == 'skip':
+                    print(f"Output exists, skipping: {existing[0]}")
+                    result["status"] = 'skipped'
+                    result["seconds"] = time.perf_counter() - start
+                    results.append(result)
+                    continue
+                if on_exists == 'error':
+                    raise OutputExistsError(existing[0])
+
+            stage = 'match'
+            source_library = library
+            source_session = warm["session"]
+            if params["processor"] != 'native' or library is None:
+                source_session = get_warm_session()
+            if params["processor"] == 'native' and source_library is None:
+                source_library = source_session.get_native_library(params["library_name"])
+
+            df_top_matches = match_source(
+                source_path,
+                params["range_min"],
+                params["range_max"],
+                params["nrel_version"],
+                params["adj_intens"],
+                params["adj_intens_type"],
+                params["subtr_baseline"],
+                5,
+                params["in_memory"],
+                source_session,
+                params["matcher"],
+                params["processor"],
+                source_library,
+                cache,
+                params["search"],
+                tracer,
+                params["chunk_size"],
+                params["memory_limit_mb"],
+                params["threads"],
+                params["library_name"],
+                params["io_workers"],
+                params["columns"],
+                params["triage"],
+                params["library_filter"],
+            )
+
+            stage = 'export'
+            sort_export(df_top_matches, target_file_path, 5, nrel = params["nrel_version"], tracer = tracer, table_format = params["table_format"], excel_sheets = params["excel_sheets"])
+
+            result["status"] = 'ok'
+            result["n_spectra"] = int(df_top_matches["file_name.y"].nunique())
+
+        # process_csv still exits on some errors, so SystemExit is caught too
+        except (Exception, SystemExit) as e:
+            error = e if isinstance(e, SourceError) else SourceError(source_path, stage, e)
+            if fail_fast:
+                raise error from e
+            print(f"Failed: {error}")
+            result["status"] = 'failed'
+            result["error"] = error.to_dict()
+
+        result["seconds"] = time.perf_counter() - start
+        results.append(result)
+
+    summary = _summarize(results, time.perf_counter() - batch_start)
+
+    if summary_path is not None:
+        with open(summary_path, "w") as f:
+            json.dump(summary, f, indent=2)
+        print("Summary saved to " + summary_path)
+
+    return summary
+
+
+def _summarize(results, seconds):
+    """
+    Builds and prints the summary of a batch.
+    """
+    ok = [result for result in results if result["status"] == 'ok']
+    n_spectra = sum(result["n_spectra"] for result in ok)
+
+    summary = {
+        "n_sources": len(results),
+        "ok": len(ok),
+        "skipped": sum(result["status"] == 'skipped' for result in results),
+        "failed": sum(result["status"] == 'failed' for result in results),
+        "n_spectra": n_spectra,
+        "seconds": seconds,
+        "spectra_per_s": n_spectra / seconds if seconds > 0 else None,
+        "failures": [result["error"] for result in results if result["status"] == 'failed'],
+        "results": results,
+    }
+
+    print(
+        f"Batch complete: {summary['ok']} matched, {summary['skipped']} skipped, "
+        f"{summary['failed']} failed. {n_spectra} spectra in {seconds:.1f} s"
+        + (f" ({summary['spectra_per_s']:.1f} spectra/s)." if n_spectra else ".")
+    )
+    for failure in summary["failures"]:
+        print(f"  {failure['source_path']} ({failure['stage']}): {failure['type']}: {failure['message']}")
+
+    return summary
+
+
+def main(argv = None):
+    """
+    Command line interface for ``run_batch``. Run ``openspi-batch --help``
+    for the options. Exits with status 1 if any source failed.
+    """
+    parser = argparse.ArgumentParser(
+        prog="openspi-batch",
+        description="Match every source in a manifest through one warm OpenSpecy session.",
+    )
+    parser.add_argument("manifest", help="A .csv or .json manifest of source folders and their parameters.")
+    parser.add_argument("--on-exists", choices=ON_EXISTS, default='skip',
+                        help="What to do when an output .xlsx file already exists (default: skip).")
+    parser.add_argument("--range-min", type=float, help="Default range_min for sources that do not set it.")
+    parser.add_argument("--range-max", type=float, help="Default range_max for sources that do not set it.")
+    parser.add_argument("--export-dir", help="Default export_dir for sources that do not set it.")
+    parser.add_argument("--processor", choices=('r', 'native'), help="Default processor.")
+    parser.add_argument("--matcher", choices=('r', 'native'), help="Default matcher.")
+    parser.add_argument("--search", choices=('exhaustive', 'cascade'), help="Default search.")
+    parser.add_argument("--in-memory", action="store_true", default=None, help="Read the spectra into memory.")
+    parser.add_argument("--chunk-size", type=int,
+                        help="Match the spectra in chunks of this many spectra to bound the memory used.")
+    parser.add_argument("--memory-limit-mb", type=float,
+                        help="With processor='native', the memory allowed for match scores, in megabytes.")
+    parser.add_argument("--threads", type=int,
+                        help="With processor='native', the number of BLAS threads used for matching (requires threadpoolctl).")
+    parser.add_argument("--library-snapshot", help="An .rds library snapshot for the R session.")
+    parser.add_argument("--library", help="A .npz library for processor='native' (see SpectralLibrary.save).")
+    parser.add_argument("--table-format", choices=('parquet', 'arrow'),
+                        help="Also write the tables as Parquet or Arrow files (requires pyarrow).")
+    parser.add_argument("--excel-sheets", choices=('all', 'summary', 'none'),
+                        help="The sheets written to the .xlsx file (default: all).")
+    parser.add_argument("--columns",
+                        help="Comma-separated match columns to keep, besides the summary columns (e.g. 'object_id,library_id').")
+    parser.add_argument("--summary-columns", action="store_true",
+                        help="Only keep the match columns used by the summary sheets.")
+    parser.add_argument("--triage", action="store_true", default=None,
+                        help="Report blank, saturated and dead spectra without matching them.")
+    parser.add_argument("--io-workers", type=int,
+                        help="Read this many .csv files at a time, e.g. from a network share.")
+    parser.add_argument("--library-filter",
+                        help="Only match against part of the library: 'polymers', 'ftir', or a JSON object such as '{\"material_class\": \"polyesters\"}'.")
+    parser.add_argument("--library-name", help="Default reference library, e.g. 'derivative/ftir' or 'raw/raman'.")
+    parser.add_argument("--snapshot-dir", help="A folder of library snapshots for the R session.")
+    parser.add_argument("--cache-dir", help="A folder for a ResultCache.")
+    parser.add_argument("--summary", help="A .json file to write the summary to.")
+    parser.add_argument("--fail-fast", action="store_true", help="Stop at the first failure.")
+    args = parser.parse_args(argv)
+
+    # An empty list of extra columns keeps only the summary columns
+    if args.summary_columns and args.columns is None:
+        args.columns = ""
+
+    defaults = {
+        key: value
+        for key, value in {
+            "range_min": args.range_min,
+            "range_max": args.range_max,
+            "export_dir": args.export_dir,
+            "processor": args.processor,
+            "matcher": args.matcher,
+            "search": args.search,
+            "in_memory": args.in_memory,
+            "chunk_size": args.chunk_size,
+            "memory_limit_mb": args.memory_limit_mb,
+            "threads": args.threads,
+            "library_name": args.library_name,
+            "io_workers": args.io_workers,
+            "table_format": args.table_format,
+            "excel_sheets": args.excel_sheets,
+            "columns": args.columns,
+            "triage": args.triage,
+            "library_filter": args.library_filter,
+        }.items()
+        if value is not None
+    }
+
+    library = None
+    if args.library is not None:
+        from .matching import SpectralLibrary
+
+        library = SpectralLibrary.load(args.library)
+
+    cache = None
+    if args.cache_dir is not None:
+        from .cache import ResultCache
+
+        cache = ResultCache(args.cache_dir)
+
+    try:
+        summary = run_batch(
+            args.manifest,
+            on_exists = args.on_exists,
+            library_snapshot = args.library_snapshot,
+            snapshot_dir = args.snapshot_dir,
+            library = library,
+            cache = cache,
+            fail_fast = args.fail_fast,
+            summary_path = args.summary,
+            **defaults,
+        )
+    except SourceError as e:
+        print(str(e))
+        sys.exit(1)
+
+    sys.exit(1 if summary["failed"] else 0)
+
+
+if __name__ == "__main__":
+    main()
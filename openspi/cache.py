@@ -0,0 +1,211 @@
+import os
+import json
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+
+class ResultCache:
+    """
+    A local on-disk cache of library matches, keyed by a hash of each raw
+    spectrum plus the processing parameters and the library version. On a
+    re-run, unchanged spectra are taken from the cache and only new or changed
+    spectra are processed and matched.
+
+    Each spectrum's matches are stored in their own file. The total size of
+    the cache is bounded by ``max_bytes``; when it is exceeded, the least
+    recently used entries are removed first.
+
+    Parameters
+    ----------
+    cache_dir : str
+        The folder holding the cache. It is created if it does not exist.
+    max_bytes : int
+        The maximum total size of the cache in bytes. Default is 500 MB.
+    library_version : str
+        Optional. A version string for the reference library, added to every
+        key. Set this (or ``clear`` the cache) after updating the OpenSpecy
+        library with ``get_lib``. Libraries held as ``SpectralLibrary``
+        objects are also identified by a hash of their contents.
+
+    """
+
+    def __init__(self, cache_dir, max_bytes = 500 * 1024 ** 2, library_version = None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.library_version = library_version
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(cache_dir, exist_ok=True)
+
+        # Key -> size in bytes, from least to most recently used
+        self._entries = OrderedDict()
+        files = [
+            entry for entry in os.scandir(cache_dir) if entry.name.endswith(".pkl")
+        ]
+        for entry in sorted(files, key=lambda entry: entry.stat().st_mtime):
+            self._entries[entry.name[:-4]] = entry.stat().st_size
+        self._bytes = sum(self._entries.values())
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + ".pkl")
+
+    @staticmethod
+    def key(wavenumber, intensity, params):
+        """
+        Computes the cache key of one spectrum.
+
+        Parameters
+        ----------
+        wavenumber : numpy.ndarray
+            The wavenumber axis of the spectrum.
+        intensity : numpy.ndarray
+            The raw intensities of the spectrum.
+        params : dict
+            The processing parameters and library version. Any change to these
+            gives a different key.
+
+        Returns
+        -------
+        key : str
+            A SHA-256 hex digest.
+
+        """
+        digest = hashlib.sha256()
+        digest.update(np.ascontiguousarray(wavenumber, dtype=np.float64).tobytes())
+        digest.update(np.ascontiguousarray(intensity, dtype=np.float64).tobytes())
+        digest.update(json.dumps(params, sort_keys=True, default=str).encode())
+
+        return digest.hexdigest()
+
+    def get(self, key):
+        """
+        Returns the cached matches for a key, or None if there are none.
+        """
+        if key not in self._entries:
+            self.misses += 1
+            return None
+
+        try:
+            df = pd.read_pickle(self._path(key))
+        except (FileNotFoundError, EOFError):
+            self._bytes -= self._entries.pop(key)
+            self.misses += 1
+            return None
+
+        # Mark as most recently used (the mtime keeps the order across runs)
+        self._entries.move_to_end(key)
+        os.utime(self._path(key))
+        self.hits += 1
+
+        return df
+
+    def put(self, key, df):
+        """
+        Stores the matches for a key, removing the least recently used entries
+        if the cache is over ``max_bytes``.
+        """
+        path = self._path(key)
+        df.to_pickle(path)
+
+        if key in self._entries:
+            self._bytes -= self._entries.pop(key)
+        self._entries[key] = os.path.getsize(path)
+        self._bytes += self._entries[key]
+
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            old_key, size = self._entries.popitem(last=False)
+            self._bytes -= size
+            try:
+                os.remove(self._path(old_key))
+            except FileNotFoundError:
+                pass
+
+    def clear(self):
+        """
+        Removes every entry from the cache.
+        """
+        for key in list(self._entries):
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+        self._entries.clear()
+        self._bytes = 0
+
+    @property
+    def stats(self):
+        """
+        The cache statistics: hits, misses, hit rate, entries and bytes.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+        }
+
+    def match(self, wavenumber, intensities, file_names, params, match_function):
+        """
+        Matches a batch of spectra, taking unchanged spectra from the cache and
+        calling ``match_function`` only for the rest.
+
+        Parameters
+        ----------
+        wavenumber : numpy.ndarray
+            The wavenumber axis shared by all of the spectra.
+        intensities : numpy.ndarray
+            A (n_files, n_points) array of raw intensities.
+        file_names : list
+            The file name of each spectrum.
+        params : dict
+            The processing parameters and library version (see ``key``).
+        match_function : callable
+            Called as ``match_function(wavenumber, intensities, file_names)``
+            for the spectra that are not cached. Must return a matches
+            dataframe with a ``'file_name.y'`` column.
+
+        Returns
+        -------
+        df_top_matches : dataframe
+            The matches for every spectrum, in the order of ``file_names``.
+
+        """
+        intensities = np.atleast_2d(intensities)
+        file_names = list(file_names)
+
+        if self.library_version is not None:
+            params = dict(params, user_library_version=self.library_version)
+
+        keys = [self.key(wavenumber, intensity, params) for intensity in intensities]
+        cached = [self.get(key) for key in keys]
+        missing = [i for i, df in enumerate(cached) if df is None]
+
+        if missing:
+            df_new = match_function(
+                wavenumber, intensities[missing], [file_names[i] for i in missing]
+            )
+            groups = dict(tuple(df_new.groupby("file_name.y", sort=False)))
+            for i in missing:
+                df = groups.get(file_names[i], df_new.iloc[:0])
+                self.put(keys[i], df)
+                cached[i] = df
+
+        # The same spectrum may have been cached under another file name
+        frames = []
+        for name, df in zip(file_names, cached):
+            if len(df) > 0 and (df["file_name.y"] != name).any():
+                df = df.copy()
+                df["file_name.y"] = name
+                if "object_id" in df.columns:
+                    df["object_id"] = name
+            frames.append(df)
+
+        print(f"Cache: {len(file_names) - len(missing)} hit(s), {len(missing)} miss(es).")
+
+        return pd.concat(frames, ignore_index=True)
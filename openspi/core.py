@@ -2,13 +2,19 @@ import os
 import sys
 import csv
 import shutil
+from concurrent.futures import ThreadPoolExecutor
 
-import rpy2.robjects as ro
-import rpy2.robjects.pandas2ri as pandas2ri
+import pandas as pd
 
+from .ingest import read_csv_rows, read_spectrum, read_spectra_folder, read_spectra_zip, iter_spectra_folder, group_by_axis, list_csv_files, read_files, IngestStats, _csv_rows_from_lines, _check_range
+from .preprocess import process_spectra
 from .nrel import nrel_delete_sp, nrel_autoname
-from .metadata import _xlsx_metadata
-from .utils import count_files, reformat_path, save_df_to_excel, matches_checked_sheet, subsequent_matches_checked, list_to_df_to_sheet
+from .session import get_session
+from .store import as_store
+from .trace import Tracer, as_tracer
+from .triage import triage_thresholds, triage_match_function
+from .library_index import filter_key
+from .utils import count_files, save_sheets_to_excel, save_tables, table_paths, matches_checked_df, rank_matches
 
 def process_csv(file_path, range_min, range_max):
     """
@@ -42,9 +48,6 @@ def process_csv(file_path, range_min, range_max):
         )
         sys.exit()
     try:
-        # For each file in the folder:
-        #for filename in os.listdir(file_path):
-
         # Ensure the file is a .csv
         if file_path.endswith(".csv") == False:
             print(
@@ -52,48 +55,11 @@ def process_csv(file_path, range_min, range_max):
             )
             sys.exit()
 
-        # Join the individual file with the parent path to get a full path
-        #file_path = os.path.join(file_path, filename)
-
-        # Open the .csv file with the csv.reader object
-        with open(file_path, "r", newline="") as csvfile:
-            csvreader = csv.reader(csvfile, csv.QUOTE_NONE)
-
-            # Read the .csv into a list
-            rows = list(csvreader)
-
-            # Initialize the keep_row list, which will be for rows that
-            # contain numeric data
-            keep_rows = []
-
-            # For each row:
-            x = 0
-            while x < len(rows):
-                try:
-                    # Check if the data in the first and second columns are
-                    # numbers, and if so, keep the row
-                    float(rows[x][0])
-                    float(rows[x][1])
-                    if (
-                        float(rows[x][0]) >= range_min
-                        and float(rows[x][0]) <= range_max
-                    ):
-                        keep_rows.append(rows[x])
-                except:
-                    # If the data cannot be converted into a number, skip
-                    # the row
-                    pass
-                x += 1
-
-        # Use the csv.writer object to overwrite the .csv file
-        with open(file_path, "w", newline="") as csvfile:
-            csvwriter = csv.writer(csvfile)
-
-            # Write the specified column names to the first row
-            csvwriter.writerow(["wavenumber", "intensity"])
-
-            # Write the "floatable" rows to the .csv file
-            csvwriter.writerows(keep_rows)
+        # Read the numeric rows within the specified range. The instrument
+        # header is detected once and the numeric block is parsed in bulk.
+        _, keep_rows = read_csv_rows(file_path, range_min, range_max)
+
+        _write_csv_rows(file_path, keep_rows)
 
         # The file should now fit the format for OpenSpecy processing
         filename = os.path.basename(file_path)
@@ -107,7 +73,23 @@ def process_csv(file_path, range_min, range_max):
     return file_path
 
 
-def process_csv_folder(folder_path, range_min, range_max):
+def _write_csv_rows(file_path, keep_rows):
+    """
+    Overwrites a .csv file with the ``'wavenumber'`` and ``'intensity'``
+    header and the kept rows.
+    """
+    # Use the csv.writer object to overwrite the .csv file
+    with open(file_path, "w", newline="") as csvfile:
+        csvwriter = csv.writer(csvfile)
+
+        # Write the specified column names to the first row
+        csvwriter.writerow(["wavenumber", "intensity"])
+
+        # Write the "floatable" rows to the .csv file
+        csvwriter.writerows(keep_rows)
+
+
+def process_csv_folder(folder_path, range_min, range_max, tracer = None, max_workers = None, stats = None):
     """
     Processes a batch of .csv files in the given folder by calling
     `process_csv`, then zips the processed files to send to OpenSpecy.
@@ -125,6 +107,18 @@ def process_csv_folder(folder_path, range_min, range_max):
     range_max : int
         The maximum wavenumber of the desired spectral range. Note that this
         value can be less than the actual maximum if cropping is desired.
+    tracer : Tracer
+        Optional. Records the time taken to process and to zip the files (see
+        ``openspi.trace``).
+    max_workers : int
+        Optional. The number of files read and rewritten at the same time by a
+        pool of threads, which hides the latency of network shares. The files
+        are still cleaned one at a time, in order. If None, each file is read,
+        cleaned and rewritten before the next one is read.
+    stats : IngestStats
+        Optional. Records the read and parse time of each file when
+        ``max_workers`` is specified. The summary is also added to the
+        tracer's ``'process_csv'`` span.
 
     Returns
     -------
@@ -135,20 +129,80 @@ def process_csv_folder(folder_path, range_min, range_max):
 
     """
 
-    try:
-        for filename in os.listdir(folder_path):
-            file_path = os.path.join(folder_path, filename)
-            process_csv(file_path, range_min, range_max)
+    tracer = as_tracer(tracer)
+    file_names = os.listdir(folder_path)
 
-    except Exception as e:
-        print(f'An error occurred: {str(e)}')
+    with tracer.span("process_csv", n_spectra = len(file_names)) as span:
+        try:
+            if max_workers is None:
+                for filename in file_names:
+                    file_path = os.path.join(folder_path, filename)
+                    process_csv(file_path, range_min, range_max)
+            else:
+                _process_csv_concurrent(folder_path, range_min, range_max, max_workers, stats if stats is not None else IngestStats(), span)
+
+        except Exception as e:
+            print(f'An error occurred: {str(e)}')
 
-    zipped_file_path = shutil.make_archive(folder_path, format='zip', root_dir=folder_path)
+    with tracer.span("zip", n_spectra = len(file_names)):
+        zipped_file_path = shutil.make_archive(folder_path, format='zip', root_dir=folder_path)
     print("Files compressed to",zipped_file_path)
 
     return zipped_file_path
 
 
+def _process_csv_concurrent(folder_path, range_min, range_max, max_workers, stats, span):
+    """
+    Rewrites the .csv files of a folder as ``process_csv`` does, reading and
+    writing them with a pool of threads (see ``process_csv_folder``).
+    """
+    _check_range(range_min, range_max)
+    file_paths = [os.path.join(folder_path, name) for name in list_csv_files(folder_path)]
+
+    rows = read_files(
+        file_paths,
+        lambda lines: _csv_rows_from_lines(lines, range_min, range_max)[1],
+        max_workers,
+        stats,
+    )
+    with ThreadPoolExecutor(max_workers = max_workers) as pool:
+        writes = [
+            pool.submit(_write_csv_rows, file_paths[i], keep_rows)
+            for i, keep_rows in enumerate(rows)
+        ]
+        for file_path, write in zip(file_paths, writes):
+            write.result()
+            print(f"Processed file: {os.path.basename(file_path)}")
+
+    span["io"] = stats.summary()
+    print(stats)
+
+
+def _cache_params(range_min, range_max, adj_intens, adj_intens_type, subtract_baseline, top_n, backend, library_version, columns = None, library_filter = None):
+    """
+    Collects the parameters that make up a ``ResultCache`` key, apart from the
+    spectrum itself.
+    """
+    params = {
+        "range_min": range_min,
+        "range_max": range_max,
+        "adj_intens": bool(adj_intens),
+        "adj_intens_type": adj_intens_type,
+        "subtr_baseline": bool(subtract_baseline),
+        "top_n": int(top_n),
+        "backend": backend,
+        "library_version": library_version,
+    }
+    # Projected matches are cached apart from the full ones
+    if columns is not None:
+        params["columns"] = list(columns)
+    # As are matches against a sub-library
+    if library_filter is not None:
+        params["library_filter"] = filter_key(library_filter)
+
+    return params
+
+
 def r_script(
         file_path,
         range_min,
@@ -156,7 +210,14 @@ def r_script(
         adj_intens: bool = False,
         adj_intens_type: str = 'none',
         subtract_baseline: bool = False,
-        top_n: int = 5):
+        top_n: int = 5,
+        session = None,
+        matcher: str = 'r',
+        cache = None,
+        tracer = None,
+        library_name = None,
+        columns = None,
+        library_filter = None):
     """
     Processes spectra through the OpenSpecy R package and returns a dataframe
     with the library matches and other data
@@ -164,8 +225,9 @@ def r_script(
 
     Parameters
     ----------
-    file_path : str
-        Path to the zipped folder containing the processed .csv files OR the path to a single .csv file.
+    file_path : str or SpectralStore
+        Path to the zipped folder containing the processed .csv files OR the path to a single .csv file
+        OR a ``SpectralStore`` (or the path to one), whose spectra are sent to R from memory.
     range_min : int
         The minimum wavenumber of the desired spectral range. Note that this
         value can be greater than the actual minimum if cropping is desired.
@@ -180,10 +242,50 @@ def r_script(
         the OpenSpecy package.
     adj_intens_type : str
         The type of intensity adjustment to be made. Options are 'none',
-        'transmittance', or 'absorbance'
+        'transmittance', or 'reflectance'
     subtract_baseline : bool
         If True, the function will subtract the baseline from the spectra using
         IModPolyFit from the OpenSpecy package.
+    session : OpenSpecySession
+        Optional. The R session to use. If not specified, a shared session is
+        started on the first call and reused afterwards, so the OpenSpecy
+        package and library are only loaded once per process.
+    matcher : str
+        The backend used to match the processed spectra against the library.
+        Options are 'r' (default), which uses OpenSpecy's ``match_spec``, or
+        'native', which uses ``openspi.matching.SpectralLibrary`` (Pearson
+        correlation as a single matrix multiply in NumPy).
+    cache : ResultCache
+        Optional. A cache of previous matches (see ``openspi.cache``). If
+        specified, the spectra are read in Python and only the spectra that
+        are not in the cache are sent to R. If every spectrum is cached, R is
+        not used at all.
+    tracer : Tracer
+        Optional. Records the time taken by each step (library load, read,
+        conform, process, match and conversion to pandas), with the number of
+        spectra and the throughput (see ``openspi.trace``).
+    library_name : str
+        Optional. The name of the reference library to match against, one of
+        ``openspi.session.LIBRARIES`` (e.g. 'derivative/ftir', 'raw/raman',
+        or an in-house library added with ``register_library``). Each library
+        is loaded once per session and kept, so switching between libraries
+        does not reload them. Default is the session's default library
+        ('derivative/ftir').
+    columns : list
+        Optional. The match columns to return, e.g. ``SUMMARY_COLUMNS`` for
+        only those ``sort_export`` needs for its summary sheets. Only these
+        columns are converted from R, which saves time and memory on large
+        batches. If None, every column is returned, including the library
+        metadata.
+    library_filter : dict or str
+        Optional. Only match against the library spectra kept by this
+        metadata filter: a dict of metadata column -> value (or list of
+        values), e.g. ``{"plastic_or_not": "plastic"}`` or
+        ``{"material_class": ["polyesters", "polyamides (polylactams)"]}``, or
+        the name of one of ``openspi.library_index.LIBRARY_FILTERS`` (e.g.
+        'polymers'). The rows are picked from masks precomputed over the
+        library metadata (see ``openspi.library_index.LibraryIndex``), and each
+        sub-library is built once per session and kept.
     Returns
     -------
     df_top_matches : dataframe
@@ -191,95 +293,262 @@ def r_script(
 
     """
 
-    # Reformat the folder path to have \\ instead of \
-    file_path = reformat_path(file_path)
-
-    # Send the folder_path Python variable to an R variable
-    ro.globalenv["file_path"] = file_path
-    ro.globalenv["range_min"] = range_min
-    ro.globalenv["range_max"] = range_max
-    ro.globalenv["py_top_n"] = top_n
-    ro.globalenv["py_adj_intens"] = adj_intens
-    ro.globalenv["py_adj_intens_type"] = adj_intens_type
-    ro.globalenv["py_subtr_baseline"] = subtract_baseline
-
-
-    print("Executing R script...")
-
-    # Call R and execute the following script
-    ro.r(
-        """
-
-    library(OpenSpecy)
-    library(data.table)
-    library(tools)
-
-    # Load library into global environment
-    spec_lib <- load_lib("derivative")
-
-    # Filter the library to only include FTIR spectra
-    ftir_lib <- filter_spec(spec_lib, spec_lib$metadata$spectrum_type=="ftir")
-
-    # Read the files in the folder, and conform the range of the spectra to
-    # match the range of the library
-    files <- read_any(file_path)
-
-    if (file_ext(file_path) == 'csv') {
-      files <- conform_spec(files, range = ftir_lib$wavenumber, res = NULL)
-      }
-
-    if (file_ext(file_path) == 'zip') {
-      files <- c_spec(files, range = ftir_lib$wavenumber, res = NULL)
-      }
-
-    # 'Monolithic' file processing function, see
-    #  https://rawcdn.githack.com/wincowgerDEV/OpenSpecy-package/c253d6c3298c7db56fbfdceee6ff0e654a1431cd/reference/process_spec.html
-    files_processed <- process_spec(
-      files,
-      active = TRUE,
-      adj_intens = py_adj_intens,
-      adj_intens_args = list(type = py_adj_intens_type),
-      conform_spec = FALSE,
-      conform_spec_args = list(range = ftir_lib$wavenumber, res = NULL, type = "interp"),
-      restrict_range = TRUE,
-      restrict_range_args = list(min = range_min, max = range_max),
-      flatten_range = FALSE,
-      flatten_range_args = list(min = 2200, max = 2420),
-      subtr_baseline = py_subtr_baseline,
-      subtr_baseline_args = list(type = "polynomial", degree = 8, raw = FALSE, baseline =
-                                   NULL),
-      smooth_intens = TRUE,
-      smooth_intens_args = list(polynomial = 3, window = 11, derivative = 1, abs = TRUE),
-      make_rel = TRUE,
-      make_rel_args = list(na.rm = TRUE)
-    )
+    store = as_store(file_path)
+
+    if store is not None:
+        groups = [store.read(range_min, range_max)]
+
+    elif cache is not None:
+        # Read the spectra in Python so unchanged spectra can be found in the
+        # cache before anything is sent to R
+        if file_path.endswith(".zip"):
+            spectra = read_spectra_zip(file_path, range_min, range_max)
+        else:
+            wavenumber, intensity = read_spectrum(file_path, range_min, range_max)
+            spectra = {os.path.basename(file_path): (wavenumber, intensity)}
+        groups = group_by_axis(spectra)
+
+    else:
+        if session is None:
+            with as_tracer(tracer).span("library_load"):
+                session = get_session()
+
+        return session.match_file(
+            file_path,
+            range_min,
+            range_max,
+            adj_intens,
+            adj_intens_type,
+            subtract_baseline,
+            top_n,
+            matcher,
+            tracer,
+            library_name,
+            columns,
+            library_filter,
+        )
+
+    def match_function(wavenumber, intensities, file_names):
+        return r_script_in_memory(wavenumber, intensities, file_names, range_min, range_max, adj_intens, adj_intens_type, subtract_baseline, top_n, session = session, matcher = matcher, tracer = tracer, library_name = library_name, columns = columns, library_filter = library_filter)
+
+    if cache is not None:
+        params = _cache_params(range_min, range_max, adj_intens, adj_intens_type, subtract_baseline, top_n, "r/" + matcher, _library_id(session, library_name), columns, library_filter)
+        frames = [
+            cache.match(wavenumber, intensities, file_names, params, match_function)
+            for wavenumber, intensities, file_names in groups
+        ]
+    else:
+        frames = [
+            match_function(wavenumber, intensities, file_names)
+            for wavenumber, intensities, file_names in groups
+        ]
+
+    return pd.concat(frames, ignore_index=True)
+
 
+def r_script_in_memory(
+        wavenumber,
+        intensities,
+        file_names,
+        range_min,
+        range_max,
+        adj_intens: bool = False,
+        adj_intens_type: str = 'none',
+        subtract_baseline: bool = False,
+        top_n: int = 5,
+        session = None,
+        matcher: str = 'r',
+        tracer = None,
+        library_name = None,
+        columns = None,
+        library_filter = None):
+    """
+    Processes spectra held in memory through the OpenSpecy R package and
+    returns a dataframe with the library matches and other data. Unlike
+    ``r_script``, nothing is written to disk: the arrays are sent to R as a
+    numeric matrix and an OpenSpecy object is built from them directly.
 
-    # Compare the processed spectra to those in the library and identify the
-    # top 5 matches for each spectrum
-    top_matches <- match_spec(files_processed, library = ftir_lib, na.rm = T, top_n = py_top_n,
-                             add_library_metadata = "sample_name",
-                             add_object_metadata = "col_id")
+    Parameters
+    ----------
+    wavenumber : numpy.ndarray
+        The wavenumber axis shared by all of the spectra.
+    intensities : numpy.ndarray
+        A (n_files, n_points) array of intensities, one row per spectrum (see
+        ``read_spectra_folder``). A 1-D array is treated as a single spectrum.
+    file_names : list
+        The file name of each spectrum. These are reported in the
+        ``'file_name.y'`` column, as with ``r_script``.
+    range_min : int
+        The minimum wavenumber of the desired spectral range. Note that this
+        value can be greater than the actual minimum if cropping is desired.
+    range_max : int
+        The maximum wavenumber of the desired spectral range. Note that this
+        value can be less than the actual maximum if cropping is desired.
+
+    See ``r_script`` for the remaining parameters.
 
-    # Remove all empty columns from the dataframe
-    top_matches_trimmed <- top_matches[, !sapply(top_matches, OpenSpecy::is_empty_vector), with = F]
+    Returns
+    -------
+    df_top_matches : dataframe
+        A Pandas dataframe containing the library match data for the files.
 
     """
+
+    if session is None:
+        with as_tracer(tracer).span("library_load"):
+            session = get_session()
+
+    return session.match_arrays(
+        wavenumber,
+        intensities,
+        file_names,
+        range_min,
+        range_max,
+        adj_intens,
+        adj_intens_type,
+        subtract_baseline,
+        top_n,
+        matcher,
+        tracer,
+        library_name,
+        columns,
+        library_filter,
     )
 
-    print("Script execution complete.")
 
-    # Send R dataframe to Python dataframe
-    pandas2ri.activate()
-    df_top_matches = pandas2ri.rpy2py(ro.r["top_matches_trimmed"])
+def match_native(
+        wavenumber,
+        intensities,
+        file_names,
+        range_min,
+        range_max,
+        adj_intens: bool = False,
+        adj_intens_type: str = 'none',
+        subtract_baseline: bool = False,
+        top_n: int = 5,
+        library = None,
+        search: str = 'exhaustive',
+        tracer = None,
+        memory_limit_mb = None,
+        threads = None,
+        columns = None,
+        library_filter = None):
+    """
+    Processes and matches spectra held in memory without R, using the NumPy
+    versions of OpenSpecy's ``process_spec`` (see
+    ``openspi.preprocess.process_spectra``) and ``match_spec`` (see
+    ``openspi.matching.SpectralLibrary``). The whole batch is processed and
+    matched as 2-D arrays.
+
+    Parameters
+    ----------
+    wavenumber : numpy.ndarray
+        The wavenumber axis shared by all of the spectra.
+    intensities : numpy.ndarray
+        A (n_files, n_points) array of intensities, one row per spectrum (see
+        ``read_spectra_folder``).
+    file_names : list
+        The file name of each spectrum.
+    range_min : int
+        The minimum wavenumber of the desired spectral range. Note that this
+        value can be greater than the actual minimum if cropping is desired.
+    range_max : int
+        The maximum wavenumber of the desired spectral range. Note that this
+        value can be less than the actual maximum if cropping is desired.
+    adj_intens : bool
+        If True, the function will adjust the intensity of the spectra.
+    adj_intens_type : str
+        The type of intensity adjustment to be made. Options are 'none',
+        'transmittance', or 'reflectance'
+    subtract_baseline : bool
+        If True, the function will subtract the baseline from the spectra using
+        I-ModPolyFit.
+    top_n : int
+        The top *n* highest matches desired.
+    library : SpectralLibrary
+        Optional. The library to match against (e.g. loaded with
+        ``SpectralLibrary.load``). If not specified, the library of the shared
+        R session is used, which starts R once to copy it.
+    search : str
+        'exhaustive' (default) or 'cascade'. With 'cascade', candidates are
+        screened on block-averaged spectra and only a shortlist is scored at
+        full resolution (see ``SpectralLibrary.cascade_search``), which is
+        faster for large libraries.
+    tracer : Tracer
+        Optional. Records the time taken to process and to match the spectra
+        (see ``openspi.trace``).
+    memory_limit_mb : float
+        Optional. The memory allowed for match scores, in megabytes. The
+        scores are computed in tiles that fit in it and only the top *n* of
+        each spectrum are kept (see ``SpectralLibrary.blocked_search``), so
+        the full (n_files, n_library) score matrix is never held.
+    threads : int
+        Optional. The number of BLAS threads used for matching. Requires the
+        ``threadpoolctl`` package.
+    columns : list
+        Optional. The match columns to return (see ``r_script``).
+    library_filter : dict or str
+        Optional. Only match against the library spectra kept by this
+        metadata filter (see ``r_script`` and ``SpectralLibrary.select``).
+
+    Returns
+    -------
+    df_top_matches : dataframe
+        A Pandas dataframe containing the library match data for the files.
+
+    """
+
+    tracer = as_tracer(tracer)
+
+    if library is None:
+        with tracer.span("library_load"):
+            library = get_session().native_library
+
+    if library_filter is not None:
+        library = library.select(library_filter)
+
+    if isinstance(file_names, str):
+        file_names = [file_names]
+
+    with tracer.span("process", n_spectra = len(file_names), processor = "native"):
+        processed_wavenumber, processed = process_spectra(
+            wavenumber,
+            intensities,
+            library.wavenumber,
+            range_min,
+            range_max,
+            adj_intens,
+            adj_intens_type,
+            subtract_baseline,
+        )
+
+    with tracer.span("match", n_spectra = len(file_names), matcher = "native", search = search):
+        df_top_matches = library.match(processed_wavenumber, processed, file_names, top_n, search = search, memory_limit_mb = memory_limit_mb, threads = threads)
+
+    if columns is not None:
+        df_top_matches = df_top_matches[[column for column in columns if column in df_top_matches]]
 
     return df_top_matches
 
 
-def sort_export(df, excel_path, top_n, nrel = False):
+# The match columns that sort_export ranks and summarizes. Pass these as
+# ``columns`` to convert only what the summary sheets need.
+SUMMARY_COLUMNS = ["file_name.y", "spectrum_identity", "material_class", "match_val", "sn", "plastic_or_not"]
+
+# The sheets written to the workbook by sort_export for each excel_sheets
+# option
+EXCEL_SHEETS = {
+    'all': ["Source Data", "Summary", "Updated Summary", "Subsequent Matches", "Matches Checked"],
+    'summary': ["Summary", "Matches Checked"],
+    'none': [],
+}
+
+
+def sort_export(df, excel_path, top_n, nrel = False, tracer = None, table_format = None, excel_sheets = 'all'):
     """
     Sorts the dataframe exported from the R script and rearranges it into a
-    more presentable format. Exports an Excel file.
+    more presentable format. Exports an Excel file and, optionally, Parquet or
+    Arrow files of the same tables.
 
     Parameters
     ----------
@@ -289,10 +558,26 @@ def sort_export(df, excel_path, top_n, nrel = False):
         The full path to an .xlsx file.
     top_n : int
         The number of top matches for each file. Equal to `top_n` in
-        `openspi_main`. Default is 5.
+        `openspi_main`. Default is 5. The matches are grouped by file name, so
+        files with fewer matches are handled correctly; ``top_n`` is only used
+        for the "First Well" row when ``nrel`` is True.
     nrel : Bool
         Adds an extra row regarding first well information to the "Matches
         Checked sheet."
+    tracer : Tracer
+        Optional. Records the time taken to rank the matches and to write the
+        workbook (see ``openspi.trace``).
+    table_format : str
+        Optional. 'parquet' or 'arrow' to also write every table (Source Data,
+        Summary, Updated Summary, Subsequent Matches and Matches Checked) as a
+        columnar file next to the workbook, named after it (e.g.
+        ``TopMatches_source_data.parquet``; see ``openspi.utils.save_tables``).
+        These have no row limit and are much faster to write and read than
+        Excel. Requires the optional ``pyarrow`` package.
+    excel_sheets : str
+        The sheets written to the workbook: 'all' (default), 'summary' (only
+        the small Summary and Matches Checked sheets), or 'none' (no workbook,
+        only the ``table_format`` files).
 
 
     Returns
@@ -301,71 +586,421 @@ def sort_export(df, excel_path, top_n, nrel = False):
 
     """
 
-    # Sort the dataframe by file name and save to Excel
-    df = df.sort_values(by=["file_name.y"], ascending=True)
-    save_df_to_excel(excel_path, df, "Source Data")
+    tracer = as_tracer(tracer)
+    export_outputs(excel_path, table_format, excel_sheets)
 
-    # Copy the following columns into a new dataframe
-    df_truncated = df[
-        [
-            "file_name.y",
-            "spectrum_identity",
-            "material_class",
-            "match_val",
-            "sn",
-            "plastic_or_not",
-        ]
-    ]
-
-    # Initialize lists (these will be nested lists which will be converted to
-    # dataframes)
-    df_full_list = []
-    df_summary_list = []
-    df_updated_summary_list = []
-
-    # Cut df into subsets of n (so the df corresponds to the matches for one
-    # file at a time)
-    for start_row in range(0, len(df_truncated), top_n):
-        end_row = start_row + top_n
-        subset_df = df_truncated.iloc[start_row:end_row]
-
-        # Sort the df by the 'match_val' column in descending order
-        subset_df = subset_df.sort_values(by=["match_val"], ascending=False)
-
-        # Check each dataframe for its subsequent matches
-        df_updated_summary_list = subsequent_matches_checked(
-            subset_df, df_updated_summary_list
+    n_spectra = df["file_name.y"].nunique()
+
+    with tracer.span("rank_matches", n_spectra = n_spectra):
+        # Sort the dataframe by file name
+        df = df.sort_values(by=["file_name.y"], ascending=True)
+
+        # Copy the following columns into a new dataframe, with the triage
+        # label of each spectrum if they were triaged
+        df_truncated = df[SUMMARY_COLUMNS + (["triage"] if "triage" in df else [])]
+
+        # Rank the matches of every file and build the summary tables
+        df_summary, df_updated_summary, df_subseq = rank_matches(df_truncated)
+
+        # Count the matches for the notes sheet from the dataframes in memory
+        df_matches_checked = matches_checked_df(df_summary, df_updated_summary, df_subseq, nrel = nrel, n = top_n)
+
+    print(df_matches_checked)
+
+    tables = {
+        "Source Data": df,
+        "Summary": df_summary,
+        "Updated Summary": df_updated_summary,
+        "Subsequent Matches": df_subseq,
+        "Matches Checked": df_matches_checked,
+    }
+
+    if table_format is not None:
+        with tracer.span("write_tables", n_spectra = n_spectra, table_format = table_format):
+            paths = save_tables(os.path.splitext(excel_path)[0], tables, table_format)
+        print("Tables saved to " + ", ".join(paths.values()))
+
+    if excel_sheets != 'none':
+        # Save the sheets to the Excel workbook in a single pass
+        with tracer.span("write_excel", n_spectra = n_spectra):
+            save_sheets_to_excel(
+                excel_path,
+                {name: tables[name] for name in EXCEL_SHEETS[excel_sheets]},
+            )
+
+        print("Workbook saved to " + excel_path)
+
+
+
+def export_outputs(excel_path, table_format = None, excel_sheets = 'all'):
+    """
+    Returns the paths of every file that ``sort_export`` writes for
+    ``excel_path``, raising a ValueError if the options are not valid.
+
+    Parameters
+    ----------
+    excel_path : str
+        The full path to an .xlsx file.
+    table_format : str
+        See ``sort_export``.
+    excel_sheets : str
+        See ``sort_export``.
+
+    Returns
+    -------
+    paths : list
+        The workbook (unless ``excel_sheets`` is 'none') and the columnar
+        files (if ``table_format`` is specified).
+
+    """
+    if excel_sheets not in EXCEL_SHEETS:
+        raise ValueError(f"Unknown excel_sheets: {excel_sheets}. Options are 'all', 'summary', or 'none'.")
+    if excel_sheets == 'none' and table_format is None:
+        raise ValueError("Nothing to export. Set table_format when excel_sheets is 'none'.")
+
+    paths = [] if excel_sheets == 'none' else [excel_path]
+    if table_format is not None:
+        paths += list(table_paths(os.path.splitext(excel_path)[0], EXCEL_SHEETS['all'], table_format).values())
+
+    return paths
+
+
+def export_path(source_path, export_xlsx = None, export_dir = None, nrel_version = False):
+    """
+    Determines the full path of the .xlsx file exported by ``openspi_main``,
+    creating ``export_dir`` if it does not exist.
+
+    Parameters
+    ----------
+    source_path : str or SpectralStore
+        The folder, .csv file or spectral store being matched.
+    export_xlsx : str
+        Optional. The name of the .xlsx file. '.xlsx' is added if missing. If
+        not specified, the file is named after the source (or with
+        ``nrel_autoname`` when ``nrel_version`` is True).
+    export_dir : str
+        Optional. The folder to save the file in. If not specified, the parent
+        directory of the source is used.
+    nrel_version : bool
+        If True, folders are named with ``nrel_autoname``.
+
+    Returns
+    -------
+    target_file_path : str
+        The full path to the .xlsx file.
+
+    """
+    # If the source is a spectral store, name the export after its folder
+    store = as_store(source_path)
+    if store is not None:
+        source_path = store.path
+
+    # If export_xlsx is specified, check that it includes '.xlsx'
+    if not export_xlsx == None:
+        if not '.xlsx' in export_xlsx:
+            export_xlsx = export_xlsx + '.xlsx'
+    else:
+        # Check if source_path is a folder or a file, and determine the export
+        # name accordingly
+        if os.path.isdir(source_path):
+
+            # Generate a name based on the source_path
+            if not nrel_version == True or store is not None:
+                export_xlsx = os.path.basename(source_path) + '.xlsx'
+
+            else:
+                # If nrel_version is True, use the nrel_autoname function to generate a name
+                export_xlsx = nrel_autoname(source_path)
+
+        else:
+            # If the source_path is a file, use the file name to generate the export name
+            export_xlsx = 'TopMatches' + os.path.basename(source_path).replace('.csv', '.xlsx')
+
+    # If export_dir is specified, check if it exists. If not, create it.
+    if not export_dir == None:
+        if not os.path.exists(export_dir):
+            os.makedirs(export_dir)
+            print(f"Directory {export_dir} created.")
+
+    # If export_dir is not specified, save the file in the same directory as source_path
+    else:
+        export_dir = os.path.dirname(source_path)
+
+    return os.path.join(export_dir, export_xlsx)
+
+
+def _library_id(session, library_name):
+    """
+    Returns the version of the library that ``session`` matches against for
+    ``library_name`` (see ``OpenSpecySession.library_version``), starting the
+    shared session if ``session`` is None.
+    """
+    if session is None:
+        session = get_session()
+
+    return session.library_version(library_name)
+
+
+def _check_source(source_path, nrel_version):
+    """
+    Checks that the source can be matched, raising a ValueError if not, and
+    returns it as a ``SpectralStore`` if it is one (None otherwise).
+    """
+    store = as_store(source_path)
+    if store is not None:
+        if len(store) == 0:
+            raise ValueError("No spectra detected in the store.")
+
+    # Check if the source_path is a folder or a file
+    elif os.path.isdir(source_path):
+
+        if nrel_version == True:
+            nrel_delete_sp(source_path)
+
+        # Every file in the folder must be a .csv file
+        if not list_csv_files(source_path):
+            raise ValueError("No files detected.")
+
+    elif not os.path.isfile(source_path):
+        raise ValueError(f"Source not found: {source_path}")
+
+    elif not source_path.endswith(".csv"):
+        raise ValueError(
+            f"Incompatible file format detected: {os.path.basename(source_path)}\nOnly .csv files are accepted."
         )
 
-        # For each subset, replace the rows in the file_name column with '-'
-        # (done for legibility purposes)
-        for x in range(len(subset_df)):
-            if x != 0:
-                subset_df.iat[x, 0] = "-"
-            row = subset_df.iloc[x]
-            row = row.tolist()
-            df_full_list.append(row)
-            if x == 0:
-                # Add the first row of each subset_df to a list
-                df_summary_list.append(row)
-
-    # Get column names for list to df conversion
-    column_names = list(df_truncated.columns)
-
-    # Add column for the notes added to the updated summary sheet
-    updated_column_names = column_names + ["matches_checked"]
-
-    # Send each nested list to a dataframe and then save as an Excel sheet in
-    # the previously-specified workbook
-    list_to_df_to_sheet(df_summary_list, column_names, excel_path, "Summary")
-    list_to_df_to_sheet(
-        df_updated_summary_list, updated_column_names, excel_path, "Updated Summary"
-    )
-    list_to_df_to_sheet(df_full_list, column_names, excel_path, "Subsequent Matches")
+    return store
+
+
+def _native_library(processor, library, session, library_name, tracer):
+    """
+    Returns the library used when ``processor`` is 'native', loading it from
+    the session if it is not given (None for other processors).
+    """
+    if processor != 'native':
+        return None
+    if library is None:
+        with tracer.span("library_load"):
+            library = (session or get_session()).get_native_library(library_name)
+    return library
+
+
+def _array_match_function(range_min, range_max, adj_intens, adj_intens_type, subtr_baseline, top_n, session, matcher, processor, library, search, tracer, memory_limit_mb = None, threads = None, library_name = None, columns = None, triage = False, library_filter = None):
+    """
+    Returns the function that processes and matches spectra already read into
+    arrays (with ``match_native`` or ``r_script_in_memory``, after
+    ``triage_spectra`` if ``triage`` is set), and the parameters that identify
+    its results in a ``ResultCache``.
+    """
+    if processor == 'native':
+        library = _native_library(processor, library, session, library_name, tracer)
+
+        if library_filter is not None:
+            library = library.select(library_filter)
+
+        def match_function(wavenumber, intensities, file_names):
+            return match_native(wavenumber, intensities, file_names, range_min, range_max, adj_intens, adj_intens_type, subtr_baseline, top_n, library = library, search = search, tracer = tracer, memory_limit_mb = memory_limit_mb, threads = threads, columns = columns)
+
+        params = _cache_params(range_min, range_max, adj_intens, adj_intens_type, subtr_baseline, top_n, "native/" + search, library.version, columns)
+    else:
+        # Send the arrays straight to R
+        def match_function(wavenumber, intensities, file_names):
+            return r_script_in_memory(wavenumber, intensities, file_names, range_min, range_max, adj_intens, adj_intens_type, subtr_baseline, top_n, session = session, matcher = matcher, tracer = tracer, library_name = library_name, columns = columns, library_filter = library_filter)
+
+        params = _cache_params(range_min, range_max, adj_intens, adj_intens_type, subtr_baseline, top_n, "r/" + matcher, _library_id(session, library_name), columns, library_filter)
+
+    thresholds = triage_thresholds(triage)
+    if thresholds is not None:
+        match_function = triage_match_function(match_function, thresholds, tracer)
+        params["triage"] = thresholds
+
+    return match_function, params
+
+
+def iter_matches(
+        source_path,
+        range_min,
+        range_max,
+        chunk_size = 1000,
+        nrel_version = False,
+        adj_intens = False,
+        adj_intens_type = 'none',
+        subtr_baseline = False,
+        top_n = 5,
+        session = None,
+        matcher = 'r',
+        processor = 'r',
+        library = None,
+        cache = None,
+        search = 'exhaustive',
+        tracer = None,
+        memory_limit_mb = None,
+        threads = None,
+        library_name = None,
+        io_workers = None,
+        columns = None,
+        triage = False,
+        library_filter = None):
+    """
+    Reads, processes and matches the spectra of a folder, a single .csv file
+    or a spectral store in chunks of ``chunk_size`` spectra, yielding the top
+    matches of each chunk as soon as it is done. Only one chunk of spectra
+    (and its processed copies and scores) is in memory at a time, so the peak
+    memory depends on ``chunk_size`` and not on the number of spectra. The
+    source files are not modified.
 
-    # Add a notes sheet to the Excel workbook
-    matches_checked_sheet(excel_path, nrel = nrel, n = top_n)
+    Parameters
+    ----------
+    source_path : str or SpectralStore
+        The folder, .csv file or spectral store to match.
+    range_min : int
+        The minimum wavenumber of the desired spectral range.
+    range_max : int
+        The maximum wavenumber of the desired spectral range.
+    chunk_size : int
+        The number of spectra read, processed and matched at a time.
 
+    See ``openspi_main`` for the other parameters.
+
+    Yields
+    ------
+    df_top_matches : dataframe
+        The library match data for the spectra of one chunk. The frames can be
+        appended to a file as they arrive, or concatenated.
+
+    """
+    tracer = as_tracer(tracer)
+    _check_range(range_min, range_max)
+    if chunk_size < 1:
+        raise ValueError(f"chunk_size must be at least 1, got {chunk_size}.")
+
+    store = _check_source(source_path, nrel_version)
+
+    # Files on other wavenumber axes are resampled onto the library's
+    library = _native_library(processor, library, session, library_name, tracer)
+    target_wavenumber = library.wavenumber if library is not None else None
+
+    if store is not None:
+        chunks = store.iter_chunks(chunk_size, range_min, range_max)
+    elif os.path.isdir(source_path):
+        chunks = iter_spectra_folder(source_path, range_min, range_max, chunk_size, io_workers, None, target_wavenumber)
+    else:
+        wavenumber, intensities = read_spectrum(source_path, range_min, range_max)
+        chunks = [(wavenumber, intensities.reshape(1, -1), [os.path.basename(source_path)])]
+
+    match_function, params = _array_match_function(range_min, range_max, adj_intens, adj_intens_type, subtr_baseline, top_n, session, matcher, processor, library, search, tracer, memory_limit_mb, threads, library_name, columns, triage, library_filter)
+
+    n_done = 0
+    for wavenumber, intensities, file_names in chunks:
+        with tracer.span("chunk", n_spectra = len(file_names), first = n_done):
+            if cache is not None:
+                df_top_matches = cache.match(wavenumber, intensities, file_names, params, match_function)
+            else:
+                df_top_matches = match_function(wavenumber, intensities, file_names)
+
+        n_done += len(file_names)
+        print(f"Matched {n_done} spectra.")
+        yield df_top_matches
+
+
+def match_source(
+        source_path,
+        range_min,
+        range_max,
+        nrel_version = False,
+        adj_intens = False,
+        adj_intens_type = 'none',
+        subtr_baseline = False,
+        top_n = 5,
+        in_memory = False,
+        session = None,
+        matcher = 'r',
+        processor = 'r',
+        library = None,
+        cache = None,
+        search = 'exhaustive',
+        tracer = None,
+        chunk_size = None,
+        memory_limit_mb = None,
+        threads = None,
+        library_name = None,
+        io_workers = None,
+        columns = None,
+        triage = False,
+        library_filter = None):
+    """
+    Reads, processes and matches every spectrum of a folder, a single .csv
+    file or a spectral store, without exporting anything. This is the part of
+    ``openspi_main`` between choosing the export path and ``sort_export``;
+    unlike ``openspi_main`` it never prompts or exits, and raises a
+    ValueError for problems with the source (no files, files that are not
+    .csv, an invalid range).
+
+    See ``openspi_main`` for the parameters.
+
+    Returns
+    -------
+    df_top_matches : dataframe
+        A Pandas dataframe containing the library match data for the files.
+
+    """
+    tracer = as_tracer(tracer)
+
+    if chunk_size is not None:
+        # Only the top matches of each chunk are kept
+        return pd.concat(
+            list(iter_matches(source_path, range_min, range_max, chunk_size, nrel_version, adj_intens, adj_intens_type, subtr_baseline, top_n, session, matcher, processor, library, cache, search, tracer, memory_limit_mb, threads, library_name, io_workers, columns, triage, library_filter)),
+            ignore_index=True,
+        )
+
+    _check_range(range_min, range_max)
+    store = _check_source(source_path, nrel_version)
+
+    if in_memory == True or processor == 'native' or store is not None or triage_thresholds(triage) is not None:
+        # Files on other wavenumber axes are resampled onto the library's
+        library = _native_library(processor, library, session, library_name, tracer)
+        target_wavenumber = library.wavenumber if library is not None else None
+
+        # Read the spectra into arrays
+        with tracer.span("read") as span:
+            if store is not None:
+                wavenumber, intensities, file_names = store.read(range_min, range_max)
+            elif os.path.isdir(source_path):
+                stats = IngestStats()
+                wavenumber, intensities, file_names = read_spectra_folder(source_path, range_min, range_max, io_workers, stats, target_wavenumber)
+                span["io"] = stats.summary()
+            else:
+                wavenumber, intensities = read_spectrum(source_path, range_min, range_max)
+                file_names = [os.path.basename(source_path)]
+            span["n_spectra"] = len(file_names)
+
+        match_function, params = _array_match_function(range_min, range_max, adj_intens, adj_intens_type, subtr_baseline, top_n, session, matcher, processor, library, search, tracer, memory_limit_mb, threads, library_name, columns, triage, library_filter)
+
+        if cache is not None:
+            df_top_matches = cache.match(wavenumber, intensities, file_names, params, match_function)
+        else:
+            df_top_matches = match_function(wavenumber, intensities, file_names)
+
+    else:
+        if os.path.isdir(source_path):
+
+            # If the folder contains multiple files, process them all and create a zip folder
+            if count_files(source_path) > 1:
+                processed_path = process_csv_folder(source_path, range_min, range_max, tracer = tracer, max_workers = io_workers)
+
+            # If the folder contains only one file, determine its path process it.
+            elif count_files(source_path) == 1:
+                for filename in os.listdir(source_path):
+                    file_path = os.path.join(source_path, filename)
+                    processed_path = process_csv(file_path, range_min, range_max)
+
+        # If the source_path is a file, process it.
+        else:
+            processed_path = process_csv(source_path, range_min, range_max)
+
+        df_top_matches = r_script(processed_path, range_min, range_max, adj_intens, adj_intens_type, subtr_baseline, top_n, session = session, matcher = matcher, cache = cache, tracer = tracer, library_name = library_name, columns = columns, library_filter = library_filter)
+
+    return df_top_matches
 
 
 def openspi_main(
@@ -377,7 +1012,26 @@ def openspi_main(
         nrel_version = False,
         adj_intens = False,
         adj_intens_type = 'none',
-        subtr_baseline = False):
+        subtr_baseline = False,
+        in_memory = False,
+        session = None,
+        matcher = 'r',
+        processor = 'r',
+        library = None,
+        cache = None,
+        search = 'exhaustive',
+        tracer = None,
+        trace_path = None,
+        chunk_size = None,
+        memory_limit_mb = None,
+        threads = None,
+        library_name = None,
+        io_workers = None,
+        table_format = None,
+        excel_sheets = 'all',
+        columns = None,
+        triage = False,
+        library_filter = None):
     """
     A complete function for spectral pre-processing, processing through the
     OpenSpecy library in R, and configuring/processing the outputted data into
@@ -386,10 +1040,12 @@ def openspi_main(
 
     Parameters
     ----------
-    source_path : str
+    source_path : str or SpectralStore
         The complete path to the folder containing .csv files to be processed OR
         the path to a single .csv file. This function only accepts .csv files,
-        and any other file types will cause the function to stop.
+        and any other file types will cause the function to stop. A
+        ``SpectralStore`` (or the path to one) can also be given, in which case
+        the spectra are read from the store and no .csv files are parsed.
     range_min : int
         The minimum wavenumber of the desired spectral range. Note that this
         value can be greater than the actual minimum if cropping is desired.
@@ -418,10 +1074,92 @@ def openspi_main(
         the OpenSpecy package.
     adj_intens_type : str
         The type of intensity adjustment to be made. Options are 'none',
-        'transmittance', or 'absorbance'
+        'transmittance', or 'reflectance'
     subtr_baseline : bool
         If True, the function will subtract the baseline from the spectra using
         IModPolyFit from the OpenSpecy package.
+    in_memory : bool
+        If True, the .csv files are read into memory and sent straight to R
+        (see ``r_script_in_memory``). The source files are left untouched and
+        no zipped folder is created. If False (default), the files are
+        rewritten in place and zipped before being read by OpenSpecy.
+    session : OpenSpecySession
+        Optional. The R session to use. If not specified, the shared session
+        is used (see ``r_script``).
+    matcher : str
+        The backend used to match the processed spectra against the library.
+        Options are 'r' (default) or 'native' (see ``r_script``).
+    processor : str
+        The backend used to process the spectra. Options are 'r' (default) or
+        'native'. With 'native', the spectra are read into memory, processed
+        and matched entirely in Python (see ``match_native``), and ``matcher``
+        is ignored. Files of a folder that are on different wavenumber axes
+        (e.g. from two instruments) are resampled onto the library's axis and
+        matched together (see ``openspi.preprocess.GridResampler``).
+    library : SpectralLibrary
+        Optional. The library used when ``processor`` is 'native'. If not
+        specified, the library of the R session is used.
+    cache : ResultCache
+        Optional. A cache of previous matches (see ``openspi.cache``). Spectra
+        whose data and parameters are unchanged since a previous run are taken
+        from the cache instead of being processed and matched again.
+    search : str
+        The library search used when ``processor`` is 'native', 'exhaustive'
+        (default) or 'cascade' (see ``match_native``).
+    tracer : Tracer
+        Optional. Records a timing span for each stage of the run (reading,
+        library load, process, match, ranking and Excel writing), with the
+        number of spectra and the throughput. Use its ``callback`` or
+        ``logger`` to report the spans as they finish (see ``openspi.trace``).
+    trace_path : str
+        Optional. The full path to a .json file to write the trace of the run
+        to. A tracer is created if ``tracer`` is not specified.
+    chunk_size : int
+        Optional. If specified, the spectra are read, processed and matched in
+        chunks of this many spectra and only the top matches of each chunk are
+        kept (see ``iter_matches``), so the memory used is bounded by the
+        chunk size instead of the number of spectra. The source files are not
+        modified, as with ``in_memory``.
+    memory_limit_mb : float
+        Optional. Used when ``processor`` is 'native'. The memory allowed for
+        match scores, in megabytes; the scores are computed in tiles and the
+        full score matrix is never held (see ``match_native``).
+    threads : int
+        Optional. Used when ``processor`` is 'native'. The number of BLAS
+        threads used for matching. Requires the ``threadpoolctl`` package.
+    library_name : str
+        Optional. The name of the reference library (see ``r_script``).
+        Ignored if ``library`` is specified.
+    io_workers : int
+        Optional. The number of .csv files of a folder read (and, unless
+        ``in_memory`` is True, rewritten) at the same time by a pool of
+        threads, which hides the latency of network shares. The read and
+        parse time of each file is summarized in the ``'io'`` entry of the
+        ``'read'`` or ``'process_csv'`` span of the trace.
+    table_format : str
+        Optional. 'parquet' or 'arrow' to also write the tables as columnar
+        files next to the .xlsx file (see ``sort_export``). Requires the
+        ``pyarrow`` package.
+    excel_sheets : str
+        The sheets written to the .xlsx file: 'all' (default), 'summary' (only
+        the Summary and Matches Checked sheets), or 'none' (no .xlsx file).
+    columns : list
+        Optional. The match columns to keep (see ``r_script``), e.g.
+        ``SUMMARY_COLUMNS``. The columns in ``SUMMARY_COLUMNS`` are always
+        kept. The Source Data sheet only has these columns.
+    triage : bool or dict
+        If True, the spectra are triaged right after they are read (see
+        ``openspi.triage.triage_spectra``): blank spectra (e.g. empty wells),
+        saturated spectra and dead spectra are reported straight away with
+        their triage label in a ``'triage'`` column and only the other
+        spectra are processed and matched. A dict overrides some of the
+        thresholds in ``TRIAGE_THRESHOLDS``. The spectra are read into memory
+        and the source files are not modified, as with ``in_memory``.
+        Default is False.
+    library_filter : dict or str
+        Optional. Only match against the library spectra kept by this
+        metadata filter, e.g. 'polymers' or ``{"plastic_or_not": "plastic"}``
+        (see ``r_script``).
 
     Returns
     -------
@@ -429,42 +1167,19 @@ def openspi_main(
 
     """
     top_n = 5
-    # If export_xlsx is specified, check that it includes '.xlsx'
-    if not export_xlsx == None:
-        if not '.xlsx' in export_xlsx:
-            export_xlsx = export_xlsx + '.xlsx'
-    else:
-        # Check if source_path is a folder or a file, and determine the export
-        # name accordingly
-        if os.path.isdir(source_path):
 
-            # Generate a name based on the source_path
-            if not nrel_version == True:
-                export_xlsx = os.path.basename(source_path) + '.xlsx'
-
-            else:
-                # If nrel_version is True, use the nrel_autoname function to generate a name
-                export_xlsx = nrel_autoname(source_path)
-
-        else:
-            # If the source_path is a file, use the file name to generate the export name
-            export_xlsx = 'TopMatches' + os.path.basename(source_path).replace('.csv', '.xlsx')
-
-    # If export_dir is specified, check if it exists. If not, create it.
-    if not export_dir == None:
-        if not os.path.exists(export_dir):
-            os.makedirs(export_dir)
-            print(f"Directory {export_dir} created.")
-
-    # If export_dir is not specified, save the file in the same directory as source_path
-    else:
-        export_dir = os.path.dirname(source_path)
-
-    target_file_path = os.path.join(export_dir, export_xlsx)
+    if columns is not None:
+        columns = list(dict.fromkeys(SUMMARY_COLUMNS + list(columns)))
 
+    target_file_path = export_path(source_path, export_xlsx, export_dir, nrel_version)
+    try:
+        outputs = export_outputs(target_file_path, table_format, excel_sheets)
+    except ValueError as e:
+        print(f"{str(e)}\nQuitting now.")
+        sys.exit()
 
     # Check if the target file already exists. If it does, ask the user if they want to overwrite.
-    if os.path.exists(target_file_path):
+    if any(os.path.exists(path) for path in outputs):
         print('File already exists. Please specify export_xlsx to change the name.\nIf you proceed, it will be overwritten.\nProceed? [y/n]')
         proceed = str(input())
         if proceed == 'y':
@@ -475,32 +1190,21 @@ def openspi_main(
             print('No valid input detected. Quitting now.')
             sys.exit()
 
-    # Check if the source_path is a folder or a file
-    if os.path.isdir(source_path):
+    if trace_path is not None and tracer is None:
+        tracer = Tracer()
+    tracer = as_tracer(tracer)
 
-        if nrel_version == True:
-            nrel_delete_sp(source_path)
-
-        # If the folder contains multiple files, process them all and create a zip folder
-        if count_files(source_path) > 1:
-            processed_path = process_csv_folder(source_path, range_min, range_max)
-
-        # If the folder contains only one file, determine its path process it.
-        elif count_files(source_path) == 1:
-            for filename in os.listdir(source_path):
-                file_path = os.path.join(source_path, filename)
-                processed_path = process_csv(file_path, range_min, range_max)
-
-        # If the folder contains no files, quit.
-        elif count_files(source_path) == 0:
-            print("No files detected. Quitting now.")
+    with tracer.span("openspi_main", source = getattr(source_path, "path", source_path)) as run_span:
+        try:
+            df_top_matches = match_source(source_path, range_min, range_max, nrel_version, adj_intens, adj_intens_type, subtr_baseline, top_n, in_memory, session, matcher, processor, library, cache, search, tracer, chunk_size, memory_limit_mb, threads, library_name, io_workers, columns, triage, library_filter)
+        except ValueError as e:
+            print(f"{str(e)}\nQuitting now.")
             sys.exit()
-    # If the source_path is a file, process it.
-    else:
-        processed_path = process_csv(source_path, range_min, range_max)
 
-    df_top_matches = r_script(processed_path, range_min, range_max, adj_intens, adj_intens_type, subtr_baseline, top_n)
-    sort_export(df_top_matches, target_file_path, 5, nrel = nrel_version)
+        sort_export(df_top_matches, target_file_path, 5, nrel = nrel_version, tracer = tracer, table_format = table_format, excel_sheets = excel_sheets)
 
+        run_span["n_spectra"] = df_top_matches["file_name.y"].nunique()
 
-    _xlsx_metadata(target_file_path)
\ No newline at end of file
+    if trace_path is not None:
+        tracer.dump(trace_path)
+        print("Trace saved to " + trace_path)
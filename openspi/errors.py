@@ -0,0 +1,53 @@
+class OpenSpiError(Exception):
+    """
+    Base class for the errors raised by openspi.
+    """
+
+
+class OutputExistsError(OpenSpiError):
+    """
+    Raised when the .xlsx file a run would write already exists and the
+    policy is to not overwrite it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        super().__init__(f"Output file already exists: {path}")
+
+
+class SourceError(OpenSpiError):
+    """
+    Raised when one source (a folder, .csv file or spectral store) of a batch
+    fails. The original exception is kept as ``cause`` (and as
+    ``__cause__``), so one failed folder can be reported without stopping the
+    rest of the batch.
+
+    Parameters
+    ----------
+    source_path : str
+        The source that failed.
+    stage : str
+        The step that failed: 'prepare' (reading the manifest entry and
+        choosing the output file), 'match' (reading, processing and matching
+        the spectra) or 'export' (writing the workbook).
+    cause : BaseException
+        The original exception.
+
+    """
+
+    def __init__(self, source_path, stage, cause):
+        self.source_path = source_path
+        self.stage = stage
+        self.cause = cause
+        super().__init__(f"{source_path} failed during {stage}: {type(cause).__name__}: {cause}")
+
+    def to_dict(self):
+        """
+        Returns the error as a JSON-serializable dict.
+        """
+        return {
+            "source_path": self.source_path,
+            "stage": self.stage,
+            "type": type(self.cause).__name__,
+            "message": str(self.cause),
+        }
@@ -0,0 +1,619 @@
+import os
+import csv
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .preprocess import get_resampler
+
+
+def _is_numeric_row(fields):
+    """
+    Checks if the first two fields of a .csv row can be read as numbers, which
+    is the rule ``process_csv`` has always used to decide which rows to keep.
+
+    Parameters
+    ----------
+    fields : list
+        A row as returned by ``csv.reader``.
+
+    Returns
+    -------
+    bool
+        ``True`` if the first and second fields are numbers, ``False`` if not.
+
+    """
+    try:
+        float(fields[0])
+        float(fields[1])
+    except (ValueError, IndexError):
+        return False
+    return True
+
+
+def _header_length(lines):
+    """
+    Finds the number of instrument header lines (e.g. ``Created as New
+    Dataset,`` and ``cm-1,ARB``) that come before the numeric block.
+
+    Parameters
+    ----------
+    lines : list
+        The lines of the .csv file.
+
+    Returns
+    -------
+    n : int
+        The index of the first numeric row.
+
+    """
+    n = 0
+    while n < len(lines) and not _is_numeric_row(next(csv.reader([lines[n]]), [])):
+        n += 1
+    return n
+
+
+def _parse_lines(lines, keep_rows=True):
+    """
+    Parses the lines of a spectrum .csv file into a float64 array, keeping the
+    raw text of every numeric row.
+
+    The instrument header is detected once and the numeric block below it is
+    loaded in bulk with ``numpy.loadtxt``. Files that do not have a clean
+    numeric block (blank lines, quoted fields, stray text rows, etc.) fall
+    back to the row-by-row rule used by ``process_csv``, so the rows kept are
+    always the same.
+
+    Parameters
+    ----------
+    lines : list
+        The lines of the .csv file, without line endings.
+    keep_rows : bool
+        If False, only the numeric data is returned and ``rows`` is None.
+
+    Returns
+    -------
+    data : numpy.ndarray
+        A (n, 2) float64 array of wavenumbers and intensities.
+    rows : list
+        The numeric rows as lists of strings (as returned by ``csv.reader``),
+        in the same order as ``data``. None if ``keep_rows`` is False.
+
+    """
+    block = lines[_header_length(lines):]
+
+    # Fast path: a single contiguous block of numbers
+    if block and '"' not in "".join(block):
+        try:
+            data = np.loadtxt(
+                block,
+                delimiter=",",
+                usecols=(0, 1),
+                dtype=np.float64,
+                comments=None,
+                ndmin=2,
+            )
+        except ValueError:
+            pass
+        else:
+            if len(data) == len(block):
+                if not keep_rows:
+                    return data, None
+                return data, [line.split(",") for line in block]
+
+    # Slow path: check each row individually
+    rows = [fields for fields in csv.reader(block) if _is_numeric_row(fields)]
+    data = np.array(
+        [[float(fields[0]), float(fields[1])] for fields in rows], dtype=np.float64
+    ).reshape(-1, 2)
+
+    return data, rows if keep_rows else None
+
+
+def _crop_mask(wavenumber, range_min, range_max):
+    """
+    Returns a boolean mask of the wavenumbers within [range_min, range_max].
+    """
+    return (wavenumber >= range_min) & (wavenumber <= range_max)
+
+
+def _check_range(range_min, range_max):
+    if range_max <= range_min:
+        raise ValueError(
+            f"Specified range is incompatible. range_min must be less than range_max.\nCurrent values:\nrange_min: {range_min}\nrange_max: {range_max}"
+        )
+
+
+def _read_text(file_path):
+    """
+    Reads a .csv file into a string.
+    """
+    if not file_path.endswith(".csv"):
+        raise ValueError(
+            f"Incompatible file format detected: {os.path.basename(file_path)}\nOnly .csv files are accepted."
+        )
+    with open(file_path, "r", newline="") as csvfile:
+        return csvfile.read()
+
+
+def _read_lines(file_path):
+    """
+    Reads a .csv file into a list of lines.
+    """
+    return _read_text(file_path).splitlines()
+
+
+def _timed_read(file_path):
+    """
+    Reads a .csv file and returns its lines, its size in characters and the
+    time the read took.
+    """
+    start = time.perf_counter()
+    text = _read_text(file_path)
+    return text.splitlines(), len(text), time.perf_counter() - start
+
+
+class IngestStats:
+    """
+    Per-file timings of a read: the time spent waiting for each file (read)
+    and the time spent parsing it (parse). On a slow network share, reads are
+    slow and parses are not; with malformed or very long files, the reverse.
+
+    Pass an IngestStats as ``stats`` to ``read_files``,
+    ``read_spectra_folder``, ``iter_spectra_folder`` or
+    ``process_csv_folder`` and call ``summary`` afterwards.
+
+    """
+
+    def __init__(self):
+        self.file_names = []
+        self.n_chars = []
+        self.read_seconds = []
+        self.parse_seconds = []
+        self.wall_seconds = 0.0
+
+    def add(self, file_path, n_chars, read_seconds, parse_seconds):
+        self.file_names.append(os.path.basename(file_path))
+        self.n_chars.append(n_chars)
+        self.read_seconds.append(read_seconds)
+        self.parse_seconds.append(parse_seconds)
+
+    def summary(self):
+        """
+        Returns the number of files, the wall-clock time, the throughput and
+        the mean, median, 95th percentile and maximum of the read and parse
+        times (in seconds), and the slowest file to read.
+        """
+        summary = {
+            "n_files": len(self.file_names),
+            "wall_seconds": self.wall_seconds,
+            "n_chars": int(sum(self.n_chars)),
+        }
+        if not self.file_names:
+            return summary
+
+        if self.wall_seconds > 0:
+            summary["files_per_s"] = len(self.file_names) / self.wall_seconds
+        for name, seconds in (("read", self.read_seconds), ("parse", self.parse_seconds)):
+            seconds = np.asarray(seconds)
+            summary[name] = {
+                "mean": float(seconds.mean()),
+                "p50": float(np.percentile(seconds, 50)),
+                "p95": float(np.percentile(seconds, 95)),
+                "max": float(seconds.max()),
+            }
+        summary["slowest_read"] = self.file_names[int(np.argmax(self.read_seconds))]
+
+        return summary
+
+    def __str__(self):
+        summary = self.summary()
+        if not summary["n_files"]:
+            return "No files read."
+        return (
+            f"Read {summary['n_files']} files in {summary['wall_seconds']:.2f} s. "
+            f"Read time per file: median {summary['read']['p50'] * 1000:.1f} ms, "
+            f"p95 {summary['read']['p95'] * 1000:.1f} ms, max {summary['read']['max'] * 1000:.1f} ms "
+            f"({summary['slowest_read']}). "
+            f"Parse time per file: median {summary['parse']['p50'] * 1000:.1f} ms, "
+            f"p95 {summary['parse']['p95'] * 1000:.1f} ms."
+        )
+
+
+def read_files(file_paths, parse, max_workers=None, stats=None):
+    """
+    Reads .csv files and parses them, in order. With ``max_workers``, the
+    files are read by a pool of threads so that the waits for many small files
+    (e.g. on a network share) overlap, while ``parse`` runs in the calling
+    thread as each file arrives. At most ``2 * max_workers`` files are read
+    ahead of the one being parsed, so the memory used does not grow with the
+    number of files.
+
+    Parameters
+    ----------
+    file_paths : list
+        The complete paths to the .csv files.
+    parse : callable
+        Called with the lines of each file (without line endings).
+    max_workers : int
+        Optional. The number of files read at the same time. If None, the
+        files are read one at a time.
+    stats : IngestStats
+        Optional. Records the read and parse time of each file.
+
+    Yields
+    ------
+    result
+        The value returned by ``parse`` for each file, in the order of
+        ``file_paths``.
+
+    """
+    start = time.perf_counter()
+
+    def parsed(file_path, read):
+        lines, n_chars, read_seconds = read
+        parse_start = time.perf_counter()
+        result = parse(lines)
+        if stats is not None:
+            stats.add(file_path, n_chars, read_seconds, time.perf_counter() - parse_start)
+        return result
+
+    try:
+        if max_workers is None:
+            for file_path in file_paths:
+                yield parsed(file_path, _timed_read(file_path))
+            return
+
+        if max_workers < 1:
+            raise ValueError(f"max_workers must be at least 1, got {max_workers}.")
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            pending = deque()
+            file_paths = iter(file_paths)
+            for file_path in file_paths:
+                pending.append((file_path, pool.submit(_timed_read, file_path)))
+                if len(pending) >= 2 * max_workers:
+                    break
+
+            while pending:
+                file_path, future = pending.popleft()
+                next_path = next(file_paths, None)
+                if next_path is not None:
+                    pending.append((next_path, pool.submit(_timed_read, next_path)))
+                yield parsed(file_path, future.result())
+    finally:
+        if stats is not None:
+            stats.wall_seconds += time.perf_counter() - start
+
+
+def _spectrum_from_lines(lines, range_min, range_max):
+    """
+    Parses the lines of a spectrum .csv file into wavenumber and intensity
+    arrays within the range.
+    """
+    data, _ = _parse_lines(lines, keep_rows=False)
+    data = data[_crop_mask(data[:, 0], range_min, range_max)]
+
+    return data[:, 0], data[:, 1]
+
+
+def _csv_rows_from_lines(lines, range_min, range_max):
+    """
+    Parses the lines of a spectrum .csv file into the numeric data and raw
+    rows within the range (see ``read_csv_rows``).
+    """
+    data, rows = _parse_lines(lines)
+
+    # Crop to the specified range with a vectorized mask
+    keep = _crop_mask(data[:, 0], range_min, range_max)
+    rows = [row for row, k in zip(rows, keep) if k]
+
+    return data[keep], rows
+
+
+def read_csv_rows(file_path, range_min, range_max):
+    """
+    Reads a spectrum .csv file and returns both the cropped numeric data and
+    the raw rows it came from. Used by ``process_csv`` to rewrite files
+    without changing how the numbers are formatted.
+
+    Parameters
+    ----------
+    file_path : str
+        The complete path to the .csv file.
+    range_min : int
+        The minimum wavenumber of the desired spectral range.
+    range_max : int
+        The maximum wavenumber of the desired spectral range.
+
+    Returns
+    -------
+    data : numpy.ndarray
+        A (n, 2) float64 array of wavenumbers and intensities within the
+        range.
+    rows : list
+        The matching rows as lists of strings.
+
+    """
+    _check_range(range_min, range_max)
+
+    return _csv_rows_from_lines(_read_lines(file_path), range_min, range_max)
+
+
+def read_spectrum(file_path, range_min, range_max):
+    """
+    Reads a single spectrum .csv file into NumPy arrays, keeping only the rows
+    within the specified range. The file is not modified.
+
+    Parameters
+    ----------
+    file_path : str
+        The complete path to the .csv file.
+    range_min : int
+        The minimum wavenumber of the desired spectral range. Note that this
+        value can be greater than the actual minimum if cropping is desired.
+    range_max : int
+        The maximum wavenumber of the desired spectral range. Note that this
+        value can be less than the actual maximum if cropping is desired.
+
+    Returns
+    -------
+    wavenumber : numpy.ndarray
+        The wavenumbers of the spectrum (float64).
+    intensity : numpy.ndarray
+        The intensities of the spectrum (float64).
+
+    """
+    _check_range(range_min, range_max)
+
+    return _spectrum_from_lines(_read_lines(file_path), range_min, range_max)
+
+
+def list_csv_files(folder_path):
+    """
+    Lists the .csv files in a folder in sorted order. Any other file types will
+    raise an error, as with ``process_csv_folder``.
+
+    Parameters
+    ----------
+    folder_path : str
+        The complete path to the folder.
+
+    Returns
+    -------
+    file_names : list
+        The sorted .csv file names.
+
+    """
+    file_names = sorted(
+        name
+        for name in os.listdir(folder_path)
+        if os.path.isfile(os.path.join(folder_path, name))
+    )
+    for name in file_names:
+        if not name.endswith(".csv"):
+            raise ValueError(
+                f"Incompatible file format detected: {name}\nOnly .csv files are accepted. Please remove all other file types."
+            )
+    return file_names
+
+
+def stack_spectra(spectra, file_names):
+    """
+    Stacks a list of (wavenumber, intensity) pairs into one array. All spectra
+    must share the same wavenumber axis.
+
+    Parameters
+    ----------
+    spectra : list
+        A list of (wavenumber, intensity) tuples.
+    file_names : list
+        The file name of each spectrum (used in error messages).
+
+    Returns
+    -------
+    wavenumber : numpy.ndarray
+        The shared wavenumber axis.
+    intensities : numpy.ndarray
+        A (n_spectra, n_points) float64 array.
+
+    """
+    if not spectra:
+        raise ValueError("No spectra to stack.")
+
+    wavenumber = spectra[0][0]
+    for name, (wn, _) in zip(file_names, spectra):
+        if not np.array_equal(wn, wavenumber):
+            raise ValueError(
+                f"{name} does not share the wavenumber axis of {file_names[0]}."
+            )
+    intensities = np.vstack([intensity for _, intensity in spectra])
+
+    return wavenumber, intensities
+
+
+def _read_spectra(folder_path, file_names, range_min, range_max, max_workers, stats):
+    """
+    Reads the spectra of some files of a folder (see ``read_files``).
+    """
+    _check_range(range_min, range_max)
+
+    return list(read_files(
+        [os.path.join(folder_path, name) for name in file_names],
+        lambda lines: _spectrum_from_lines(lines, range_min, range_max),
+        max_workers,
+        stats,
+    ))
+
+
+def read_spectra_folder(folder_path, range_min, range_max, max_workers=None, stats=None, target_wavenumber=None):
+    """
+    Reads every .csv file in a folder into one stacked array. The files are
+    not modified.
+
+    Parameters
+    ----------
+    folder_path : str
+        The complete path to the folder containing .csv files. This function
+        only accepts .csv files.
+    range_min : int
+        The minimum wavenumber of the desired spectral range. Note that this
+        value can be greater than the actual minimum if cropping is desired.
+    range_max : int
+        The maximum wavenumber of the desired spectral range. Note that this
+        value can be less than the actual maximum if cropping is desired.
+    max_workers : int
+        Optional. The number of files read at the same time by a pool of
+        threads, which speeds up reading from network shares (see
+        ``read_files``). If None, the files are read one at a time.
+    stats : IngestStats
+        Optional. Records the read and parse time of each file.
+    target_wavenumber : numpy.ndarray
+        Optional. If the files are not all on the same wavenumber axis, the
+        spectra of each axis are interpolated onto this one (e.g. the
+        library's; see ``GridResampler.resample_groups``) instead of raising
+        a ValueError. Files that share an axis are returned as they are.
+
+    Returns
+    -------
+    wavenumber : numpy.ndarray
+        The wavenumber axis shared by all of the spectra.
+    intensities : numpy.ndarray
+        A (n_files, n_points) float64 array, one row per file.
+    file_names : list
+        The file names, in the same order as the rows of ``intensities``.
+
+    """
+    file_names = list_csv_files(folder_path)
+    spectra = _read_spectra(folder_path, file_names, range_min, range_max, max_workers, stats)
+
+    if target_wavenumber is not None:
+        return get_resampler().resample_groups(
+            group_by_axis(dict(zip(file_names, spectra))), target_wavenumber
+        )
+
+    wavenumber, intensities = stack_spectra(spectra, file_names)
+
+    return wavenumber, intensities, file_names
+
+
+def iter_spectra_folder(folder_path, range_min, range_max, chunk_size=1000, max_workers=None, stats=None, target_wavenumber=None):
+    """
+    Reads the .csv files in a folder in chunks of ``chunk_size`` files, so
+    that only one chunk is held in memory at a time. The files are not
+    modified.
+
+    Parameters
+    ----------
+    folder_path : str
+        The complete path to the folder containing .csv files. This function
+        only accepts .csv files.
+    range_min : int
+        The minimum wavenumber of the desired spectral range.
+    range_max : int
+        The maximum wavenumber of the desired spectral range.
+    chunk_size : int
+        The number of files read at a time.
+    max_workers : int
+        Optional. The number of files of a chunk read at the same time (see
+        ``read_spectra_folder``).
+    stats : IngestStats
+        Optional. Records the read and parse time of each file.
+    target_wavenumber : numpy.ndarray
+        Optional. If the files of a chunk are not all on the same wavenumber
+        axis, they are interpolated onto this one and yielded together (see
+        ``read_spectra_folder``).
+
+    Yields
+    ------
+    wavenumber : numpy.ndarray
+        The wavenumber axis shared by the spectra of the chunk.
+    intensities : numpy.ndarray
+        A (n_files, n_points) float64 array, one row per file.
+    file_names : list
+        The file names, in the same order as the rows of ``intensities``.
+        Unless ``target_wavenumber`` is set, files of one chunk that are on
+        different wavenumber axes are yielded as separate groups (see
+        ``group_by_axis``).
+
+    """
+    file_names = list_csv_files(folder_path)
+
+    for start in range(0, len(file_names), chunk_size):
+        names = file_names[start:start + chunk_size]
+        spectra = _read_spectra(folder_path, names, range_min, range_max, max_workers, stats)
+        groups = group_by_axis(dict(zip(names, spectra)))
+        if target_wavenumber is not None:
+            yield get_resampler().resample_groups(groups, target_wavenumber)
+        else:
+            yield from groups
+
+
+def read_spectra_zip(zip_path, range_min, range_max):
+    """
+    Reads every .csv file in a zipped folder (see ``process_csv_folder``)
+    into NumPy arrays without extracting it.
+
+    Parameters
+    ----------
+    zip_path : str
+        The complete path to the .zip file.
+    range_min : int
+        The minimum wavenumber of the desired spectral range.
+    range_max : int
+        The maximum wavenumber of the desired spectral range.
+
+    Returns
+    -------
+    spectra : dict
+        The (wavenumber, intensity) arrays of each file, keyed by file name,
+        in sorted order.
+
+    """
+    _check_range(range_min, range_max)
+    spectra = {}
+
+    with zipfile.ZipFile(zip_path) as archive:
+        for member in sorted(archive.namelist()):
+            if not member.endswith(".csv"):
+                continue
+            lines = archive.read(member).decode().splitlines()
+            data, _ = _parse_lines(lines, keep_rows=False)
+            data = data[_crop_mask(data[:, 0], range_min, range_max)]
+            spectra[os.path.basename(member)] = (data[:, 0], data[:, 1])
+
+    return spectra
+
+
+def group_by_axis(spectra):
+    """
+    Groups spectra by wavenumber axis, so that each group can be stacked into
+    one array.
+
+    Parameters
+    ----------
+    spectra : dict
+        The (wavenumber, intensity) arrays of each file, keyed by file name.
+
+    Returns
+    -------
+    groups : list
+        A list of (wavenumber, intensities, file_names) tuples, one per
+        distinct wavenumber axis, where ``intensities`` is a
+        (n_files, n_points) array.
+
+    """
+    names_by_axis = {}
+    for name, (wavenumber, _) in spectra.items():
+        names_by_axis.setdefault(wavenumber.tobytes(), []).append(name)
+
+    groups = []
+    for names in names_by_axis.values():
+        wavenumber = spectra[names[0]][0]
+        intensities = np.vstack([spectra[name][1] for name in names])
+        groups.append((wavenumber, intensities, names))
+
+    return groups
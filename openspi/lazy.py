@@ -0,0 +1,42 @@
+import sys
+import importlib
+
+
+class LazyModule:
+    """
+    A stand-in for a module that is only imported the first time one of its
+    attributes is used. Importing ``rpy2.robjects`` starts an embedded R
+    interpreter, and ``scipy.signal`` takes longer to import than the rest of
+    the package, so they are held as LazyModules and only loaded by the
+    functions that need them.
+
+    Parameters
+    ----------
+    name : str
+        The full name of the module, e.g. ``'rpy2.robjects'``.
+
+    """
+
+    def __init__(self, name):
+        self.__dict__["_name"] = name
+        self.__dict__["_module"] = None
+
+    def _load(self):
+        if self._module is None:
+            self.__dict__["_module"] = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attribute):
+        return getattr(self._load(), attribute)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<LazyModule {self._name} ({state})>"
+
+
+def r_started():
+    """
+    Returns True if rpy2 has been imported (and so R has been started) in this
+    process.
+    """
+    return "rpy2.robjects" in sys.modules
@@ -0,0 +1,141 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+
+# The metadata columns indexed as soon as an index is built. Other columns are
+# indexed the first time a filter uses them.
+INDEX_COLUMNS = ("spectrum_type", "material_class", "plastic_or_not")
+
+# Named filters that can be passed as ``library_filter`` instead of a dict
+LIBRARY_FILTERS = {
+    "polymers": {"plastic_or_not": "plastic"},
+    "nonpolymers": {"plastic_or_not": "not plastic"},
+    "ftir": {"spectrum_type": "ftir"},
+    "raman": {"spectrum_type": "raman"},
+}
+
+
+def parse_filter(library_filter):
+    """
+    Returns a library filter as a dict of column -> list of values. A filter
+    is a dict of metadata column -> value (or list of values), the name of one
+    of ``LIBRARY_FILTERS``, or the JSON text of a dict (e.g. from a manifest).
+    """
+    if isinstance(library_filter, str):
+        if library_filter.lstrip().startswith("{"):
+            library_filter = json.loads(library_filter)
+        elif library_filter in LIBRARY_FILTERS:
+            library_filter = LIBRARY_FILTERS[library_filter]
+        else:
+            raise ValueError(
+                f"Unknown library filter: {library_filter}. Options are {', '.join(LIBRARY_FILTERS)}, or a dict of metadata column -> values."
+            )
+
+    if not isinstance(library_filter, dict) or not library_filter:
+        raise ValueError("A library filter must be a non-empty dict of metadata column -> values.")
+
+    return {
+        column: list(values) if isinstance(values, (list, tuple, set)) else [values]
+        for column, values in library_filter.items()
+    }
+
+
+def filter_key(library_filter):
+    """
+    Returns a canonical text form of a library filter, the same for any
+    spelling of the same filter, used to cache sub-libraries and in
+    ``ResultCache`` keys.
+    """
+    library_filter = parse_filter(library_filter)
+
+    return json.dumps(
+        {column: sorted(map(str, values)) for column, values in library_filter.items()},
+        sort_keys=True,
+    )
+
+
+class LibraryIndex:
+    """
+    Boolean masks over the rows of a library's metadata, one per value of
+    each indexed column (spectrum type, material class and plastic or not by
+    default). Picking the rows of a sub-library is then a handful of
+    element-wise operations on these masks instead of a comparison over the
+    metadata for every run.
+
+    A filter keeps the rows that match every column it names, and any of the
+    values given for a column, e.g. ``{"spectrum_type": "ftir",
+    "material_class": ["polyolefins (polyalkenes)", "polyesters"]}``.
+
+    Parameters
+    ----------
+    metadata : dataframe
+        The library metadata, one row per library spectrum.
+    columns : tuple
+        The columns indexed straight away. Other columns of ``metadata`` are
+        indexed when a filter first uses them.
+
+    """
+
+    def __init__(self, metadata, columns=INDEX_COLUMNS):
+        self.metadata = metadata.reset_index(drop=True)
+        self._masks = {}
+
+        for column in columns:
+            if column in self.metadata.columns:
+                self._index(column)
+
+    def __len__(self):
+        return len(self.metadata)
+
+    def _index(self, column):
+        """
+        Returns the masks of a column, keyed by value, building them on first
+        use.
+        """
+        if column not in self._masks:
+            if column not in self.metadata.columns:
+                raise ValueError(f"Unknown library metadata column: {column}")
+
+            codes, values = pd.factorize(self.metadata[column])
+            self._masks[column] = {
+                value: codes == code for code, value in enumerate(values)
+            }
+
+        return self._masks[column]
+
+    def values(self, column):
+        """
+        Returns the values of a metadata column and the number of library
+        spectra with each, e.g. to write a filter.
+        """
+        return {value: int(mask.sum()) for value, mask in self._index(column).items()}
+
+    def mask(self, library_filter):
+        """
+        Returns a boolean array that is True for the library rows kept by a
+        filter (see ``parse_filter``).
+        """
+        keep = np.ones(len(self), dtype=bool)
+
+        for column, values in parse_filter(library_filter).items():
+            masks = self._index(column)
+            column_mask = np.zeros(len(self), dtype=bool)
+            for value in values:
+                if value in masks:
+                    column_mask |= masks[value]
+            keep &= column_mask
+
+        return keep
+
+    def rows(self, library_filter):
+        """
+        Returns the indices of the library rows kept by a filter, raising a
+        ValueError if there are none.
+        """
+        rows = np.flatnonzero(self.mask(library_filter))
+        if len(rows) == 0:
+            raise ValueError(f"No library spectra match the filter: {filter_key(library_filter)}")
+
+        return rows
@@ -0,0 +1,723 @@
+import json
+import hashlib
+import contextlib
+
+import numpy as np
+import pandas as pd
+
+from .library_index import LibraryIndex, filter_key
+
+
+def _center_normalize(spectra):
+    """
+    Centers each row of a 2-D array on its mean and scales it to unit length,
+    so that the dot product of two rows is their Pearson correlation. Missing
+    values (NaN) are ignored when taking the mean and then set to zero, which
+    is the same as replacing them with the mean (OpenSpecy's ``mean_replace``).
+
+    Parameters
+    ----------
+    spectra : numpy.ndarray
+        A (n_spectra, n_points) array.
+
+    Returns
+    -------
+    normalized : numpy.ndarray
+        The centered and normalized array (float64).
+
+    """
+    spectra = np.array(spectra, dtype=np.float64, order="C")
+    missing = np.isnan(spectra)
+    if missing.any():
+        counts = np.maximum((~missing).sum(axis=1, keepdims=True), 1)
+        spectra[missing] = 0.0
+        spectra -= spectra.sum(axis=1, keepdims=True) / counts
+        spectra[missing] = 0.0
+    else:
+        spectra -= spectra.mean(axis=1, keepdims=True)
+
+    norms = np.linalg.norm(spectra, axis=1, keepdims=True)
+    norms[norms == 0] = np.nan
+
+    return spectra / norms
+
+
+def _top_n(scores, top_n):
+    """
+    Finds the indices of the ``top_n`` highest scores in each row, ordered from
+    highest to lowest.
+
+    Parameters
+    ----------
+    scores : numpy.ndarray
+        A (n_spectra, n_library) array of scores.
+    top_n : int
+        The number of matches to keep for each row.
+
+    Returns
+    -------
+    index : numpy.ndarray
+        A (n_spectra, top_n) array of column indices.
+
+    """
+    top_n = min(top_n, scores.shape[1])
+
+    # NaN scores (e.g. flat spectra) are ranked last
+    scores = np.where(np.isnan(scores), -np.inf, scores)
+
+    if top_n < scores.shape[1]:
+        index = np.argpartition(-scores, top_n - 1, axis=1)[:, :top_n]
+    else:
+        index = np.tile(np.arange(scores.shape[1]), (scores.shape[0], 1))
+
+    order = np.argsort(-np.take_along_axis(scores, index, axis=1), axis=1, kind="stable")
+
+    return np.take_along_axis(index, order, axis=1)
+
+
+def _merge_top_n(index, values, tile_index, tile_values, top_n):
+    """
+    Merges the running top *n* of each row with the top *n* of a new tile of
+    scores, keeping the ``top_n`` highest.
+
+    Parameters
+    ----------
+    index : numpy.ndarray
+        A (n_spectra, k) array of the library row indices kept so far.
+    values : numpy.ndarray
+        A (n_spectra, k) array of their scores.
+    tile_index : numpy.ndarray
+        A (n_spectra, m) array of the library row indices of the new tile.
+    tile_values : numpy.ndarray
+        A (n_spectra, m) array of their scores.
+    top_n : int
+        The number of matches to keep for each row.
+
+    Returns
+    -------
+    index : numpy.ndarray
+        A (n_spectra, min(top_n, k + m)) array of library row indices, best
+        first.
+    values : numpy.ndarray
+        The matching scores.
+
+    """
+    index = np.concatenate([index, tile_index], axis=1)
+    values = np.concatenate([values, tile_values], axis=1)
+    order = _top_n(values, top_n)
+
+    return np.take_along_axis(index, order, axis=1), np.take_along_axis(values, order, axis=1)
+
+
+def _tile_shape(n_spectra, n_library, n_points, top_n, memory_limit_mb):
+    """
+    Chooses how many spectra and library spectra are scored at a time so that
+    a tile of scores, plus the normalized spectra it is computed from, fits in
+    ``memory_limit_mb`` megabytes. Whole library rows are preferred; the
+    library is only split when a single spectrum does not fit.
+
+    Returns
+    -------
+    rows : int
+        The number of spectra in each tile.
+    columns : int
+        The number of library spectra in each tile (at least ``top_n``).
+
+    """
+    budget = int(memory_limit_mb * 2**20) // 8
+
+    rows = budget // (n_library + n_points)
+    if rows >= 1:
+        return min(rows, n_spectra), n_library
+
+    return 1, min(n_library, max(top_n, budget - n_points))
+
+
+@contextlib.contextmanager
+def blas_threads(threads=None):
+    """
+    Limits the number of threads used by the BLAS library that NumPy calls for
+    matrix multiplies, for the duration of a ``with`` block. Requires the
+    optional ``threadpoolctl`` package.
+
+    Parameters
+    ----------
+    threads : int
+        The maximum number of BLAS threads. If None, the BLAS default is kept.
+
+    """
+    if threads is None:
+        yield
+        return
+
+    if threads < 1:
+        raise ValueError(f"threads must be at least 1, got {threads}.")
+
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        raise ImportError(
+            "Setting the number of BLAS threads requires threadpoolctl. Install it with 'pip install threadpoolctl'."
+        ) from None
+
+    with threadpool_limits(limits=threads, user_api="blas"):
+        yield
+
+
+def _block_average(spectra, block):
+    """
+    Reduces each row of a 2-D array to the means of consecutive blocks of
+    ``block`` points (the last block may be shorter).
+
+    Parameters
+    ----------
+    spectra : numpy.ndarray
+        A (n_spectra, n_points) array.
+    block : int
+        The number of points averaged into each reduced point.
+
+    Returns
+    -------
+    reduced : numpy.ndarray
+        A (n_spectra, ceil(n_points / block)) array.
+
+    """
+    starts = np.arange(0, spectra.shape[1], block)
+    sums = np.add.reduceat(spectra, starts, axis=1)
+
+    return sums / np.diff(np.append(starts, spectra.shape[1]))
+
+
+class SpectralLibrary:
+    """
+    A reference library held as NumPy arrays, for matching spectra without R.
+    Matching uses the Pearson correlation, as OpenSpecy's ``match_spec`` does.
+
+    The library is centered and normalized once for each set of wavenumbers it
+    is matched on, so matching a batch of spectra is a single matrix multiply
+    followed by a top *n* selection. For large batches, the scores can instead
+    be computed in tiles under a memory limit (see ``blocked_search``), and for
+    large libraries, ``match`` can run a coarse-to-fine cascade (see
+    ``cascade_search``). A sub-library picked by its metadata (e.g. polymers
+    only) is built once with ``select`` and kept.
+
+    Parameters
+    ----------
+    wavenumber : numpy.ndarray
+        The wavenumber axis of the library.
+    spectra : numpy.ndarray
+        A (n_library, n_points) array, one row per library spectrum.
+    metadata : dataframe
+        The library metadata, one row per library spectrum. Must contain a
+        ``'sample_name'`` column.
+
+    """
+
+    def __init__(self, wavenumber, spectra, metadata):
+        self.wavenumber = np.asarray(wavenumber, dtype=np.float64)
+        self.spectra = np.asarray(spectra, dtype=np.float64)
+        self.metadata = metadata.reset_index(drop=True)
+
+        if self.spectra.shape != (len(self.metadata), len(self.wavenumber)):
+            raise ValueError(
+                f"Library spectra have shape {self.spectra.shape}, expected ({len(self.metadata)}, {len(self.wavenumber)})."
+            )
+
+        self._prepared = {}
+        self._coarse = {}
+        self._version = None
+        self._index = None
+        self._subsets = {}
+
+    @property
+    def version(self):
+        """
+        A hash of the library contents, used to tell libraries apart (e.g. in
+        ``ResultCache`` keys).
+        """
+        if self._version is None:
+            digest = hashlib.sha256()
+            digest.update(self.wavenumber.tobytes())
+            digest.update(np.ascontiguousarray(self.spectra).tobytes())
+            digest.update(self.metadata["sample_name"].astype(str).str.cat(sep="\n").encode())
+            self._version = digest.hexdigest()[:16]
+        return self._version
+
+    @property
+    def index(self):
+        """
+        The ``LibraryIndex`` of the library metadata, built on first use.
+        """
+        if self._index is None:
+            self._index = LibraryIndex(self.metadata)
+        return self._index
+
+    def select(self, library_filter):
+        """
+        Returns the sub-library of the spectra kept by a metadata filter. The
+        rows are picked with the masks of ``index``, and the sub-library is
+        kept, so later calls with the same filter return it straight away,
+        along with the matrices it has prepared for matching.
+
+        Parameters
+        ----------
+        library_filter : dict or str
+            A dict of metadata column -> value (or list of values), e.g.
+            ``{"plastic_or_not": "plastic"}``, or the name of one of
+            ``openspi.library_index.LIBRARY_FILTERS`` (see
+            ``LibraryIndex``).
+
+        Returns
+        -------
+        library : SpectralLibrary
+
+        """
+        key = filter_key(library_filter)
+
+        if key not in self._subsets:
+            rows = self.index.rows(library_filter)
+            subset = SpectralLibrary(self.wavenumber, self.spectra[rows], self.metadata.iloc[rows])
+
+            # The spectra are centered and normalized one at a time, so the
+            # prepared rows can be reused
+            subset._prepared = {
+                wavenumber: (query_columns, library_matrix[rows])
+                for wavenumber, (query_columns, library_matrix) in self._prepared.items()
+            }
+            subset._coarse = {
+                coarse_key: coarse_matrix[rows]
+                for coarse_key, coarse_matrix in self._coarse.items()
+            }
+            self._subsets[key] = subset
+
+        return self._subsets[key]
+
+    @classmethod
+    def from_session(cls, session, library_name=None):
+        """
+        Copies a library of an ``OpenSpecySession`` into a SpectralLibrary.
+
+        Parameters
+        ----------
+        session : OpenSpecySession
+            The session holding the library.
+        library_name : str
+            Optional. The name of the library (see ``openspi.session.LIBRARIES``).
+            Default is the session's default library.
+
+        Returns
+        -------
+        library : SpectralLibrary
+
+        """
+        return cls(*session.export_library(library_name))
+
+    def save(self, path):
+        """
+        Saves the library to a .npz file.
+
+        Parameters
+        ----------
+        path : str
+            The full path to the .npz file.
+
+        Returns
+        -------
+        None.
+
+        """
+        np.savez(
+            path,
+            wavenumber=self.wavenumber,
+            spectra=self.spectra,
+            metadata=np.array(self.metadata.to_json(orient="split")),
+        )
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads a library saved with ``save``.
+
+        Parameters
+        ----------
+        path : str
+            The full path to the .npz file.
+
+        Returns
+        -------
+        library : SpectralLibrary
+
+        """
+        with np.load(path) as data:
+            metadata = pd.DataFrame(**json.loads(str(data["metadata"])))
+            return cls(data["wavenumber"], data["spectra"], metadata)
+
+    def prepare(self, wavenumber):
+        """
+        Returns the library restricted to the given wavenumbers, centered and
+        normalized. The result is cached, so only the first call for a given
+        wavenumber axis does any work.
+
+        Parameters
+        ----------
+        wavenumber : numpy.ndarray
+            The wavenumber axis of the spectra to be matched.
+
+        Returns
+        -------
+        query_columns : numpy.ndarray
+            The indices of the query wavenumbers that are in the library.
+        library_matrix : numpy.ndarray
+            A (n_library, n_common) array of centered, normalized spectra.
+
+        """
+        wavenumber = np.asarray(wavenumber, dtype=np.float64)
+        key = wavenumber.tobytes()
+
+        if key not in self._prepared:
+            query_columns = np.flatnonzero(np.isin(wavenumber, self.wavenumber))
+            if len(query_columns) == 0:
+                raise ValueError("The spectra share no wavenumbers with the library.")
+
+            order = np.argsort(self.wavenumber)
+            library_columns = order[
+                np.searchsorted(self.wavenumber, wavenumber[query_columns], sorter=order)
+            ]
+
+            self._prepared[key] = (
+                query_columns,
+                _center_normalize(self.spectra[:, library_columns]),
+            )
+
+        return self._prepared[key]
+
+    def correlate(self, wavenumber, spectra):
+        """
+        Computes the Pearson correlation of each spectrum with each library
+        spectrum on the wavenumbers they have in common.
+
+        Parameters
+        ----------
+        wavenumber : numpy.ndarray
+            The wavenumber axis of the spectra.
+        spectra : numpy.ndarray
+            A (n_spectra, n_points) array of processed spectra.
+
+        Returns
+        -------
+        scores : numpy.ndarray
+            A (n_spectra, n_library) array of correlation coefficients.
+
+        """
+        query_columns, library_matrix = self.prepare(wavenumber)
+        spectra = np.atleast_2d(np.asarray(spectra, dtype=np.float64))
+
+        return _center_normalize(spectra[:, query_columns]) @ library_matrix.T
+
+    def blocked_search(self, wavenumber, spectra, top_n=5, memory_limit_mb=256):
+        """
+        Finds the top *n* library matches of each spectrum, with the same
+        scores as ``correlate``, without holding the full (n_spectra,
+        n_library) score matrix. Scores are computed in tiles sized so that
+        each tile fits in ``memory_limit_mb`` megabytes, and only a running top
+        *n* is kept for each spectrum.
+
+        Parameters
+        ----------
+        wavenumber : numpy.ndarray
+            The wavenumber axis of the spectra.
+        spectra : numpy.ndarray
+            A (n_spectra, n_points) array of processed spectra.
+        top_n : int
+            The number of matches to keep for each spectrum.
+        memory_limit_mb : float
+            The memory allowed for a tile of scores and the normalized spectra
+            it is computed from, in megabytes. The prepared library is not
+            counted, as it is held by the library either way.
+
+        Returns
+        -------
+        index : numpy.ndarray
+            A (n_spectra, top_n) array of library row indices, best first.
+        values : numpy.ndarray
+            A (n_spectra, top_n) array of the matching correlation coefficients.
+
+        """
+        query_columns, library_matrix = self.prepare(wavenumber)
+        spectra = np.atleast_2d(np.asarray(spectra))
+        n_spectra, n_library = len(spectra), len(library_matrix)
+
+        rows, columns = _tile_shape(n_spectra, n_library, len(query_columns), top_n, memory_limit_mb)
+        top_n = min(top_n, n_library)
+
+        index = np.empty((n_spectra, top_n), dtype=np.intp)
+        values = np.empty((n_spectra, top_n))
+        for start in range(0, n_spectra, rows):
+            stop = min(start + rows, n_spectra)
+            block = _center_normalize(spectra[start:stop, query_columns])
+
+            block_index = np.empty((stop - start, 0), dtype=np.intp)
+            block_values = np.empty((stop - start, 0))
+            for first in range(0, n_library, columns):
+                scores = block @ library_matrix[first:first + columns].T
+                tile_index = _top_n(scores, top_n)
+                block_index, block_values = _merge_top_n(
+                    block_index,
+                    block_values,
+                    tile_index + first,
+                    np.take_along_axis(scores, tile_index, axis=1),
+                    top_n,
+                )
+
+            index[start:stop] = block_index
+            values[start:stop] = block_values
+
+        return index, values
+
+    def prepare_coarse(self, wavenumber, block=8):
+        """
+        Returns the reduced representation of the library used by the first
+        stage of ``cascade_search``: the prepared library averaged over blocks
+        of ``block`` points, then centered and normalized again. The result is
+        cached for each wavenumber axis and block size.
+
+        Parameters
+        ----------
+        wavenumber : numpy.ndarray
+            The wavenumber axis of the spectra to be matched.
+        block : int
+            The number of points averaged into each reduced point.
+
+        Returns
+        -------
+        coarse_matrix : numpy.ndarray
+            A (n_library, ceil(n_common / block)) array.
+
+        """
+        wavenumber = np.asarray(wavenumber, dtype=np.float64)
+        key = (wavenumber.tobytes(), block)
+
+        if key not in self._coarse:
+            _, library_matrix = self.prepare(wavenumber)
+            self._coarse[key] = _center_normalize(
+                _block_average(np.nan_to_num(library_matrix), block)
+            )
+
+        return self._coarse[key]
+
+    def cascade_search(self, wavenumber, spectra, top_n=5, block=8, shortlist=50, chunk_size=64, memory_limit_mb=None):
+        """
+        Finds the top *n* library matches of each spectrum in two stages.
+
+        1. Screen: correlate block-averaged spectra (``block`` points per
+           reduced point) with the reduced library and keep the ``shortlist``
+           best candidates for each spectrum.
+        2. Re-score: compute the full-resolution Pearson correlation (the same
+           score as ``correlate``) for the shortlisted candidates only, and
+           keep the ``top_n`` best.
+
+        Use ``check_cascade`` to confirm that a ``block``/``shortlist`` setting
+        returns the same top *n* as the exhaustive search on your data.
+
+        Parameters
+        ----------
+        wavenumber : numpy.ndarray
+            The wavenumber axis of the spectra.
+        spectra : numpy.ndarray
+            A (n_spectra, n_points) array of processed spectra.
+        top_n : int
+            The number of matches to keep for each spectrum.
+        block : int
+            The number of points averaged into each reduced point.
+        shortlist : int
+            The number of candidates re-scored at full resolution for each
+            spectrum. Raised to ``top_n`` if smaller.
+        chunk_size : int
+            The number of spectra re-scored at a time, which bounds the memory
+            used by the second stage.
+        memory_limit_mb : float
+            Optional. Caps the memory used by each stage, in megabytes: the
+            spectra are screened a block at a time (see ``_tile_shape``), and
+            ``chunk_size`` is lowered so that the gathered candidates, a
+            (chunk_size, shortlist, n_points) array, fit.
+
+        Returns
+        -------
+        index : numpy.ndarray
+            A (n_spectra, top_n) array of library row indices, best first.
+        values : numpy.ndarray
+            A (n_spectra, top_n) array of the matching correlation coefficients.
+
+        """
+        query_columns, library_matrix = self.prepare(wavenumber)
+        spectra = _center_normalize(
+            np.atleast_2d(np.asarray(spectra, dtype=np.float64))[:, query_columns]
+        )
+
+        coarse_library = self.prepare_coarse(wavenumber, block)
+        coarse_spectra = _center_normalize(_block_average(np.nan_to_num(spectra), block))
+        n_candidates = max(shortlist, top_n)
+
+        rows = len(spectra)
+        if memory_limit_mb is not None:
+            # The screening scores are (n_spectra, n_library), and the
+            # re-scoring gathers (chunk_size, shortlist, n_points) floats
+            rows, _ = _tile_shape(len(spectra), len(coarse_library), coarse_library.shape[1], n_candidates, memory_limit_mb)
+            budget = int(memory_limit_mb * 2**20) // 8
+            chunk_size = min(chunk_size, max(1, budget // (n_candidates * (library_matrix.shape[1] + 1))))
+
+        # Stage 1: screen the whole library on the reduced representation
+        candidates = np.concatenate([
+            _top_n(coarse_spectra[start:start + rows] @ coarse_library.T, n_candidates)
+            for start in range(0, max(len(spectra), 1), max(rows, 1))
+        ])
+
+        # Stage 2: exact correlation for the shortlisted candidates only
+        exact = np.empty(candidates.shape)
+        for start in range(0, len(spectra), chunk_size):
+            stop = start + chunk_size
+            exact[start:stop] = (
+                library_matrix[candidates[start:stop]] @ spectra[start:stop, :, None]
+            )[:, :, 0]
+
+        order = _top_n(exact, top_n)
+
+        return (
+            np.take_along_axis(candidates, order, axis=1),
+            np.take_along_axis(exact, order, axis=1),
+        )
+
+    def check_cascade(self, wavenumber, spectra, top_n=5, block=8, shortlist=50):
+        """
+        Compares ``cascade_search`` with the exhaustive search on a set of
+        spectra and reports the recall of the top *n* matches.
+
+        Parameters
+        ----------
+        wavenumber : numpy.ndarray
+            The wavenumber axis of the spectra.
+        spectra : numpy.ndarray
+            A (n_spectra, n_points) array of processed spectra.
+        top_n : int
+            The number of matches compared for each spectrum.
+        block : int
+            Passed to ``cascade_search``.
+        shortlist : int
+            Passed to ``cascade_search``.
+
+        Returns
+        -------
+        recall : float
+            The fraction of the exhaustive top *n* matches that the cascade
+            also returns. 1.0 means the results passed to ``sort_export`` are
+            unchanged.
+        mismatched : numpy.ndarray
+            The indices of the spectra whose top *n* differ.
+
+        """
+        scores = self.correlate(wavenumber, spectra)
+        exhaustive = _top_n(scores, top_n)
+        cascade, _ = self.cascade_search(wavenumber, spectra, top_n, block, shortlist)
+
+        found = np.array([
+            len(np.intersect1d(expected, returned))
+            for expected, returned in zip(exhaustive, cascade)
+        ])
+        mismatched = np.flatnonzero(found < exhaustive.shape[1])
+
+        return found.sum() / exhaustive.size, mismatched
+
+    def match(self, wavenumber, spectra, file_names, top_n=5, search='exhaustive', block=8, shortlist=50, memory_limit_mb=None, threads=None):
+        """
+        Matches processed spectra against the library and returns the top
+        *n* matches for each, in the same layout as ``r_script``.
+
+        Parameters
+        ----------
+        wavenumber : numpy.ndarray
+            The wavenumber axis of the spectra.
+        spectra : numpy.ndarray
+            A (n_spectra, n_points) array of processed spectra.
+        file_names : list
+            The file name of each spectrum.
+        top_n : int
+            The number of matches to keep for each spectrum.
+        search : str
+            'exhaustive' (default) correlates every spectrum with every library
+            spectrum. 'cascade' uses ``cascade_search``, which is faster for
+            large libraries.
+        block : int
+            Used when ``search`` is 'cascade' (see ``cascade_search``).
+        shortlist : int
+            Used when ``search`` is 'cascade' (see ``cascade_search``).
+        memory_limit_mb : float
+            Optional. Caps the memory used for scores, in megabytes. The
+            exhaustive search scores the library in tiles (see
+            ``blocked_search``), and the cascade search screens and re-scores
+            the spectra a block at a time (see ``cascade_search``). If None,
+            all of the scores are computed at once.
+        threads : int
+            Optional. The number of BLAS threads used for the matrix
+            multiplies (see ``blas_threads``).
+
+        Returns
+        -------
+        df_top_matches : dataframe
+            One row per match, with the ``'object_id'``, ``'library_id'`` and
+            ``'match_val'`` columns, the library metadata (including
+            ``'spectrum_identity'``, ``'material_class'``, ``'plastic_or_not'``
+            and ``'sn'``) and ``'file_name.y'``.
+
+        """
+        if search not in ('exhaustive', 'cascade'):
+            raise ValueError(f"Unknown search: {search}. Options are 'exhaustive' or 'cascade'.")
+
+        with blas_threads(threads):
+            if search == 'cascade':
+                index, values = self.cascade_search(wavenumber, spectra, top_n, block, shortlist, memory_limit_mb=memory_limit_mb)
+            elif memory_limit_mb is not None:
+                index, values = self.blocked_search(wavenumber, spectra, top_n, memory_limit_mb)
+            else:
+                scores = self.correlate(wavenumber, spectra)
+                index = _top_n(scores, top_n)
+                values = np.take_along_axis(scores, index, axis=1)
+
+        return self._matches_frame(index, values, file_names)
+
+    def _matches_frame(self, index, values, file_names):
+        """
+        Builds the matches dataframe from the indices and scores of the top
+        matches for each spectrum.
+        """
+        n_spectra, n_matches = index.shape
+        file_names = np.asarray(list(file_names), dtype=object)
+
+        rows = np.repeat(np.arange(n_spectra), n_matches)
+        library_rows = index.ravel()
+
+        metadata = self.metadata.iloc[library_rows].reset_index(drop=True)
+
+        # Follow the column names of OpenSpecy's merge of the library and
+        # object metadata
+        metadata = metadata.rename(
+            columns={"sample_name": "library_id", "file_name": "file_name.x"}
+        )
+
+        df_top_matches = pd.concat(
+            [
+                pd.DataFrame(
+                    {
+                        "object_id": file_names[rows],
+                        "match_val": values.ravel(),
+                    }
+                ),
+                metadata,
+            ],
+            axis=1,
+        )
+        df_top_matches["file_name.y"] = file_names[rows]
+
+        # Remove all empty columns from the dataframe
+        df_top_matches = df_top_matches.dropna(axis=1, how="all")
+
+        return df_top_matches
@@ -1,15 +1,32 @@
 import os
-import openpyxl
 
-def _xlsx_metadata(xlsx_file):
+from openspi.lazy import LazyModule
+
+# openpyxl is only needed when a workbook is written
+openpyxl = LazyModule("openpyxl")
+
+def _version_tag():
     """
-    Adds the OpenSpecy-Python-Interface version number as metadata stored in
-    Excel's `subject` and `keywords` attributes.
+    Returns the OpenSpecy-Python-Interface version tag, e.g. ``'openspi v0.0.5'``.
+    """
+
+    # Pull version num from __version__.py
+    from openspi.__version__ import __version__
+
+    # Create version tag str
+    return "openspi v" + __version__
+
+
+def _set_workbook_metadata(wb):
+    """
+    Stores the OpenSpecy-Python-Interface version number in the `subject` and
+    `keywords` attributes of an open openpyxl workbook. The workbook is not
+    saved.
 
     Parameters
     ----------
-    xlsx_file : str
-        The full file path of the .xlsx file to be tagged.
+    wb : openpyxl.Workbook
+        The workbook to be tagged.
 
     Returns
     -------
@@ -17,14 +34,7 @@ def _xlsx_metadata(xlsx_file):
 
     """
 
-    # Pull version num from __version__.py
-    from openspi.__version__ import __version__
-
-    # Create version tag str
-    version_tag = "openspi v" + __version__
-
-    # Load the workbook
-    wb = openpyxl.load_workbook(xlsx_file)
+    version_tag = _version_tag()
 
     # Access the workbook properties
     props = wb.properties
@@ -34,5 +44,27 @@ def _xlsx_metadata(xlsx_file):
         props.subject = version_tag
         props.keywords = version_tag
 
+
+def _xlsx_metadata(xlsx_file):
+    """
+    Adds the OpenSpecy-Python-Interface version number as metadata stored in
+    Excel's `subject` and `keywords` attributes.
+
+    Parameters
+    ----------
+    xlsx_file : str
+        The full file path of the .xlsx file to be tagged.
+
+    Returns
+    -------
+    None.
+
+    """
+
+    # Load the workbook
+    wb = openpyxl.load_workbook(xlsx_file)
+
+    _set_workbook_metadata(wb)
+
     # Save the workbook
     wb.save(xlsx_file)
\ No newline at end of file
@@ -0,0 +1,230 @@
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from .core import match_native, sort_export
+from .ingest import list_csv_files, read_spectrum, stack_spectra
+from .matching import SpectralLibrary
+from .session import OpenSpecySession, get_session
+
+
+# The session (or native library) held by each worker process
+_worker_state = {}
+
+
+def plan_shards(sources, shard_size=100):
+    """
+    Splits the .csv files of one or more folders into shards of at most
+    ``shard_size`` files. The shards depend only on the folder contents and
+    ``shard_size``, never on the number of workers, so results are the same
+    however many workers are used.
+
+    Parameters
+    ----------
+    sources : str or list
+        The complete path to a folder containing .csv files, or a list of
+        such paths.
+    shard_size : int
+        The maximum number of files in each shard.
+
+    Returns
+    -------
+    shards : list
+        A list of (folder_path, file_names, prefix) tuples, where ``prefix``
+        is added to the file names in the results (the folder name when there
+        is more than one folder, so that file names stay unique).
+
+    """
+    if isinstance(sources, str):
+        sources = [sources]
+
+    shards = []
+    for folder_path in sources:
+        file_names = list_csv_files(folder_path)
+        prefix = os.path.basename(os.path.normpath(folder_path)) + "/" if len(sources) > 1 else ""
+
+        for start in range(0, len(file_names), shard_size):
+            shards.append((folder_path, file_names[start:start + shard_size], prefix))
+
+    return shards
+
+
+def _create_snapshot(processor, library_path):
+    """
+    Saves the library to ``library_path`` in the parent process if there is
+    no snapshot there yet, so that the workers only load it rather than each
+    loading the library and writing the same file at the same time.
+    """
+    if library_path is None or os.path.exists(library_path):
+        return
+
+    session = get_session()
+    if processor == 'native':
+        session.native_library.save(library_path)
+        print(f"Library saved to {library_path}")
+    else:
+        session.save_library(library_path)
+
+
+def _init_worker(processor, library_path):
+    """
+    Starts the R session (or loads the native library) once per worker
+    process, from the snapshot at ``library_path`` if there is one.
+    """
+    if processor == 'native' and library_path is not None:
+        _worker_state["library"] = SpectralLibrary.load(library_path)
+    else:
+        session = OpenSpecySession(library_snapshot=library_path)
+        _worker_state["session"] = session
+        if processor == 'native':
+            _worker_state["library"] = session.native_library
+
+
+def _match_shard(shard, params):
+    """
+    Reads, processes and matches the files of one shard in a worker process.
+    """
+    folder_path, file_names, prefix = shard
+
+    spectra = [
+        read_spectrum(os.path.join(folder_path, name), params["range_min"], params["range_max"])
+        for name in file_names
+    ]
+    wavenumber, intensities = stack_spectra(spectra, file_names)
+    file_names = [prefix + name for name in file_names]
+
+    if params["processor"] == 'native':
+        return match_native(
+            wavenumber,
+            intensities,
+            file_names,
+            params["range_min"],
+            params["range_max"],
+            params["adj_intens"],
+            params["adj_intens_type"],
+            params["subtr_baseline"],
+            params["top_n"],
+            library=_worker_state["library"],
+        )
+
+    return _worker_state["session"].match_arrays(
+        wavenumber,
+        intensities,
+        file_names,
+        params["range_min"],
+        params["range_max"],
+        params["adj_intens"],
+        params["adj_intens_type"],
+        params["subtr_baseline"],
+        params["top_n"],
+        params["matcher"],
+    )
+
+
+def openspi_parallel(
+        sources,
+        range_min,
+        range_max,
+        excel_path = None,
+        workers = None,
+        shard_size = 100,
+        library_path = None,
+        nrel_version = False,
+        adj_intens = False,
+        adj_intens_type = 'none',
+        subtr_baseline = False,
+        top_n = 5,
+        matcher = 'r',
+        processor = 'r'):
+    """
+    Processes one or more folders of .csv files across several CPU cores. The
+    files are split into shards (see ``plan_shards``) and each shard is read,
+    processed and matched in a worker process that holds its own warm R
+    session and library. The per-shard match dataframes are then merged in
+    shard order, so the result does not depend on the number of workers.
+
+    The source files are read into memory and are not modified.
+
+    Parameters
+    ----------
+    sources : str or list
+        The complete path to a folder containing .csv files, or a list of
+        such paths.
+    range_min : int
+        The minimum wavenumber of the desired spectral range.
+    range_max : int
+        The maximum wavenumber of the desired spectral range.
+    excel_path : str
+        Optional. The full path to the .xlsx file to export with
+        ``sort_export``. If not specified, nothing is exported.
+    workers : int
+        The number of worker processes. Default is the number of CPUs.
+    shard_size : int
+        The maximum number of files matched in one call.
+    library_path : str
+        Optional. With ``processor='r'``, the path to an .rds library snapshot
+        (see ``OpenSpecySession``), so that the workers do not each load and
+        filter the library. With ``processor='native'``, the path to a .npz
+        library saved with ``SpectralLibrary.save``, in which case R is not
+        started in the workers. If the file does not exist yet, the library
+        is saved there once before the workers start.
+    nrel_version : bool
+        Passed to ``sort_export`` as ``nrel``.
+    adj_intens : bool
+        If True, the intensity of the spectra will be adjusted.
+    adj_intens_type : str
+        The type of intensity adjustment to be made.
+    subtr_baseline : bool
+        If True, the baseline will be subtracted from the spectra.
+    top_n : int
+        The top *n* highest matches desired.
+    matcher : str
+        The backend used for matching, 'r' or 'native' (see ``r_script``).
+    processor : str
+        The backend used for processing, 'r' or 'native' (see
+        ``openspi_main``).
+
+    Returns
+    -------
+    df_top_matches : dataframe
+        The merged library match data for all of the files.
+
+    """
+    shards = plan_shards(sources, shard_size)
+    if not shards:
+        raise ValueError("No .csv files found in the source folder(s).")
+
+    params = {
+        "range_min": range_min,
+        "range_max": range_max,
+        "adj_intens": adj_intens,
+        "adj_intens_type": adj_intens_type,
+        "subtr_baseline": subtr_baseline,
+        "top_n": top_n,
+        "matcher": matcher,
+        "processor": processor,
+    }
+
+    workers = min(workers or os.cpu_count() or 1, len(shards))
+
+    _create_snapshot(processor, library_path)
+    print(f"Matching {len(shards)} shard(s) with {workers} worker(s)...")
+
+    # Workers are spawned rather than forked, since an embedded R interpreter
+    # cannot be shared with a forked child
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(processor, library_path),
+    ) as pool:
+        results = list(pool.map(_match_shard, shards, [params] * len(shards)))
+
+    df_top_matches = pd.concat(results, ignore_index=True)
+
+    if excel_path is not None:
+        sort_export(df_top_matches, excel_path, top_n, nrel = nrel_version)
+
+    return df_top_matches
@@ -0,0 +1,469 @@
+from collections import OrderedDict
+
+import numpy as np
+
+from .lazy import LazyModule
+
+
+# scipy.signal and scipy.sparse are slow to import, so they are only imported
+# when spectra are processed
+signal = LazyModule("scipy.signal")
+sparse = LazyModule("scipy.sparse")
+
+
+class GridResampler:
+    """
+    Linearly interpolates spectra onto a target wavenumber axis (OpenSpecy's
+    ``conform_spec`` with ``res = NULL``), as one sparse matrix product per
+    batch. The interpolation weights only depend on the source and target
+    axes, and every file from an instrument shares the same axis, so the
+    weight matrix (two non-zero weights per target point) is built once for
+    each (source axis, target axis) pair and kept for later batches. Source
+    axes that already hold every target point are sliced instead.
+
+    Parameters
+    ----------
+    max_pairs : int
+        The number of (source axis, target axis) pairs kept. The least
+        recently used pair is dropped first.
+
+    """
+
+    def __init__(self, max_pairs=64):
+        self.max_pairs = max_pairs
+        self._weights = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def weights(self, wavenumber, target_wavenumber):
+        """
+        Returns the interpolation from one wavenumber axis onto another,
+        building it on first use.
+
+        Parameters
+        ----------
+        wavenumber : numpy.ndarray
+            The source wavenumber axis, in any order.
+        target_wavenumber : numpy.ndarray
+            The wavenumber axis to interpolate onto.
+
+        Returns
+        -------
+        target : numpy.ndarray
+            The points of ``target_wavenumber`` within the range of the
+            source axis.
+        columns : numpy.ndarray
+            The source column of each target point if every target point is
+            on the source axis, None otherwise.
+        matrix : scipy.sparse.csr_matrix
+            A (n_points, n_target) matrix of interpolation weights, None if
+            ``columns`` is set.
+
+        """
+        wavenumber = np.asarray(wavenumber, dtype=np.float64)
+        target_wavenumber = np.asarray(target_wavenumber, dtype=np.float64)
+        key = (wavenumber.tobytes(), target_wavenumber.tobytes())
+
+        if key in self._weights:
+            self.hits += 1
+            self._weights.move_to_end(key)
+            return self._weights[key]
+
+        self.misses += 1
+
+        # Sort the source axis (instrument exports run from high to low). The
+        # order is folded into the column indices, so the spectra themselves
+        # are never reordered.
+        order = np.argsort(wavenumber)
+        ordered = wavenumber[order]
+
+        target = target_wavenumber[
+            (target_wavenumber >= ordered[0]) & (target_wavenumber <= ordered[-1])
+        ]
+
+        right = np.clip(np.searchsorted(ordered, target, side="left"), 1, len(ordered) - 1)
+        left = right - 1
+        step = ordered[right] - ordered[left]
+        weight = np.divide(
+            target - ordered[left], step, out=np.zeros_like(target), where=step != 0
+        )
+
+        if np.all((weight == 0) | (weight == 1)):
+            # Every target point is a source point
+            columns = order[np.where(weight == 1, right, left)]
+            entry = (target, columns, None)
+        else:
+            n_target = len(target)
+            matrix = sparse.csr_matrix(
+                (
+                    np.concatenate([1 - weight, weight]),
+                    (
+                        np.concatenate([order[left], order[right]]),
+                        np.tile(np.arange(n_target), 2),
+                    ),
+                ),
+                shape=(len(wavenumber), n_target),
+            )
+            entry = (target, None, matrix)
+
+        self._weights[key] = entry
+        if len(self._weights) > self.max_pairs:
+            self._weights.popitem(last=False)
+
+        return entry
+
+    def resample(self, wavenumber, intensities, target_wavenumber):
+        """
+        Interpolates spectra that share a wavenumber axis onto the points of
+        ``target_wavenumber`` that fall within that axis.
+
+        Parameters
+        ----------
+        wavenumber : numpy.ndarray
+            The wavenumber axis shared by all of the spectra.
+        intensities : numpy.ndarray
+            A (n_spectra, n_points) array of intensities.
+        target_wavenumber : numpy.ndarray
+            The wavenumber axis to interpolate onto (e.g. the library's).
+
+        Returns
+        -------
+        wavenumber : numpy.ndarray
+            The points of ``target_wavenumber`` within the range of the
+            spectra.
+        intensities : numpy.ndarray
+            A (n_spectra, n_target_points) array of interpolated intensities.
+            If the target points are exactly the source points, in the same
+            order, this is ``intensities`` itself.
+
+        """
+        intensities = np.atleast_2d(np.asarray(intensities, dtype=np.float64))
+        target, columns, matrix = self.weights(wavenumber, target_wavenumber)
+
+        if columns is None:
+            return target, np.asarray(intensities @ matrix)
+        if len(columns) == intensities.shape[1] and np.array_equal(columns, np.arange(len(columns))):
+            return target, intensities
+
+        return target, intensities[:, columns]
+
+    def resample_groups(self, groups, target_wavenumber):
+        """
+        Interpolates groups of spectra on different wavenumber axes (see
+        ``openspi.ingest.group_by_axis``) onto one shared axis, so that they
+        can be processed and matched as one batch. Each group is resampled
+        with the weights of its own axis. If there is only one group, it is
+        returned as it is.
+
+        Parameters
+        ----------
+        groups : list
+            A list of (wavenumber, intensities, file_names) tuples.
+        target_wavenumber : numpy.ndarray
+            The wavenumber axis to interpolate onto (e.g. the library's).
+
+        Returns
+        -------
+        wavenumber : numpy.ndarray
+            The points of ``target_wavenumber`` within the range of every
+            group.
+        intensities : numpy.ndarray
+            A (n_spectra, n_target_points) array, the rows of each group in
+            turn.
+        file_names : list
+            The file names, in the same order as the rows of
+            ``intensities``.
+
+        """
+        if len(groups) == 1:
+            wavenumber, intensities, file_names = groups[0]
+            return wavenumber, np.atleast_2d(intensities), list(file_names)
+
+        resampled = [
+            self.resample(wavenumber, intensities, target_wavenumber)
+            for wavenumber, intensities, _ in groups
+        ]
+
+        # Keep the target points covered by every group
+        shared = resampled[0][0]
+        for target, _ in resampled[1:]:
+            shared = shared[np.isin(shared, target)]
+        if len(shared) == 0:
+            raise ValueError("The spectra share no part of the target wavenumber axis.")
+
+        intensities = np.vstack([
+            conformed[:, np.isin(target, shared)] for target, conformed in resampled
+        ])
+        file_names = [name for _, _, names in groups for name in names]
+
+        return shared, intensities, file_names
+
+
+_default_resampler = GridResampler()
+
+
+def get_resampler():
+    """
+    Returns the ``GridResampler`` shared by ``conform_grid`` and
+    ``process_spectra``, which keeps the interpolation weights for the axes
+    seen in this process.
+    """
+    return _default_resampler
+
+
+def conform_grid(wavenumber, intensities, target_wavenumber):
+    """
+    Linearly interpolates spectra that share a wavenumber axis onto the points
+    of ``target_wavenumber`` that fall within that axis (OpenSpecy's
+    ``conform_spec`` with ``res = NULL``). The interpolation weights are
+    computed once for each pair of axes and applied to the whole batch as a
+    sparse matrix product (see ``GridResampler``).
+
+    Parameters
+    ----------
+    wavenumber : numpy.ndarray
+        The wavenumber axis shared by all of the spectra.
+    intensities : numpy.ndarray
+        A (n_spectra, n_points) array of intensities.
+    target_wavenumber : numpy.ndarray
+        The wavenumber axis to interpolate onto (e.g. the library's).
+
+    Returns
+    -------
+    wavenumber : numpy.ndarray
+        The points of ``target_wavenumber`` within the range of the spectra.
+    intensities : numpy.ndarray
+        A (n_spectra, n_target_points) array of interpolated intensities.
+
+    """
+    return get_resampler().resample(wavenumber, intensities, target_wavenumber)
+
+
+def make_rel(intensities):
+    """
+    Scales each spectrum to the range [0, 1] (OpenSpecy's ``make_rel`` with
+    ``na.rm = TRUE``).
+
+    Parameters
+    ----------
+    intensities : numpy.ndarray
+        A (n_spectra, n_points) array of intensities.
+
+    Returns
+    -------
+    intensities : numpy.ndarray
+        The scaled intensities.
+
+    """
+    low = np.nanmin(intensities, axis=1, keepdims=True)
+    high = np.nanmax(intensities, axis=1, keepdims=True)
+
+    return (intensities - low) / (high - low)
+
+
+def adj_neg(intensities):
+    """
+    Shifts each spectrum with values below 1 up so that its minimum is 1
+    (OpenSpecy's ``adj_neg``).
+    """
+    low = np.nanmin(intensities, axis=1, keepdims=True)
+
+    return np.where(low < 1, intensities + 1 - low, intensities)
+
+
+def adjust_intensity(intensities, adj_intens_type='none'):
+    """
+    Converts reflectance or transmittance spectra to absorbance-like
+    intensities (OpenSpecy's ``adj_intens``).
+
+    Unlike OpenSpecy, the Kubelka-Munk conversion of reflectance spectra
+    raises zero and negative values to the smallest positive value of their
+    spectrum first, so that they do not give infinite or negative
+    intensities. Spectra with only positive values give the same result as
+    OpenSpecy.
+
+    Parameters
+    ----------
+    intensities : numpy.ndarray
+        A (n_spectra, n_points) array of intensities.
+    adj_intens_type : str
+        The type of intensity adjustment to be made. Options are 'none',
+        'transmittance', or 'reflectance'.
+
+    Returns
+    -------
+    intensities : numpy.ndarray
+        The adjusted intensities, scaled with ``make_rel``.
+
+    """
+    if adj_intens_type == 'none':
+        adjusted = adj_neg(intensities)
+    elif adj_intens_type == 'transmittance':
+        adjusted = np.log10(1 / adj_neg(intensities))
+    elif adj_intens_type == 'reflectance':
+        positive = np.where(intensities > 0, intensities, np.inf)
+        floor = np.min(positive, axis=1, keepdims=True)
+        floor[~np.isfinite(floor)] = 1.0
+        reflectance = np.where(intensities <= 0, floor, intensities) / 100
+        adjusted = (1 - reflectance) ** 2 / (2 * reflectance)
+    else:
+        raise ValueError(
+            f"Unknown adj_intens_type: {adj_intens_type}. Options are 'none', 'transmittance', or 'reflectance'."
+        )
+
+    return make_rel(adjusted)
+
+
+def subtract_poly_baseline(wavenumber, intensities, degree=8, max_iter=100):
+    """
+    Subtracts a polynomial baseline from each spectrum with the improved
+    modified polynomial fit (I-ModPolyFit) used by OpenSpecy's
+    ``subtr_baseline(type = "polynomial")``.
+
+    After the first fit, points above the fit plus one standard deviation of
+    the residual are treated as peaks and left out of every later fit. The
+    signal is then clipped to the fit plus one standard deviation until the
+    standard deviation changes by less than 5%. Every spectrum in the batch is
+    fitted at once by solving its (degree + 1) x (degree + 1) normal equations
+    in a single stacked solve.
+
+    Parameters
+    ----------
+    wavenumber : numpy.ndarray
+        The wavenumber axis shared by all of the spectra.
+    intensities : numpy.ndarray
+        A (n_spectra, n_points) array of intensities.
+    degree : int
+        The degree of the polynomial. Default is 8.
+    max_iter : int
+        The maximum number of iterations.
+
+    Returns
+    -------
+    intensities : numpy.ndarray
+        The intensities with the baseline subtracted.
+
+    """
+    # Scale the axis to [-1, 1] to keep the fit well conditioned
+    x = np.asarray(wavenumber, dtype=np.float64)
+    x = 2 * (x - x.min()) / (x.max() - x.min()) - 1
+    vander = np.polynomial.legendre.legvander(x, degree)
+    n_terms = degree + 1
+
+    # Outer products of the basis at each point, so the normal equations of
+    # every spectrum come from one matrix multiply with the weights
+    outer = (vander[:, :, None] * vander[:, None, :]).reshape(len(x), -1)
+
+    y = np.array(intensities, dtype=np.float64)
+    weights = np.ones_like(y)
+    active = np.ones(len(y), dtype=bool)
+    dev_prev = np.zeros(len(y))
+    baseline = np.zeros_like(y)
+
+    for iteration in range(max_iter):
+        # Weighted least squares fit of every active spectrum
+        w = weights[active]
+        yw = y[active] * w
+        lhs = (w @ outer).reshape(-1, n_terms, n_terms)
+        rhs = yw @ vander
+        coef = np.linalg.solve(lhs, rhs[:, :, None])[:, :, 0]
+        fit = coef @ vander.T
+
+        residual = (y[active] - fit) * w
+        n_points = w.sum(axis=1)
+        dev = np.sqrt(
+            ((residual - residual.sum(axis=1, keepdims=True) / n_points[:, None]) ** 2 * w).sum(axis=1)
+            / np.maximum(n_points - 1, 1)
+        )
+
+        if iteration == 0:
+            # Leave the peaks out of the remaining fits
+            weights[active] = np.where(y[active] > fit + dev[:, None], 0.0, w)
+
+        y[active] = np.minimum(fit + dev[:, None], y[active])
+        baseline[active] = fit
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            converged = np.abs((dev - dev_prev[active]) / dev) <= 0.05
+        dev_prev[active] = dev
+
+        index = np.flatnonzero(active)
+        active[index[converged | ~np.isfinite(dev)]] = False
+        if not active.any():
+            break
+
+    return np.asarray(intensities, dtype=np.float64) - baseline
+
+
+def process_spectra(
+        wavenumber,
+        intensities,
+        target_wavenumber,
+        range_min,
+        range_max,
+        adj_intens: bool = False,
+        adj_intens_type: str = 'none',
+        subtr_baseline: bool = False):
+    """
+    Processes a batch of spectra the same way as the ``process_spec`` call in
+    ``r_script``, without R. Every step works on the whole 2-D array at once:
+
+    1. Conform the spectra to ``target_wavenumber`` (the library grid)
+    2. Optionally adjust the intensity (``adj_intens``)
+    3. Restrict the range to [range_min, range_max]
+    4. Optionally subtract a polynomial baseline (degree 8)
+    5. Savitzky-Golay smoothing with the first derivative (polynomial 3,
+       window 11), taking the absolute value
+    6. Scale each spectrum to [0, 1] (``make_rel``)
+
+    Parameters
+    ----------
+    wavenumber : numpy.ndarray
+        The wavenumber axis shared by all of the spectra.
+    intensities : numpy.ndarray
+        A (n_spectra, n_points) array of intensities. A 1-D array is treated
+        as a single spectrum.
+    target_wavenumber : numpy.ndarray
+        The wavenumber axis of the library.
+    range_min : int
+        The minimum wavenumber of the desired spectral range.
+    range_max : int
+        The maximum wavenumber of the desired spectral range.
+    adj_intens : bool
+        If True, the intensity of the spectra will be adjusted.
+    adj_intens_type : str
+        The type of intensity adjustment to be made. Options are 'none',
+        'transmittance', or 'reflectance'.
+    subtr_baseline : bool
+        If True, the baseline will be subtracted from the spectra using
+        I-ModPolyFit.
+
+    Returns
+    -------
+    wavenumber : numpy.ndarray
+        The wavenumber axis of the processed spectra.
+    intensities : numpy.ndarray
+        A (n_spectra, n_points) array of processed spectra.
+
+    """
+    processed_wavenumber, processed = conform_grid(wavenumber, intensities, target_wavenumber)
+
+    if adj_intens:
+        processed = adjust_intensity(processed, adj_intens_type)
+
+    keep = (processed_wavenumber >= range_min) & (processed_wavenumber <= range_max)
+    processed_wavenumber = processed_wavenumber[keep]
+    processed = make_rel(processed[:, keep])
+
+    if len(processed_wavenumber) < 11:
+        raise ValueError(
+            f"Only {len(processed_wavenumber)} library wavenumbers fall within the range {range_min}-{range_max}; at least 11 are needed for smoothing."
+        )
+
+    if subtr_baseline:
+        processed = subtract_poly_baseline(processed_wavenumber, processed)
+
+    processed = np.abs(signal.savgol_filter(processed, 11, 3, deriv=1, axis=1, mode="interp"))
+    processed = make_rel(processed)
+
+    return processed_wavenumber, processed
@@ -0,0 +1,825 @@
+import os
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+from .lazy import LazyModule
+from .library_index import LibraryIndex, filter_key
+from .trace import as_tracer
+from .utils import reformat_path
+
+
+# rpy2 starts an embedded R interpreter when it is imported, so it is only
+# imported once a session is created
+ro = LazyModule("rpy2.robjects")
+pandas2ri = LazyModule("rpy2.robjects.pandas2ri")
+numpy2ri = LazyModule("rpy2.robjects.numpy2ri")
+conversion = LazyModule("rpy2.robjects.conversion")
+
+
+# R code that loads the packages once per R interpreter
+_R_PACKAGES = """
+
+    library(OpenSpecy)
+    library(data.table)
+    library(tools)
+
+"""
+
+# The name of the library loaded by the session by default, used to identify
+# it in ResultCache keys without starting R
+LIBRARY_NAME = "derivative/ftir"
+
+# The libraries a session can load, by name: the OpenSpecy library type (or
+# the path to an in-house library, see ``register_library``) and the spectrum
+# type kept from it ("" keeps every spectrum)
+LIBRARIES = {
+    (lib_type + "/" + spectrum_type if spectrum_type else lib_type): (lib_type, spectrum_type)
+    for lib_type in ("derivative", "nobaseline", "raw")
+    for spectrum_type in ("", "ftir", "raman")
+}
+
+# R function that keeps the spectra of one type from a library
+_R_FILTER_LIBRARY = """
+
+    function(spec_lib, spectrum_type) {
+      if (spectrum_type == "") {
+        return(spec_lib)
+      }
+
+      # Filter the library to only include one type of spectra
+      filter_spec(spec_lib, spec_lib$metadata$spectrum_type==spectrum_type)
+    }
+
+"""
+
+# R function that builds an OpenSpecy library from arrays (one column per
+# library spectrum)
+_R_BUILD_LIBRARY = """
+
+    function(wavenumber, spectra, metadata) {
+      spectra <- as.data.table(spectra)
+      setnames(spectra, make.unique(as.character(metadata$sample_name)))
+
+      as_OpenSpecy(x = wavenumber,
+                   spectra = spectra,
+                   metadata = as.data.table(metadata))
+    }
+
+"""
+
+# R function that builds the processing and matching pipeline around a
+# library. The returned closures keep the library in scope, so later calls
+# only need to pass the spectra and the processing parameters.
+_R_PIPELINE = """
+
+    function(ftir_lib) {
+      force(ftir_lib)
+
+      # Read the files in the folder
+      read_raw <- function(file_path) {
+        read_any(file_path)
+      }
+
+      # Conform the range of the spectra to match the range of the library
+      conform_file <- function(files, file_path) {
+        if (file_ext(file_path) == 'csv') {
+          files <- conform_spec(files, range = ftir_lib$wavenumber, res = NULL)
+          }
+
+        if (file_ext(file_path) == 'zip') {
+          files <- c_spec(files, range = ftir_lib$wavenumber, res = NULL)
+          }
+
+        files
+      }
+
+      read_file <- function(file_path) {
+        conform_file(read_raw(file_path), file_path)
+      }
+
+      # Build an OpenSpecy object from the wavenumber axis and the intensity
+      # matrix (one column per file)
+      build_arrays <- function(wavenumber, intensities, file_names) {
+        spectra <- as.data.table(intensities)
+        setnames(spectra, file_names)
+
+        as_OpenSpecy(x = wavenumber,
+                     spectra = spectra,
+                     metadata = data.table(file_name = file_names))
+      }
+
+      # Conform the range of the spectra to match the range of the library
+      conform_arrays <- function(files) {
+        conform_spec(files, range = ftir_lib$wavenumber, res = NULL)
+      }
+
+      read_arrays <- function(wavenumber, intensities, file_names) {
+        conform_arrays(build_arrays(wavenumber, intensities, file_names))
+      }
+
+      n_spectra <- function(x) {
+        ncol(x$spectra)
+      }
+
+      process <- function(files, range_min, range_max, adj_intens,
+                          adj_intens_type, subtr_baseline) {
+
+        # 'Monolithic' file processing function, see
+        #  https://rawcdn.githack.com/wincowgerDEV/OpenSpecy-package/c253d6c3298c7db56fbfdceee6ff0e654a1431cd/reference/process_spec.html
+        process_spec(
+          files,
+          active = TRUE,
+          adj_intens = adj_intens,
+          adj_intens_args = list(type = adj_intens_type),
+          conform_spec = FALSE,
+          conform_spec_args = list(range = ftir_lib$wavenumber, res = NULL, type = "interp"),
+          restrict_range = TRUE,
+          restrict_range_args = list(min = range_min, max = range_max),
+          flatten_range = FALSE,
+          flatten_range_args = list(min = 2200, max = 2420),
+          subtr_baseline = subtr_baseline,
+          subtr_baseline_args = list(type = "polynomial", degree = 8, raw = FALSE, baseline =
+                                       NULL),
+          smooth_intens = TRUE,
+          smooth_intens_args = list(polynomial = 3, window = 11, derivative = 1, abs = TRUE),
+          make_rel = TRUE,
+          make_rel_args = list(na.rm = TRUE)
+        )
+      }
+
+      # Keep the library spectra of a logical vector (one value per spectrum)
+      sub_library <- function(rows) {
+        filter_spec(ftir_lib, rows)
+      }
+
+      match <- function(files_processed, top_n, library = ftir_lib) {
+
+        # Compare the processed spectra to those in the library and identify
+        # the top n matches for each spectrum
+        top_matches <- match_spec(files_processed, library = library, na.rm = T, top_n = top_n,
+                                 add_library_metadata = "sample_name",
+                                 add_object_metadata = "col_id")
+
+        # Remove all empty columns from the dataframe
+        top_matches[, !sapply(top_matches, OpenSpecy::is_empty_vector), with = F]
+      }
+
+      # Keep only the requested columns (all of them if columns is NULL)
+      select_columns <- function(x, columns) {
+        if (is.null(columns)) {
+          return(x)
+        }
+        x[, intersect(columns, names(x)), with = F]
+      }
+
+      # Unpack an OpenSpecy object into plain vectors and a matrix (one column
+      # per spectrum) for use in Python
+      as_arrays <- function(x) {
+        list(wavenumber = x$wavenumber,
+             spectra = as.matrix(x$spectra),
+             file_name = as.character(x$metadata$file_name))
+      }
+
+      list(read_raw = read_raw,
+           conform_file = conform_file,
+           read_file = read_file,
+           build_arrays = build_arrays,
+           conform_arrays = conform_arrays,
+           read_arrays = read_arrays,
+           n_spectra=n_spectra,
+           process = process,
+           sub_library = sub_library,
+           match = match,
+           select_columns = select_columns,
+           as_arrays = as_arrays)
+    }
+
+"""
+
+
+def r_frame_to_pandas(r_frame):
+    """
+    Converts an R data.frame (or data.table) to a Pandas dataframe one column
+    at a time, without activating a global rpy2 converter. Numeric columns
+    are copied into NumPy arrays in one block through the buffer protocol,
+    with R's integer and logical NA values turned into NaN and None. Factors
+    become their labels.
+
+    Parameters
+    ----------
+    r_frame : rpy2.robjects.vectors.DataFrame
+        The R data.frame.
+
+    Returns
+    -------
+    df : dataframe
+
+    """
+    na_integer = np.iinfo(np.int32).min
+    columns = {}
+
+    for name, vector in zip(r_frame.names, r_frame):
+        if isinstance(vector, ro.vectors.FactorVector):
+            codes = np.array(vector, dtype=np.int64)
+            levels = np.array(list(vector.levels) + [None], dtype=object)
+            values = levels[np.where(codes == na_integer, len(levels), codes) - 1]
+        elif isinstance(vector, ro.vectors.BoolVector):
+            codes = np.array(vector, dtype=np.int32)
+            values = codes.astype(bool)
+            if (codes == na_integer).any():
+                values = values.astype(object)
+                values[codes == na_integer] = None
+        elif isinstance(vector, ro.vectors.IntVector):
+            values = np.array(vector, dtype=np.int32)
+            if (values == na_integer).any():
+                values = np.where(values == na_integer, np.nan, values)
+        elif isinstance(vector, ro.vectors.FloatVector):
+            values = np.array(vector, dtype=np.float64)
+        else:
+            values = [None if value is ro.NA_Character else value for value in vector]
+
+        columns[name] = values
+
+    return pd.DataFrame(columns)
+
+
+def register_library(name, path, spectrum_type=""):
+    """
+    Registers an in-house reference library under a name, so that it can be
+    selected with ``library_name`` like the OpenSpecy libraries.
+
+    Parameters
+    ----------
+    name : str
+        The name used to select the library, e.g. ``'inhouse/ftir'``.
+    path : str
+        The full path to the library: an .rds file holding an OpenSpecy
+        object (e.g. written with ``OpenSpecySession.save_library``), or an
+        .npz file written with ``SpectralLibrary.save``.
+    spectrum_type : str
+        Optional. Only keep the library spectra of this type (e.g. 'ftir').
+        Only used for .rds files.
+
+    Returns
+    -------
+    None.
+
+    """
+    if not path.endswith((".rds", ".npz")):
+        raise ValueError(f"Incompatible library file: {os.path.basename(path)}\nOnly .rds and .npz files are accepted.")
+
+    LIBRARIES[name] = (os.path.abspath(path), spectrum_type)
+
+
+def _library_source(library_name):
+    """
+    Returns the source and the spectrum type of a registered library.
+    """
+    if library_name not in LIBRARIES:
+        raise ValueError(
+            f"Unknown library: {library_name}. Options are {', '.join(sorted(LIBRARIES))}, or register one with register_library."
+        )
+    return LIBRARIES[library_name]
+
+
+def _snapshot_file(snapshot_dir, library_name, extension):
+    """
+    Returns the path of the snapshot of a library in ``snapshot_dir``.
+    """
+    return os.path.join(snapshot_dir, library_name.replace("/", "_") + extension)
+
+
+class OpenSpecySession:
+    """
+    A persistent connection to the OpenSpecy R package. The packages are
+    loaded, the default library is loaded and filtered (to FTIR spectra of the
+    derivative library, unless ``library_name`` says otherwise), and the
+    processing/matching pipeline is defined once when the session is created.
+    Every later call reuses them, so only the spectra themselves are read,
+    processed and matched.
+
+    Other libraries in ``LIBRARIES`` are loaded the first time they are
+    selected with ``library_name`` and then kept, with their pipeline and
+    their ``SpectralLibrary`` copy, so switching between libraries only costs
+    the first load of each. Sub-libraries picked with a ``library_filter``
+    are kept in the same way (see ``library_index``).
+
+    Parameters
+    ----------
+    library_snapshot : str
+        Optional. The path to an .rds snapshot of the default library (see
+        ``save_library``). If the file exists, the library is read from it and
+        nothing is fetched or filtered. If it does not exist, the library is
+        loaded as usual and then saved to this path.
+    library_name : str
+        Optional. The name of the default library, one of ``LIBRARIES``.
+        Default is 'derivative/ftir'.
+    snapshot_dir : str
+        Optional. A folder of library snapshots, one .rds file (and one .npz
+        file for the ``SpectralLibrary`` copy) per library name. Libraries are
+        read from it when they are there, and saved to it when they are first
+        loaded.
+
+    """
+
+    def __init__(self, library_snapshot=None, library_name=LIBRARY_NAME, snapshot_dir=None):
+        print("Starting OpenSpecy session...")
+
+        ro.r(_R_PACKAGES)
+
+        self.library_name = library_name
+        self.snapshot_dir = snapshot_dir
+        self._variants = {}
+        self._native_libraries = {}
+        self._library_indexes = {}
+        self._library_versions = {}
+        self._sub_libraries = {}
+
+        if library_snapshot is None and snapshot_dir is not None:
+            library_snapshot = _snapshot_file(snapshot_dir, library_name, ".rds")
+
+        if library_snapshot is not None and os.path.exists(library_snapshot):
+            self.library = ro.r["readRDS"](reformat_path(library_snapshot))
+            print(f"Library loaded from {library_snapshot}")
+        else:
+            self.library = self._load_library(library_name)
+            if library_snapshot is not None:
+                self.save_library(library_snapshot)
+
+        self._pipeline = ro.r(_R_PIPELINE)(self.library)
+        self._variants[library_name] = (self.library, self._pipeline)
+
+        print("OpenSpecy session ready.")
+
+    def _load_library(self, library_name):
+        """
+        Loads a library by name into R, fetching it with ``load_lib`` or
+        reading an in-house library, and filters it to its spectrum type.
+        """
+        source, spectrum_type = _library_source(library_name)
+
+        if source.endswith(".npz"):
+            from .matching import SpectralLibrary
+
+            native = SpectralLibrary.load(source)
+            self._native_libraries[library_name] = native
+            with conversion.localconverter(ro.default_converter + numpy2ri.converter + pandas2ri.converter):
+                return ro.r(_R_BUILD_LIBRARY)(
+                    ro.conversion.py2rpy(native.wavenumber),
+                    ro.conversion.py2rpy(np.asfortranarray(native.spectra.T)),
+                    ro.conversion.py2rpy(native.metadata),
+                )
+
+        if source.endswith(".rds"):
+            spec_lib = ro.r["readRDS"](reformat_path(source))
+        else:
+            spec_lib = ro.r["load_lib"](source)
+
+        return ro.r(_R_FILTER_LIBRARY)(spec_lib, spectrum_type)
+
+    def _variant(self, library_name=None):
+        """
+        Returns the R library and the pipeline built around it for a library
+        name, loading them on first use.
+        """
+        if library_name is None:
+            library_name = self.library_name
+
+        if library_name not in self._variants:
+            snapshot = None
+            if self.snapshot_dir is not None:
+                snapshot = _snapshot_file(self.snapshot_dir, library_name, ".rds")
+
+            if snapshot is not None and os.path.exists(snapshot):
+                library = ro.r["readRDS"](reformat_path(snapshot))
+                print(f"Library loaded from {snapshot}")
+            else:
+                print(f"Loading library {library_name}...")
+                library = self._load_library(library_name)
+                if snapshot is not None:
+                    ro.r["saveRDS"](library, reformat_path(snapshot))
+                    print(f"Library saved to {snapshot}")
+
+            self._variants[library_name] = (library, ro.r(_R_PIPELINE)(library))
+
+        return self._variants[library_name]
+
+    def save_library(self, path, library_name=None):
+        """
+        Saves a filtered library to an .rds snapshot, which can be passed as
+        ``library_snapshot`` to start a session without fetching or filtering
+        the library, or registered with ``register_library``.
+
+        Parameters
+        ----------
+        path : str
+            The full path to the .rds file.
+        library_name : str
+            Optional. The library to save. Default is the session's default
+            library.
+
+        Returns
+        -------
+        None.
+
+        """
+        library = self.library if library_name is None else self._variant(library_name)[0]
+        ro.r["saveRDS"](library, reformat_path(path))
+        print(f"Library saved to {path}")
+
+    def export_library(self, library_name=None):
+        """
+        Copies a filtered library out of R.
+
+        Parameters
+        ----------
+        library_name : str
+            Optional. The library to copy. Default is the session's default
+            library.
+
+        Returns
+        -------
+        wavenumber : numpy.ndarray
+            The wavenumber axis of the library.
+        spectra : numpy.ndarray
+            A (n_library, n_points) array, one row per library spectrum.
+        metadata : dataframe
+            The library metadata, one row per library spectrum.
+
+        """
+        if library_name is None:
+            library, pipeline = self.library, self._pipeline
+        else:
+            library, pipeline = self._variant(library_name)
+
+        arrays = pipeline.rx2("as_arrays")(library)
+        with conversion.localconverter(ro.default_converter + numpy2ri.converter + pandas2ri.converter):
+            wavenumber = np.asarray(arrays.rx2("wavenumber"), dtype=np.float64)
+            spectra = np.asarray(arrays.rx2("spectra"), dtype=np.float64).T
+            metadata = ro.conversion.rpy2py(library.rx2("metadata"))
+
+        return wavenumber, spectra, metadata
+
+    @property
+    def native_library(self):
+        """
+        The default library as a ``SpectralLibrary``, copied out of R on first
+        use.
+        """
+        return self.get_native_library()
+
+    def get_native_library(self, library_name=None):
+        """
+        Returns a library as a ``SpectralLibrary``. It is read from the
+        snapshot folder or copied out of R on first use, then kept, along with
+        the centered and normalized matrices it prepares for matching.
+
+        Parameters
+        ----------
+        library_name : str
+            Optional. The name of the library. Default is the session's
+            default library.
+
+        Returns
+        -------
+        library : SpectralLibrary
+
+        """
+        if library_name is None:
+            library_name = self.library_name
+
+        if library_name not in self._native_libraries:
+            from .matching import SpectralLibrary
+
+            snapshot = None
+            if self.snapshot_dir is not None:
+                snapshot = _snapshot_file(self.snapshot_dir, library_name, ".npz")
+
+            source, _ = _library_source(library_name)
+            if source.endswith(".npz"):
+                # In-house .npz libraries are already SpectralLibrary files
+                library = SpectralLibrary.load(source)
+            elif snapshot is not None and os.path.exists(snapshot):
+                library = SpectralLibrary.load(snapshot)
+            else:
+                library = SpectralLibrary.from_session(self, library_name)
+                if snapshot is not None:
+                    library.save(snapshot)
+
+            self._native_libraries[library_name] = library
+
+        return self._native_libraries[library_name]
+
+    def library_index(self, library_name=None):
+        """
+        Returns the ``LibraryIndex`` of a library's metadata, built on first
+        use. The metadata is taken from the ``SpectralLibrary`` copy if there
+        is one, and only the metadata is copied out of R otherwise.
+
+        Parameters
+        ----------
+        library_name : str
+            Optional. The name of the library. Default is the session's
+            default library.
+
+        Returns
+        -------
+        index : LibraryIndex
+
+        """
+        if library_name is None:
+            library_name = self.library_name
+
+        if library_name not in self._library_indexes:
+            if library_name in self._native_libraries:
+                index = self._native_libraries[library_name].index
+            else:
+                library, _ = self._variant(library_name)
+                index = LibraryIndex(r_frame_to_pandas(library.rx2("metadata")))
+            self._library_indexes[library_name] = index
+
+        return self._library_indexes[library_name]
+
+    def library_version(self, library_name=None):
+        """
+        Returns a hash of a library's wavenumber axis and metadata, used to
+        tell libraries apart in ``ResultCache`` keys, so that matches cached
+        against an older copy of a library (e.g. before a new ``get_lib``)
+        are not reused.
+
+        Parameters
+        ----------
+        library_name : str
+            Optional. The name of the library. Default is the session's
+            default library.
+
+        Returns
+        -------
+        version : str
+
+        """
+        if library_name is None:
+            library_name = self.library_name
+
+        if library_name not in self._library_versions:
+            library, _ = self._variant(library_name)
+            with conversion.localconverter(ro.default_converter + numpy2ri.converter):
+                wavenumber = np.asarray(library.rx2("wavenumber"), dtype=np.float64)
+            metadata = self.library_index(library_name).metadata
+
+            digest = hashlib.sha256()
+            digest.update(wavenumber.tobytes())
+            digest.update(pd.util.hash_pandas_object(metadata.astype(str), index=False).values.tobytes())
+            self._library_versions[library_name] = digest.hexdigest()[:16]
+
+        return self._library_versions[library_name]
+
+    def _sub_library(self, library_name, library_filter):
+        """
+        Returns the R library holding the spectra of a library kept by a
+        metadata filter, filtering it on first use.
+        """
+        if library_name is None:
+            library_name = self.library_name
+
+        key = (library_name, filter_key(library_filter))
+        if key not in self._sub_libraries:
+            _, pipeline = self._variant(library_name)
+            mask = self.library_index(library_name).mask(library_filter)
+            if not mask.any():
+                raise ValueError(f"No library spectra match the filter: {key[1]}")
+            self._sub_libraries[key] = pipeline.rx2("sub_library")(ro.BoolVector(mask.tolist()))
+
+        return self._sub_libraries[key]
+
+    def _count(self, files):
+        """
+        Returns the number of spectra in an OpenSpecy object.
+        """
+        return int(self._pipeline.rx2("n_spectra")(files)[0])
+
+    def _read_arrays(self, wavenumber, intensities, file_names, tracer=None, library_name=None):
+        """
+        Sends spectra held in memory to R as an OpenSpecy object conformed to
+        the library.
+        """
+        tracer = as_tracer(tracer)
+        _, pipeline = self._variant(library_name)
+        intensities = np.atleast_2d(np.asarray(intensities, dtype=np.float64))
+        if isinstance(file_names, str):
+            file_names = [file_names]
+
+        # Send the arrays to R. The intensity matrix is transposed so that each
+        # spectrum is one column, as OpenSpecy expects.
+        with tracer.span("read", n_spectra=len(intensities)):
+            with conversion.localconverter(ro.default_converter + numpy2ri.converter):
+                r_wavenumber = ro.conversion.py2rpy(np.asarray(wavenumber, dtype=np.float64))
+                r_intensities = ro.conversion.py2rpy(np.asfortranarray(intensities.T))
+
+            files = pipeline.rx2("build_arrays")(
+                r_wavenumber, r_intensities, ro.StrVector(list(file_names))
+            )
+
+        with tracer.span("conform", n_spectra=len(intensities)):
+            return pipeline.rx2("conform_arrays")(files)
+
+    def _process_match(
+            self,
+            files,
+            range_min,
+            range_max,
+            adj_intens,
+            adj_intens_type,
+            subtract_baseline,
+            top_n,
+            matcher,
+            tracer=None,
+            library_name=None,
+            columns=None,
+            library_filter=None):
+        """
+        Processes and matches an OpenSpecy object and returns the matches as a
+        Pandas dataframe, with only ``columns`` if specified, against the
+        sub-library kept by ``library_filter`` if specified.
+        """
+        tracer = as_tracer(tracer)
+        n_spectra=self._count(files)
+        _, pipeline = self._variant(library_name)
+
+        if matcher == "native":
+            with tracer.span("process", n_spectra=n_spectra):
+                wavenumber, spectra, file_names = self._process(
+                    files, range_min, range_max, adj_intens, adj_intens_type, subtract_baseline, library_name
+                )
+            print("Script execution complete.")
+            with tracer.span("match", n_spectra=n_spectra, matcher="native"):
+                library = self.get_native_library(library_name)
+                if library_filter is not None:
+                    library = library.select(library_filter)
+                df_top_matches = library.match(wavenumber, spectra, file_names, top_n)
+            if columns is not None:
+                df_top_matches = df_top_matches[[column for column in columns if column in df_top_matches]]
+            return df_top_matches
+
+        if matcher != "r":
+            raise ValueError(f"Unknown matcher: {matcher}. Options are 'r' or 'native'.")
+
+        with tracer.span("process", n_spectra=n_spectra):
+            files_processed = pipeline.rx2("process")(
+                files,
+                range_min,
+                range_max,
+                bool(adj_intens),
+                adj_intens_type,
+                bool(subtract_baseline),
+            )
+
+        with tracer.span("match", n_spectra=n_spectra, matcher="r"):
+            if library_filter is None:
+                r_top_matches = pipeline.rx2("match")(files_processed, int(top_n))
+            else:
+                r_top_matches = pipeline.rx2("match")(
+                    files_processed, int(top_n), self._sub_library(library_name, library_filter)
+                )
+
+        print("Script execution complete.")
+
+        # Send R dataframe to Python dataframe. Only the requested columns are
+        # converted, without changing rpy2's global conversion rules.
+        with tracer.span("conversion", n_spectra=n_spectra):
+            if columns is not None:
+                r_top_matches = pipeline.rx2("select_columns")(r_top_matches, ro.StrVector(list(columns)))
+            df_top_matches = r_frame_to_pandas(r_top_matches)
+
+        return df_top_matches
+
+    def _process(
+            self,
+            files,
+            range_min,
+            range_max,
+            adj_intens,
+            adj_intens_type,
+            subtract_baseline,
+            library_name=None):
+        """
+        Processes an OpenSpecy object in R and returns the processed spectra as
+        NumPy arrays.
+        """
+        _, pipeline = self._variant(library_name)
+        files_processed = pipeline.rx2("process")(
+            files,
+            range_min,
+            range_max,
+            bool(adj_intens),
+            adj_intens_type,
+            bool(subtract_baseline),
+        )
+        arrays = pipeline.rx2("as_arrays")(files_processed)
+
+        with conversion.localconverter(ro.default_converter + numpy2ri.converter):
+            wavenumber = np.asarray(arrays.rx2("wavenumber"), dtype=np.float64)
+            spectra = np.asarray(arrays.rx2("spectra"), dtype=np.float64).T
+        file_names = list(arrays.rx2("file_name"))
+
+        return wavenumber, spectra, file_names
+
+    def match_file(
+            self,
+            file_path,
+            range_min,
+            range_max,
+            adj_intens=False,
+            adj_intens_type='none',
+            subtract_baseline=False,
+            top_n=5,
+            matcher='r',
+            tracer=None,
+            library_name=None,
+            columns=None,
+            library_filter=None):
+        """
+        Reads a zipped folder or a single .csv file with OpenSpecy, then
+        processes and matches the spectra. See ``r_script`` for the
+        parameters.
+
+        Returns
+        -------
+        df_top_matches : dataframe
+            A Pandas dataframe containing the library match data for the files.
+
+        """
+        print("Executing R script...")
+
+        tracer = as_tracer(tracer)
+        _, pipeline = self._variant(library_name)
+
+        # Reformat the folder path to have \\ instead of \
+        file_path = reformat_path(file_path)
+
+        with tracer.span("read") as span:
+            files = pipeline.rx2("read_raw")(file_path)
+            span["n_spectra"] = self._count(files)
+
+        with tracer.span("conform", n_spectra=span["n_spectra"]):
+            files = pipeline.rx2("conform_file")(files, file_path)
+
+        return self._process_match(
+            files, range_min, range_max, adj_intens, adj_intens_type, subtract_baseline, top_n, matcher, tracer, library_name, columns, library_filter
+        )
+
+    def match_arrays(
+            self,
+            wavenumber,
+            intensities,
+            file_names,
+            range_min,
+            range_max,
+            adj_intens=False,
+            adj_intens_type='none',
+            subtract_baseline=False,
+            top_n=5,
+            matcher='r',
+            tracer=None,
+            library_name=None,
+            columns=None,
+            library_filter=None):
+        """
+        Sends spectra held in memory to R, then processes and matches them.
+        See ``r_script_in_memory`` for the parameters.
+
+        Returns
+        -------
+        df_top_matches : dataframe
+            A Pandas dataframe containing the library match data for the files.
+
+        """
+        print("Executing R script...")
+
+        files = self._read_arrays(wavenumber, intensities, file_names, tracer, library_name)
+
+        return self._process_match(
+            files, range_min, range_max, adj_intens, adj_intens_type, subtract_baseline, top_n, matcher, tracer, library_name, columns, library_filter
+        )
+
+
+_default_session = None
+
+
+def get_session():
+    """
+    Returns the session shared by ``r_script`` and ``openspi_main``, starting
+    it on first use.
+
+    Returns
+    -------
+    session : OpenSpecySession
+        The shared session.
+
+    """
+    global _default_session
+    if _default_session is None:
+        _default_session = OpenSpecySession()
+    return _default_session
@@ -0,0 +1,447 @@
+import os
+import re
+import json
+
+import numpy as np
+import pandas as pd
+
+from .ingest import list_csv_files, read_spectrum, _check_range, _crop_mask
+
+
+# The files that make up a store folder
+_META_FILE = "meta.json"
+_AXIS_FILE = "wavenumber.npy"
+_DATA_FILE = "intensities.dat"
+_INDEX_FILE = "index.csv"
+
+_FORMAT = "openspi-spectral-store"
+
+# A well ID such as A1, B07 or P24 (rows A-P, columns 1-48), on its own
+# between separators in a file name
+_WELL_PATTERN = re.compile(r"(?<![A-Za-z0-9])([A-Pa-p])0?([1-9]|[1-4][0-9])(?![0-9A-Za-z])")
+
+
+def well_id(file_name):
+    """
+    Finds the well ID in a file name, e.g. 'B7' in 'plate3_B07_scan.csv'. If
+    there is more than one candidate, the last one is used.
+
+    Parameters
+    ----------
+    file_name : str
+        The file name.
+
+    Returns
+    -------
+    well : str
+        The well ID as a row letter and column number (e.g. 'B7'), or an empty
+        string if none is found.
+
+    """
+    matches = _WELL_PATTERN.findall(os.path.splitext(os.path.basename(file_name))[0])
+    if not matches:
+        return ""
+    row, column = matches[-1]
+
+    return row.upper() + column
+
+
+def _replace_file(path, text):
+    """
+    Writes ``text`` to a temporary file next to ``path`` and moves it over
+    ``path``, so readers see either the old or the new file, never part of
+    one.
+    """
+    temp_path = path + ".tmp"
+    with open(temp_path, "w", newline="") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+def is_store(path):
+    """
+    Returns True if ``path`` is a folder holding a ``SpectralStore``.
+    """
+    return isinstance(path, str) and os.path.isfile(os.path.join(path, _META_FILE))
+
+
+def as_store(source):
+    """
+    Returns ``source`` as a ``SpectralStore`` if it is one (or is the path to
+    one), or None otherwise.
+    """
+    if isinstance(source, SpectralStore):
+        return source
+    if is_store(source):
+        return SpectralStore(source)
+    return None
+
+
+class SpectralStore:
+    """
+    A compact on-disk collection of spectra that share a wavenumber axis, so
+    that a campaign's .csv files only need to be parsed once. A store is a
+    folder containing:
+
+    * ``wavenumber.npy``: the shared wavenumber axis
+    * ``intensities.dat``: a contiguous (n_spectra, n_points) matrix of
+      intensities in row-major order, read with ``numpy.memmap``
+    * ``index.csv``: the file name and well ID of each row
+    * ``meta.json``: the data type, number of points and number of spectra,
+      and the committed size of ``index.csv``
+
+    Reading a store only pages in the rows and columns that are used. New
+    spectra are appended to the end of the matrix without rewriting it. The
+    number of spectra in ``meta.json`` is updated last and commits each
+    append, so a store interrupted mid-append opens as it was before it.
+
+    A store can be passed to ``r_script`` or ``openspi_main`` in place of a
+    folder path. Use ``create`` or ``import_folder`` to make a new store.
+
+    Parameters
+    ----------
+    path : str
+        The complete path to the store folder.
+
+    """
+
+    def __init__(self, path):
+        if not is_store(path):
+            raise ValueError(f"{path} is not a spectral store.")
+
+        self.path = path
+
+        with open(os.path.join(path, _META_FILE), "r") as f:
+            self.meta = json.load(f)
+        if self.meta.get("format") != _FORMAT:
+            raise ValueError(f"{path} is not a spectral store.")
+
+        self.wavenumber = np.load(os.path.join(path, _AXIS_FILE))
+        self.dtype = np.dtype(self.meta["dtype"])
+
+        # meta.json is written last by append, so its count is the committed
+        # number of spectra; index rows past it are from an interrupted append
+        # and are not read
+        self.index = pd.read_csv(
+            os.path.join(path, _INDEX_FILE), dtype=str, keep_default_na=False, nrows=len(self)
+        )
+        if len(self.index) < len(self):
+            raise ValueError(
+                f"{path} is damaged: index.csv has {len(self.index)} rows, expected {len(self)}."
+            )
+        self._names = set(self.index["file_name"])
+
+    @classmethod
+    def create(cls, path, wavenumber, dtype = 'float64', range_min = None, range_max = None):
+        """
+        Creates an empty store.
+
+        Parameters
+        ----------
+        path : str
+            The complete path to the store folder. It is created if it does not
+            exist, and must not already hold a store.
+        wavenumber : numpy.ndarray
+            The wavenumber axis shared by every spectrum in the store.
+        dtype : str
+            The data type of the intensities, 'float64' (default) or
+            'float32'. float32 halves the size of the store.
+        range_min : int
+            Optional. The range the spectra were cropped to, kept for
+            reference.
+        range_max : int
+            Optional. See ``range_min``.
+
+        Returns
+        -------
+        store : SpectralStore
+
+        """
+        if np.dtype(dtype) not in (np.float32, np.float64):
+            raise ValueError(f"Unsupported dtype: {dtype}. Options are 'float64' or 'float32'.")
+        if is_store(path):
+            raise ValueError(f"A spectral store already exists at {path}.")
+
+        os.makedirs(path, exist_ok=True)
+
+        np.save(os.path.join(path, _AXIS_FILE), np.asarray(wavenumber, dtype=np.float64))
+        open(os.path.join(path, _DATA_FILE), "wb").close()
+        index_path = os.path.join(path, _INDEX_FILE)
+        pd.DataFrame(columns=["file_name", "well_id"]).to_csv(index_path, index=False, lineterminator="\n")
+
+        meta = {
+            "format": _FORMAT,
+            "version": 1,
+            "dtype": np.dtype(dtype).name,
+            "n_points": len(wavenumber),
+            "n_spectra": 0,
+            "range_min": range_min,
+            "range_max": range_max,
+            "index_bytes": os.path.getsize(index_path),
+        }
+        _replace_file(os.path.join(path, _META_FILE), json.dumps(meta, indent=2))
+
+        return cls(path)
+
+    @classmethod
+    def import_folder(cls, folder_path, store_path, range_min, range_max, dtype = 'float64'):
+        """
+        Reads every .csv file in a folder, applying the same cleaning rules as
+        ``process_csv`` (the header and any other non-numeric rows are dropped
+        and the spectra are cropped to [range_min, range_max]), and writes them
+        to a store. The .csv files are not modified.
+
+        If ``store_path`` already holds a store, the files that are not in it
+        yet are appended, so importing a folder again only adds new files.
+
+        Parameters
+        ----------
+        folder_path : str
+            The complete path to the folder containing .csv files. This
+            function only accepts .csv files.
+        store_path : str
+            The complete path to the store folder.
+        range_min : int
+            The minimum wavenumber of the desired spectral range.
+        range_max : int
+            The maximum wavenumber of the desired spectral range.
+        dtype : str
+            The data type of a new store (see ``create``).
+
+        Returns
+        -------
+        store : SpectralStore
+
+        """
+        file_names = list_csv_files(folder_path)
+        if not file_names:
+            raise ValueError(f"No .csv files found in {folder_path}.")
+
+        if is_store(store_path):
+            store = cls(store_path)
+            stored = set(store.file_names)
+            file_names = [name for name in file_names if name not in stored]
+            print(f"{len(stored)} file(s) already in the store.")
+        else:
+            store = None
+
+        # Append in blocks so the whole folder is never held in memory
+        block = 1000
+        for start in range(0, len(file_names), block):
+            names = file_names[start:start + block]
+            spectra = [
+                read_spectrum(os.path.join(folder_path, name), range_min, range_max)
+                for name in names
+            ]
+
+            if store is None:
+                store = cls.create(store_path, spectra[0][0], dtype, range_min, range_max)
+
+            for name, (wavenumber, _) in zip(names, spectra):
+                if not np.array_equal(wavenumber, store.wavenumber):
+                    raise ValueError(
+                        f"{name} does not share the wavenumber axis of the store. Spectra measured on a different axis need a separate store."
+                    )
+
+            store.append(np.vstack([intensity for _, intensity in spectra]), names)
+
+        print(f"{len(file_names)} file(s) imported. The store now holds {len(store)} spectra.")
+
+        return store
+
+    def __len__(self):
+        return self.meta["n_spectra"]
+
+    @property
+    def file_names(self):
+        """
+        The file name of each spectrum, in row order.
+        """
+        return self.index["file_name"].tolist()
+
+    @property
+    def well_ids(self):
+        """
+        The well ID of each spectrum, in row order (empty if unknown).
+        """
+        return self.index["well_id"].tolist()
+
+    @property
+    def intensities(self):
+        """
+        The (n_spectra, n_points) intensity matrix as a read-only memmap.
+        """
+        if len(self) == 0:
+            return np.empty((0, self.meta["n_points"]), dtype=self.dtype)
+
+        return np.memmap(
+            os.path.join(self.path, _DATA_FILE),
+            dtype=self.dtype,
+            mode="r",
+            shape=(len(self), self.meta["n_points"]),
+        )
+
+    def append(self, intensities, file_names, well_ids = None):
+        """
+        Appends spectra on the store's wavenumber axis to the end of the store.
+
+        Parameters
+        ----------
+        intensities : numpy.ndarray
+            A (n_spectra, n_points) array of intensities.
+        file_names : list
+            The file name of each spectrum. Must not already be in the store.
+        well_ids : list
+            Optional. The well ID of each spectrum. If not specified, they are
+            taken from the file names (see ``well_id``).
+
+        Returns
+        -------
+        None.
+
+        """
+        intensities = np.atleast_2d(np.asarray(intensities))
+        file_names = list(file_names)
+
+        if intensities.shape != (len(file_names), self.meta["n_points"]):
+            raise ValueError(
+                f"Intensities have shape {intensities.shape}, expected ({len(file_names)}, {self.meta['n_points']})."
+            )
+        names = pd.Series(file_names)
+        duplicates = set(names[names.duplicated()]) | (self._names & set(file_names))
+        if duplicates:
+            raise ValueError(
+                f"File names must be unique in the store. Duplicates: {sorted(duplicates)}"
+            )
+        if well_ids is None:
+            well_ids = [well_id(name) for name in file_names]
+
+        # Write the rows, then the index rows, then the count. Updating
+        # meta.json commits the append: until then, readers only use the first
+        # n_spectra rows of the data and the index, and the next append
+        # overwrites anything past them, so an interrupted append leaves the
+        # store as it was
+        with open(os.path.join(self.path, _DATA_FILE), "r+b") as f:
+            f.seek(len(self) * self.meta["n_points"] * self.dtype.itemsize)
+            f.write(np.ascontiguousarray(intensities, dtype=self.dtype).tobytes())
+            f.truncate()
+
+        new_rows = pd.DataFrame({"file_name": file_names, "well_id": list(well_ids)}).astype(str)
+        index_path = os.path.join(self.path, _INDEX_FILE)
+        if "index_bytes" not in self.meta:
+            # A store written before the index size was kept: rewrite the
+            # committed rows once so the size is known
+            _replace_file(index_path, self.index.to_csv(index=False, lineterminator="\n"))
+            self.meta["index_bytes"] = os.path.getsize(index_path)
+
+        with open(index_path, "r+b") as f:
+            f.seek(self.meta["index_bytes"])
+            f.write(new_rows.to_csv(index=False, header=False, lineterminator="\n").encode("utf-8"))
+            f.truncate()
+            index_bytes = f.tell()
+
+        meta = dict(self.meta, n_spectra=len(self) + len(file_names), index_bytes=index_bytes)
+        _replace_file(os.path.join(self.path, _META_FILE), json.dumps(meta, indent=2))
+
+        self.index = pd.concat([self.index, new_rows], ignore_index=True)
+        self._names.update(file_names)
+        self.meta = meta
+
+    def iter_chunks(self, chunk_size = 1000, range_min = None, range_max = None):
+        """
+        Reads the store in blocks of ``chunk_size`` rows. Only the rows of the
+        current block are paged in, so the memory used does not depend on the
+        size of the store.
+
+        Parameters
+        ----------
+        chunk_size : int
+            The number of spectra in each block.
+        range_min : int
+            Optional. The minimum wavenumber of the desired spectral range.
+        range_max : int
+            Optional. The maximum wavenumber of the desired spectral range.
+
+        Yields
+        ------
+        wavenumber : numpy.ndarray
+            The wavenumber axis within the range.
+        intensities : numpy.ndarray
+            A (n_block, n_points) float64 array.
+        file_names : list
+            The file name of each row of ``intensities``.
+
+        """
+        columns = self._columns(range_min, range_max)
+        data = self.intensities
+        file_names = self.file_names
+
+        for start in range(0, len(self), chunk_size):
+            stop = min(start + chunk_size, len(self))
+            yield (
+                self.wavenumber[columns],
+                np.asarray(data[start:stop, columns], dtype=np.float64),
+                file_names[start:stop],
+            )
+
+    def _columns(self, range_min, range_max):
+        """
+        Returns the columns within [range_min, range_max], as a slice when
+        they are contiguous.
+        """
+        columns = np.ones(len(self.wavenumber), dtype=bool)
+        if range_min is not None and range_max is not None:
+            _check_range(range_min, range_max)
+            columns = _crop_mask(self.wavenumber, range_min, range_max)
+
+        # The range is contiguous on a sorted axis, so a slice reads only
+        # those columns
+        columns = np.flatnonzero(columns)
+        if len(columns) and columns[-1] - columns[0] + 1 == len(columns):
+            columns = slice(columns[0], columns[-1] + 1)
+
+        return columns
+
+    def read(self, range_min = None, range_max = None, file_names = None, well_ids = None):
+        """
+        Reads spectra from the store into memory, optionally cropped to a
+        range and restricted to some files or wells.
+
+        Parameters
+        ----------
+        range_min : int
+            Optional. The minimum wavenumber of the desired spectral range.
+        range_max : int
+            Optional. The maximum wavenumber of the desired spectral range.
+        file_names : list
+            Optional. The file names to read.
+        well_ids : list
+            Optional. The well IDs to read.
+
+        Returns
+        -------
+        wavenumber : numpy.ndarray
+            The wavenumber axis within the range.
+        intensities : numpy.ndarray
+            A (n_selected, n_points) float64 array.
+        file_names : list
+            The file name of each row of ``intensities``.
+
+        """
+        columns = self._columns(range_min, range_max)
+
+        rows = np.ones(len(self), dtype=bool)
+        if file_names is not None:
+            rows &= self.index["file_name"].isin(list(file_names)).to_numpy()
+        if well_ids is not None:
+            rows &= self.index["well_id"].isin(list(well_ids)).to_numpy()
+
+        data = self.intensities
+        if not rows.all():
+            data = data[np.flatnonzero(rows)]
+
+        intensities = np.asarray(data[:, columns], dtype=np.float64)
+
+        return self.wavenumber[columns], intensities, self.index["file_name"][rows].tolist()
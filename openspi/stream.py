@@ -0,0 +1,406 @@
+import os
+import time
+
+import pandas as pd
+
+from .core import match_native, r_script_in_memory, sort_export, SUMMARY_COLUMNS
+from .ingest import read_spectrum, group_by_axis
+
+
+class FolderWatcher:
+    """
+    Watches a folder that an instrument is writing spectra to, and matches
+    each .csv file as soon as it has been completely written. Results are
+    appended to a running table (and optionally to a .csv file), so they are
+    available seconds after each spectrum is acquired rather than after the
+    whole plate is finished. The Excel report ranks every match so far, so it
+    is rewritten every ``report_interval`` seconds and when ``run`` stops,
+    not after every batch.
+
+    A file is considered complete once its size and modification time have
+    not changed between two scans and it has not been modified for
+    ``settle_time`` seconds. Each file is matched only once; if
+    ``results_path`` already exists, the files listed in it are skipped, so a
+    restarted watcher picks up where it left off. Files without any matches
+    are listed in it with an empty ``spectrum_identity``, so they are skipped
+    too. A file that cannot be read or matched is retried after
+    ``retry_delay`` seconds (doubled after each failure), and skipped after
+    ``max_attempts`` failures.
+
+    Parameters
+    ----------
+    folder_path : str
+        The complete path to the folder to watch.
+    range_min : int
+        The minimum wavenumber of the desired spectral range.
+    range_max : int
+        The maximum wavenumber of the desired spectral range.
+    excel_path : str
+        Optional. The full path to an .xlsx report, written with
+        ``sort_export`` during ``run`` and when it stops (see
+        ``write_report``).
+    results_path : str
+        Optional. The full path to a .csv file that every new match is
+        appended to, batch by batch.
+    settle_time : float
+        The number of seconds a file must be left unmodified before it is
+        read.
+    top_n : int
+        The top *n* highest matches desired.
+    adj_intens : bool
+        If True, the intensity of the spectra will be adjusted.
+    adj_intens_type : str
+        The type of intensity adjustment to be made.
+    subtr_baseline : bool
+        If True, the baseline will be subtracted from the spectra.
+    session : OpenSpecySession
+        Optional. The R session to use (see ``r_script``).
+    matcher : str
+        The backend used for matching, 'r' or 'native' (see ``r_script``).
+    processor : str
+        The backend used for processing, 'r' or 'native' (see
+        ``openspi_main``).
+    library : SpectralLibrary
+        Optional. The library used when ``processor`` is 'native'.
+    nrel_version : bool
+        Passed to ``sort_export`` as ``nrel``.
+    report_interval : float
+        Rewrite the Excel report during ``run`` once this many seconds have
+        passed since it was last written and there are new matches. Default
+        is 60. If None, it is only written when ``run`` stops.
+    max_attempts : int
+        The number of times a file is read and matched before it is given up
+        on and listed in ``failed``. Default is 3.
+    retry_delay : float
+        The number of seconds to wait before retrying a file that failed,
+        doubled after each further failure. Default is 10.
+
+    """
+
+    def __init__(
+            self,
+            folder_path,
+            range_min,
+            range_max,
+            excel_path = None,
+            results_path = None,
+            settle_time = 2.0,
+            top_n = 5,
+            adj_intens = False,
+            adj_intens_type = 'none',
+            subtr_baseline = False,
+            session = None,
+            matcher = 'r',
+            processor = 'r',
+            library = None,
+            nrel_version = False,
+            report_interval = 60.0,
+            max_attempts = 3,
+            retry_delay = 10.0):
+        self.folder_path = folder_path
+        self.range_min = range_min
+        self.range_max = range_max
+        self.excel_path = excel_path
+        self.results_path = results_path
+        self.settle_time = settle_time
+        self.top_n = top_n
+        self.adj_intens = adj_intens
+        self.adj_intens_type = adj_intens_type
+        self.subtr_baseline = subtr_baseline
+        self.session = session
+        self.matcher = matcher
+        self.processor = processor
+        self.library = library
+        self.nrel_version = nrel_version
+        self.report_interval = report_interval
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+
+        # File name -> (size, mtime) seen on the previous scan
+        self._pending = {}
+        self.matched = set()
+        self.results = pd.DataFrame()
+
+        # The columns of the results .csv, fixed by its header
+        self._columns = None
+
+        # File name -> number of failed attempts, the time it can be retried
+        # at, and the files given up on
+        self._attempts = {}
+        self._retry_time = {}
+        self.failed = set()
+
+        # Whether the Excel report is behind the results, and when it was
+        # last written
+        self._report_stale = False
+        self._report_time = time.time()
+
+        if results_path is not None and os.path.exists(results_path):
+            results = pd.read_csv(results_path)
+            self._columns = list(results.columns)
+            self.matched.update(results["file_name.y"].unique())
+            # Leave out the rows that only record files without matches
+            self.results = results[results["spectrum_identity"].notna()].reset_index(drop=True)
+            print(f"Resuming: {len(self.matched)} file(s) already matched.")
+
+    def _ready_files(self):
+        """
+        Scans the folder and returns the new files that are completely written.
+        """
+        now = time.time()
+        ready = []
+        seen = {}
+
+        for name in sorted(os.listdir(self.folder_path)):
+            if not name.endswith(".csv") or name in self.matched or name in self.failed:
+                continue
+            if now < self._retry_time.get(name, 0.0):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.folder_path, name))
+            except FileNotFoundError:
+                continue
+
+            signature = (stat.st_size, stat.st_mtime)
+            seen[name] = signature
+
+            # Only read files that have not changed since the last scan and
+            # have been left alone for settle_time seconds
+            if (
+                self._pending.get(name) == signature
+                and stat.st_size > 0
+                and now - stat.st_mtime >= self.settle_time
+            ):
+                ready.append(name)
+
+        self._pending = seen
+
+        return ready
+
+    def _match(self, wavenumber, intensities, file_names):
+        """
+        Matches a batch of spectra that share a wavenumber axis.
+        """
+        if self.processor == 'native':
+            library = self.library
+            if library is None and self.session is not None:
+                library = self.session.native_library
+            return match_native(
+                wavenumber,
+                intensities,
+                file_names,
+                self.range_min,
+                self.range_max,
+                self.adj_intens,
+                self.adj_intens_type,
+                self.subtr_baseline,
+                self.top_n,
+                library = library,
+            )
+
+        return r_script_in_memory(
+            wavenumber,
+            intensities,
+            file_names,
+            self.range_min,
+            self.range_max,
+            self.adj_intens,
+            self.adj_intens_type,
+            self.subtr_baseline,
+            self.top_n,
+            session = self.session,
+            matcher = self.matcher,
+        )
+
+    def _failure(self, names, error):
+        """
+        Records a failed attempt to read or match some files. They are
+        retried after ``retry_delay`` seconds, doubled after each failure,
+        until they have failed ``max_attempts`` times.
+        """
+        for name in names:
+            attempts = self._attempts.get(name, 0) + 1
+            self._attempts[name] = attempts
+            if attempts >= self.max_attempts:
+                self.failed.add(name)
+                print(f"Giving up on {name} after {attempts} attempt(s): {error}")
+            else:
+                delay = self.retry_delay * 2 ** (attempts - 1)
+                self._retry_time[name] = time.time() + delay
+                print(f"Could not process {name} (attempt {attempts}), retrying in {delay:g} s: {error}")
+
+    def poll(self):
+        """
+        Scans the folder once and matches every new, completely written file.
+
+        Returns
+        -------
+        df_new : dataframe
+            The matches for the files matched in this scan (empty if there
+            were none).
+
+        """
+        spectra = {}
+        for name in self._ready_files():
+            try:
+                spectra[name] = read_spectrum(
+                    os.path.join(self.folder_path, name), self.range_min, self.range_max
+                )
+            except (OSError, ValueError) as e:
+                self._failure([name], f"{type(e).__name__}: {e}")
+
+        if not spectra:
+            return pd.DataFrame()
+
+        # Match files that share a wavenumber axis together. If a group fails
+        # (e.g. an error in R), its files are matched one at a time so that
+        # one bad file does not hold back the rest; files that still fail are
+        # left out of matched and retried on a later scan.
+        frames = []
+        matched = []
+        for wavenumber, intensities, names in group_by_axis(spectra):
+            try:
+                frames.append(self._match(wavenumber, intensities, names))
+                matched.extend(names)
+                continue
+            except Exception as e:
+                if len(names) == 1:
+                    self._failure(names, f"{type(e).__name__}: {e}")
+                    continue
+
+            for name, intensity in zip(names, intensities):
+                try:
+                    frames.append(self._match(wavenumber, intensity.reshape(1, -1), [name]))
+                except Exception as e:
+                    self._failure([name], f"{type(e).__name__}: {e}")
+                    continue
+                matched.append(name)
+
+        if not matched:
+            return pd.DataFrame()
+
+        df_new = pd.concat(frames, ignore_index=True)
+        self._record(df_new, matched)
+
+        return df_new
+
+    def _record(self, df_new, file_names):
+        """
+        Appends new matches to the running results and the results .csv. The
+        files without any matches get a row with only their file name in the
+        .csv, so that a restarted watcher does not match them again.
+        """
+        self.matched.update(file_names)
+        self.results = pd.concat([self.results, df_new], ignore_index=True)
+
+        found = set(df_new["file_name.y"]) if "file_name.y" in df_new.columns else set()
+        unmatched = [name for name in file_names if name not in found]
+
+        if self.results_path is not None:
+            if self._columns is None:
+                self._columns = list(df_new.columns) if len(df_new.columns) else list(SUMMARY_COLUMNS)
+            rows = pd.concat([df_new, pd.DataFrame({"file_name.y": unmatched})], ignore_index=True)
+            rows.reindex(columns=self._columns).to_csv(
+                self.results_path,
+                mode="a",
+                header=not os.path.exists(self.results_path),
+                index=False,
+            )
+
+        self._report_stale = True
+
+        note = f" ({len(unmatched)} without matches)" if unmatched else ""
+        print(f"Matched {len(file_names)} new file(s){note}; {len(self.matched)} in total.")
+
+    def write_report(self):
+        """
+        Writes every match so far to the Excel report with ``sort_export``, if
+        there is a report and it is behind the results.
+
+        Returns
+        -------
+        None.
+
+        """
+        if self.excel_path is None or not self._report_stale or len(self.results) == 0:
+            return
+
+        try:
+            sort_export(self.results, self.excel_path, self.top_n, nrel = self.nrel_version)
+        except Exception as e:
+            # e.g. the workbook is open in Excel; it is written again later
+            print(f"Could not write {self.excel_path}: {type(e).__name__}: {e}")
+            return
+
+        self._report_stale = False
+        self._report_time = time.time()
+
+    def run(self, poll_interval = 2.0, idle_timeout = None, max_files = None):
+        """
+        Polls the folder until stopped. Press Ctrl+C to stop. The Excel
+        report is rewritten every ``report_interval`` seconds and when it
+        stops.
+
+        Parameters
+        ----------
+        poll_interval : float
+            The number of seconds between scans.
+        idle_timeout : float
+            Optional. Stop after this many seconds without a new file.
+        max_files : int
+            Optional. Stop once this many files have been matched (e.g. the
+            number of wells on the plate).
+
+        Returns
+        -------
+        results : dataframe
+            All of the matches.
+
+        """
+        print(f"Watching {self.folder_path} for new spectra...")
+        last_match = time.time()
+
+        try:
+            while True:
+                if len(self.poll()) > 0:
+                    last_match = time.time()
+
+                if (
+                    self.report_interval is not None
+                    and time.time() - self._report_time >= self.report_interval
+                ):
+                    self.write_report()
+
+                if max_files is not None and len(self.matched) >= max_files:
+                    break
+                if idle_timeout is not None and time.time() - last_match >= idle_timeout:
+                    print("No new files detected. Stopping.")
+                    break
+
+                time.sleep(poll_interval)
+
+        except KeyboardInterrupt:
+            print("Stopped.")
+
+        finally:
+            self.write_report()
+
+        return self.results
+
+
+def watch_folder(folder_path, range_min, range_max, poll_interval = 2.0, idle_timeout = None, max_files = None, **kwargs):
+    """
+    Watches a folder and matches each .csv file as soon as it has been
+    completely written. See ``FolderWatcher`` for the keyword arguments and
+    ``FolderWatcher.run`` for ``poll_interval``, ``idle_timeout`` and
+    ``max_files``.
+
+    Returns
+    -------
+    results : dataframe
+        All of the matches.
+
+    """
+    watcher = FolderWatcher(folder_path, range_min, range_max, **kwargs)
+
+    return watcher.run(poll_interval = poll_interval, idle_timeout = idle_timeout, max_files = max_files)
@@ -0,0 +1,130 @@
+import json
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+
+class Tracer:
+    """
+    Records timing spans for the stages of a run. Each span has a name, a
+    start time and duration, the name of the span it is nested in and,
+    where known, the number of spectra it handled and the throughput in
+    spectra per second.
+
+    Pass a Tracer as ``tracer`` to ``openspi_main``, ``process_csv_folder``,
+    ``r_script``, ``r_script_in_memory``, ``match_native`` or
+    ``sort_export``. Spans are reported as they finish through ``callback``
+    and/or ``logger``, and the whole trace can be written to a JSON file with
+    ``dump``.
+
+    Parameters
+    ----------
+    callback : callable
+        Optional. Called with each finished span (a dict).
+    logger : logging.Logger
+        Optional. Each finished span is logged at INFO level.
+
+    """
+
+    def __init__(self, callback=None, logger=None):
+        self.callback = callback
+        self.logger = logger
+        self.spans = []
+        self.started = datetime.now()
+        self._origin = time.perf_counter()
+        self._stack = []
+
+    @contextmanager
+    def span(self, name, n_spectra=None, **attributes):
+        """
+        Times the code inside a ``with`` block as one span.
+
+        Parameters
+        ----------
+        name : str
+            The name of the stage.
+        n_spectra : int
+            Optional. The number of spectra handled, used for the throughput.
+            It can also be set inside the block with ``span["n_spectra"]``.
+        **attributes
+            Any other values to record with the span.
+
+        Yields
+        ------
+        span : dict
+            The span record, which can be updated inside the block.
+
+        """
+        record = {
+            "name": name,
+            "parent": self._stack[-1]["name"] if self._stack else None,
+            "start": time.perf_counter() - self._origin,
+            "n_spectra": n_spectra,
+        }
+        record.update(attributes)
+
+        self._stack.append(record)
+        try:
+            yield record
+        finally:
+            self._stack.pop()
+            record["seconds"] = time.perf_counter() - self._origin - record["start"]
+            if record["n_spectra"] and record["seconds"] > 0:
+                record["spectra_per_s"] = record["n_spectra"] / record["seconds"]
+            self._emit(record)
+
+    def _emit(self, record):
+        self.spans.append(record)
+
+        if self.callback is not None:
+            self.callback(record)
+
+        if self.logger is not None:
+            message = f"{record['name']}: {record['seconds']:.3f} s"
+            if record.get("spectra_per_s") is not None:
+                message += f" ({record['n_spectra']} spectra, {record['spectra_per_s']:.1f} spectra/s)"
+            self.logger.info(message)
+
+    def to_dict(self):
+        """
+        Returns the trace as a dict with the start time of the run and the
+        finished spans, in the order they finished.
+        """
+        return {"started": self.started.isoformat(timespec="seconds"), "spans": self.spans}
+
+    def dump(self, path):
+        """
+        Writes the trace to a JSON file.
+
+        Parameters
+        ----------
+        path : str
+            The full path to the .json file.
+
+        Returns
+        -------
+        None.
+
+        """
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2, default=str)
+
+
+class _NullTracer(Tracer):
+    """
+    A tracer that records nothing, used when no tracer is given.
+    """
+
+    @contextmanager
+    def span(self, name, n_spectra=None, **attributes):
+        yield {"name": name, "n_spectra": n_spectra}
+
+
+_null_tracer = _NullTracer()
+
+
+def as_tracer(tracer):
+    """
+    Returns ``tracer``, or a tracer that records nothing if it is None.
+    """
+    return _null_tracer if tracer is None else tracer
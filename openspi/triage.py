@@ -0,0 +1,254 @@
+import numpy as np
+import pandas as pd
+
+
+# The default thresholds of ``triage_spectra``. Pass a dict with some of these
+# keys as ``triage`` to override them.
+TRIAGE_THRESHOLDS = {
+    # The degree of the polynomial baseline removed before the blank tests, so
+    # that a drifting or curved baseline under the noise does not count as
+    # signal. Degree 10 follows up to about two periods of baseline drift.
+    "baseline_degree": 10,
+    # Spectra whose RMS about their mean is at or below this (or that have
+    # missing values, or the same value at every point) are 'dead'
+    "energy_min": 0.0,
+    # Spectra whose detrended range is below this many times their noise are
+    # 'blank' (white noise is about 7)
+    "snr_min": 10.0,
+    # Spectra whose detrended power spectrum is flatter than this (white noise
+    # is about 0.56, a spectrum with bands is close to 0) are 'blank'
+    "flatness_max": 0.3,
+    # Spectra with at least this fraction of their points stuck at their
+    # maximum are 'saturated'
+    "saturation_fraction": 0.05,
+}
+
+# The spectrum_identity reported for each triage label
+TRIAGE_IDENTITIES = {
+    "blank": "empty well",
+    "saturated": "saturated spectrum",
+    "dead": "dead spectrum",
+}
+
+
+def triage_thresholds(triage):
+    """
+    Returns the thresholds for a ``triage`` option: None if it is False or
+    None, the defaults if it is True, or the defaults updated with a dict.
+    """
+    if triage is None or triage is False:
+        return None
+    if triage is True:
+        return dict(TRIAGE_THRESHOLDS)
+
+    unknown = set(triage) - set(TRIAGE_THRESHOLDS)
+    if unknown:
+        raise ValueError(
+            f"Unknown triage thresholds: {', '.join(sorted(unknown))}. Options are {', '.join(TRIAGE_THRESHOLDS)}."
+        )
+
+    return dict(TRIAGE_THRESHOLDS, **triage)
+
+
+def spectrum_features(intensities, baseline_degree = 10):
+    """
+    Computes the features used to triage spectra, for the whole batch at
+    once.
+
+    Parameters
+    ----------
+    intensities : numpy.ndarray
+        A (n_spectra, n_points) array of raw intensities.
+    baseline_degree : int
+        The degree of the polynomial baseline fitted by least squares and
+        removed before computing ``'signal'``, ``'snr'`` and ``'flatness'``.
+
+    Returns
+    -------
+    features : dict
+        One array per feature, each with one value per spectrum:
+        ``'finite'`` (no missing values), ``'energy'`` (the RMS about the
+        mean), ``'range'`` (the maximum minus the minimum), ``'signal'``
+        (the range of the detrended spectrum), ``'noise'`` (a robust estimate
+        of the noise standard deviation from the second differences),
+        ``'snr'`` (the detrended range over the noise), ``'flatness'`` (the
+        spectral flatness of the detrended spectrum) and ``'saturation'``
+        (the fraction of points equal to the maximum).
+
+    """
+    intensities = np.atleast_2d(np.asarray(intensities, dtype=np.float64))
+    n_spectra, n_points = intensities.shape
+
+    finite = np.isfinite(intensities).all(axis=1)
+    values = np.where(np.isfinite(intensities), intensities, 0.0)
+
+    energy = values.std(axis=1)
+    span = np.ptp(values, axis=1) if n_points else np.zeros(n_spectra)
+
+    # The second difference of white noise has a standard deviation of
+    # sqrt(6) times that of the noise; the median makes the estimate robust
+    # to the bands
+    if n_points >= 3:
+        second = np.diff(values, n=2, axis=1)
+        noise = 1.4826 * np.median(np.abs(second), axis=1) / np.sqrt(6)
+    else:
+        noise = np.zeros(n_spectra)
+
+    # Remove a smooth polynomial baseline so that a sloping, curved or
+    # drifting baseline does not count as signal. The least-squares fit of
+    # every spectrum is one projection with the pseudo-inverse of the Legendre
+    # basis; the bands are too narrow for it to follow them.
+    residual = values - values.mean(axis=1, keepdims=True)
+    degree = min(int(baseline_degree), n_points - 1)
+    if degree >= 1:
+        vander = np.polynomial.legendre.legvander(np.linspace(-1, 1, n_points), degree)
+        residual = values - (values @ np.linalg.pinv(vander).T) @ vander.T
+
+    signal = np.ptp(residual, axis=1) if n_points else np.zeros(n_spectra)
+    snr = np.divide(signal, noise, out=np.full(n_spectra, np.inf), where=noise > 0)
+    snr[span == 0] = 0.0
+
+    power = np.abs(np.fft.rfft(residual, axis=1))[:, 1:] ** 2
+    if power.shape[1]:
+        power = power + np.finfo(np.float64).tiny
+        flatness = np.exp(np.log(power).mean(axis=1)) / power.mean(axis=1)
+    else:
+        flatness = np.ones(n_spectra)
+
+    maximum = values.max(axis=1, keepdims=True) if n_points else np.zeros((n_spectra, 1))
+    saturation = (values == maximum).mean(axis=1) if n_points else np.zeros(n_spectra)
+
+    return {
+        "finite": finite,
+        "energy": energy,
+        "range": span,
+        "signal": signal,
+        "noise": noise,
+        "snr": snr,
+        "flatness": flatness,
+        "saturation": saturation,
+    }
+
+
+def triage_spectra(
+    intensities,
+    baseline_degree = 10,
+    energy_min = 0.0,
+    snr_min = 10.0,
+    flatness_max = 0.3,
+    saturation_fraction = 0.05,
+):
+    """
+    Flags the spectra that are not worth matching: 'dead' spectra (missing
+    values, or the same value at every point), 'saturated' spectra (clipped
+    at the detector maximum) and 'blank' spectra (noise only, e.g. empty
+    wells). The tests are vectorized over the whole batch and take a fraction
+    of the time of processing and matching.
+
+    Parameters
+    ----------
+    intensities : numpy.ndarray
+        A (n_spectra, n_points) array of raw intensities.
+    baseline_degree : int
+        The degree of the polynomial baseline removed before the 'blank'
+        tests, so that noise on a curved or drifting baseline is still
+        'blank'.
+    energy_min : float
+        Spectra whose RMS about their mean is at or below this are 'dead'
+        (as are spectra with missing values or a single value).
+    snr_min : float
+        Spectra whose detrended range is less than this many times their
+        noise are 'blank'. White noise has a ratio of about 7.
+    flatness_max : float
+        Spectra whose detrended power spectrum has a spectral flatness above
+        this are 'blank'. White noise has a flatness of about 0.56.
+    saturation_fraction : float
+        Spectra with at least this fraction of their points equal to their
+        maximum are 'saturated'.
+
+    Returns
+    -------
+    labels : numpy.ndarray
+        The triage label of each spectrum: 'dead', 'saturated', 'blank', or
+        '' for the spectra to be matched.
+    features : dict
+        The features the labels were decided on (see
+        ``spectrum_features``).
+
+    """
+    features = spectrum_features(intensities, baseline_degree = baseline_degree)
+
+    dead = ~features["finite"] | (features["range"] == 0) | (features["energy"] <= energy_min)
+    saturated = ~dead & (features["saturation"] >= saturation_fraction)
+    blank = ~dead & ~saturated & (
+        (features["snr"] < snr_min) | (features["flatness"] > flatness_max)
+    )
+
+    labels = np.full(len(dead), "", dtype=object)
+    labels[blank] = "blank"
+    labels[saturated] = "saturated"
+    labels[dead] = "dead"
+
+    return labels, features
+
+
+def triage_matches(file_names, labels, features):
+    """
+    Builds the matches dataframe rows for triaged spectra: one row per
+    spectrum, with the ``spectrum_identity`` of its label (see
+    ``TRIAGE_IDENTITIES``), no ``match_val``, the estimated signal-to-noise
+    ratio as ``sn`` and the label in a ``'triage'`` column.
+    """
+    file_names = np.asarray(list(file_names), dtype=object)
+    labels = np.asarray(labels, dtype=object)
+    identities = np.array([TRIAGE_IDENTITIES[label] for label in labels], dtype=object)
+
+    return pd.DataFrame(
+        {
+            "object_id": file_names,
+            "match_val": np.full(len(labels), np.nan),
+            "spectrum_identity": identities,
+            "material_class": identities,
+            "plastic_or_not": "not plastic",
+            "sn": features["snr"],
+            "file_name.y": file_names,
+            "triage": labels,
+        }
+    )
+
+
+def triage_match_function(match_function, thresholds, tracer):
+    """
+    Wraps a ``match_function(wavenumber, intensities, file_names)`` so that
+    the spectra flagged by ``triage_spectra`` are reported straight away and
+    only the others are processed and matched. The returned matches have a
+    ``'triage'`` column, which is '' for the matched spectra.
+    """
+    def triaged_match_function(wavenumber, intensities, file_names):
+        intensities = np.atleast_2d(intensities)
+        file_names = list(file_names)
+
+        with tracer.span("triage", n_spectra = len(file_names)) as span:
+            labels, features = triage_spectra(intensities, **thresholds)
+            flagged = labels != ""
+            for label in TRIAGE_IDENTITIES:
+                span[label] = int((labels == label).sum())
+
+        frames = []
+        if not flagged.all():
+            keep = np.flatnonzero(~flagged)
+            df_matches = match_function(wavenumber, intensities[keep], [file_names[i] for i in keep])
+            df_matches = df_matches.assign(triage = "")
+            frames.append(df_matches)
+
+        if flagged.any():
+            index = np.flatnonzero(flagged)
+            selected = {name: values[index] for name, values in features.items()}
+            frames.append(triage_matches([file_names[i] for i in index], labels[index], selected))
+
+        if len(frames) == 1:
+            return frames[0]
+
+        return pd.concat(frames, ignore_index=True)
+
+    return triaged_match_function
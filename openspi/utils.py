@@ -3,7 +3,7 @@ import pandas as pd
 
 
 
-from openspi.metadata import _xlsx_metadata
+from openspi.metadata import _xlsx_metadata, _set_workbook_metadata
 
 def count_files(folder_path):
     """Counts the number of files in a given directory.
@@ -86,19 +86,34 @@ def plastic_matches_checked(row, index):
 
     """
 
-    if index == 1:
-        row.append("second match")
+    row.append(match_ordinal(index))
 
-    elif index == 2:
-        row.append("third match")
+    return row
 
-    elif index == 3:
-        row.append("fourth match")
 
-    elif index == 4:
-        row.append("fifth match")
+def match_ordinal(index):
+    """
+    Returns the note used to mark the place of a subsequent plastic match,
+    e.g. ``'second match'`` for index 1.
 
-    return row
+    Parameters
+    ----------
+    index : int
+        The (zero-based) index of the match within its file.
+
+    Returns
+    -------
+    note : str
+        The note for the match.
+
+    """
+
+    ordinals = ["first", "second", "third", "fourth", "fifth", "sixth", "seventh", "eighth", "ninth", "tenth"]
+
+    if index < len(ordinals):
+        return ordinals[index] + " match"
+
+    return f"match {index + 1}"
 
 
 def nonpolymer_matches_checked(row, nested_list):
@@ -192,6 +207,85 @@ def subsequent_matches_checked(df, nested_list):
     return nested_list
 
 
+def rank_matches(df):
+    """
+    Builds the Summary, Updated Summary and Subsequent Matches tables from the
+    library matches of every file at once, using ``groupby`` on
+    ``'file_name.y'`` instead of looping over each file. The result is the
+    same as calling ``subsequent_matches_checked`` on each file's matches
+    sorted by ``'match_val'``, and files may have any number of matches.
+
+    Parameters
+    ----------
+    df : df
+        A Pandas dataframe with the ``'file_name.y'``, ``'spectrum_identity'``,
+        ``'match_val'`` and ``'plastic_or_not'`` columns (one row per match).
+
+    Returns
+    -------
+    df_summary : df
+        The best match for each file.
+    df_updated_summary : df
+        The best match for each file, or its first plastic match if the best
+        match is not plastic, with a ``'matches_checked'`` note column.
+    df_subseq : df
+        Every match, sorted by file and then by ``'match_val'``, with the file
+        name replaced by ``'-'`` after the first row of each file.
+
+    """
+
+    # Sort by file name, then by match_val in descending order within each file
+    df = df.sort_values(
+        by=["file_name.y", "match_val"], ascending=[True, False], kind="stable"
+    ).reset_index(drop=True)
+
+    files = df["file_name.y"]
+    rank = df.groupby("file_name.y", sort=False).cumcount()
+    first = rank == 0
+
+    is_plastic = df["plastic_or_not"] == "plastic"
+    first_not_plastic = (
+        df["plastic_or_not"].groupby(files, sort=False).transform("first") == "not plastic"
+    )
+    has_plastic = is_plastic.groupby(files, sort=False).transform("any")
+    first_plastic_rank = rank.where(is_plastic).groupby(files, sort=False).transform("min")
+    all_empty_wells = (
+        (df["spectrum_identity"] == "empty well").groupby(files, sort=False).transform("all")
+    )
+
+    # If the best match is not plastic but a subsequent match is, use the first
+    # plastic match. Otherwise use the best match.
+    use_plastic = first_not_plastic & has_plastic
+    updated = (use_plastic & (rank == first_plastic_rank)) | (first & ~use_plastic)
+
+    df_updated_summary = df[updated].copy()
+    notes = pd.Series(" ", index=df_updated_summary.index, dtype=object)
+
+    nonpolymer = (first_not_plastic & ~has_plastic)[updated]
+    notes[nonpolymer] = "all top matches nonpolymer"
+    notes[nonpolymer & all_empty_wells[updated]] = "all top matches empty wells"
+
+    plastic = use_plastic[updated]
+    notes[plastic] = rank[updated][plastic].map(match_ordinal)
+
+    # Spectra reported by the triage (see openspi.triage) were not matched
+    if "triage" in df_updated_summary.columns:
+        triage = df_updated_summary["triage"].fillna("")
+        notes[triage != ""] = "triaged " + triage[triage != ""]
+
+    df_updated_summary["matches_checked"] = notes
+    df_updated_summary = df_updated_summary.reset_index(drop=True)
+
+    df_summary = df[first].reset_index(drop=True)
+
+    # Replace the file name with '-' after the first row of each file (done for
+    # legibility purposes)
+    df_subseq = df.copy()
+    df_subseq.loc[~first, "file_name.y"] = "-"
+
+    return df_summary, df_updated_summary, df_subseq
+
+
 def save_df_to_excel(excel_path, df, sheetname):
     """
     Saves a Pandas dataframe to an Excel file. If the Excel file does not yet
@@ -225,6 +319,104 @@ def save_df_to_excel(excel_path, df, sheetname):
     _xlsx_metadata(excel_path)
 
 
+def save_sheets_to_excel(excel_path, sheets):
+    """
+    Saves several Pandas dataframes to a new Excel file in a single pass, with
+    the version metadata set before the workbook is written. Unlike
+    ``save_df_to_excel``, the workbook is opened and saved only once, however
+    many sheets there are. An existing file at ``excel_path`` is overwritten.
+
+    Parameters
+    ----------
+    excel_path : str
+        The full path to an .xlsx file.
+    sheets : dict
+        The dataframes to be saved, keyed by sheet name, in the order the
+        sheets should appear.
+
+    Returns
+    -------
+    None.
+
+    """
+
+    with pd.ExcelWriter(excel_path, engine="openpyxl") as writer:
+        for sheetname, df in sheets.items():
+            df.to_excel(writer, sheet_name=sheetname, index=False)
+
+        _set_workbook_metadata(writer.book)
+
+
+# The file extension written for each columnar table format
+TABLE_FORMATS = {"parquet": ".parquet", "arrow": ".arrow"}
+
+
+def table_paths(base_path, names, table_format):
+    """
+    Returns the path of the columnar file written for each table by
+    ``save_tables``, e.g. ``'TopMatches_source_data.parquet'`` for the
+    'Source Data' table of ``'TopMatches'``.
+    """
+    if table_format not in TABLE_FORMATS:
+        raise ValueError(f"Unknown table_format: {table_format}. Options are 'parquet' or 'arrow'.")
+
+    return {
+        name: base_path + "_" + name.lower().replace(" ", "_") + TABLE_FORMATS[table_format]
+        for name in names
+    }
+
+
+def save_tables(base_path, tables, table_format = 'parquet'):
+    """
+    Saves several Pandas dataframes as columnar files, one per table, which
+    are much faster to write and to read than Excel sheets and have no row
+    limit. Requires the optional ``pyarrow`` package. Existing files are
+    overwritten.
+
+    Parameters
+    ----------
+    base_path : str
+        The full path the file names start with, without an extension (see
+        ``table_paths``).
+    tables : dict
+        The dataframes to be saved, keyed by table name.
+    table_format : str
+        'parquet' (default) or 'arrow' (the Arrow IPC file format, also known
+        as Feather v2).
+
+    Returns
+    -------
+    paths : dict
+        The path of the file written for each table.
+
+    """
+
+    paths = table_paths(base_path, tables, table_format)
+
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError(
+            "Writing Parquet or Arrow files requires pyarrow. Install it with 'pip install pyarrow'."
+        ) from None
+
+    for name, df in tables.items():
+        df = df.reset_index(drop=True)
+
+        # Columns that mix strings and numbers (e.g. the text rows of the
+        # Matches Checked table) are written as strings
+        for column in df.columns[df.dtypes == object]:
+            if df[column].dropna().map(type).nunique() > 1:
+                df[column] = df[column].map(lambda value: value if pd.isna(value) else str(value))
+
+        if table_format == 'parquet':
+            df.to_parquet(paths[name], index=False)
+        else:
+            df.to_feather(paths[name])
+
+    return paths
+
+
 def check_excel_sheet(excel_path, sheetname):
     """
     Checks if an Excel spreadsheet exists within the (already existing) Excel
@@ -309,55 +501,108 @@ def matches_checked_sheet(excel_path, nrel = False, n = 5):
     # Open the Summary and Updated Summary sheets into a pandas dataframe
     xlsx_file = pd.ExcelFile(excel_path)
     df_summary = pd.read_excel(xlsx_file, "Summary")
-    sum_len = len(df_summary)
-
     df_updated_summary = pd.read_excel(xlsx_file, "Updated Summary")
+
+    df_subseq = None
+    if nrel == True:
+        # Open the Subsequent Matches sheet into a pandas dataframe
+        df_subseq = pd.read_excel(xlsx_file, "Subsequent Matches")
+
+    df = matches_checked_df(df_summary, df_updated_summary, df_subseq, nrel = nrel, n = n)
+
+    print(df)
+
+    # Send df to Excel workbook
+    save_df_to_excel(excel_path, df, "Matches Checked")
+
+    print("Workbook saved to " + excel_path)
+
+    _xlsx_metadata(excel_path)
+
+
+def matches_checked_df(df_summary, df_updated_summary, df_subseq = None, nrel = False, n = 5):
+    """
+    Builds the 'Matches Checked' table (the number of polymer and nonpolymer
+    matches and empty wells) from the summary dataframes held in memory. If
+    the spectra were triaged (see ``openspi.triage``), a 'Triaged' column
+    counts the spectra reported without matching; triaged blanks are also
+    counted as empty wells, while saturated and dead spectra are instrument
+    failures, counted under 'Saturated or Dead' instead of as nonpolymer.
+
+    Parameters
+    ----------
+    df_summary : df
+        The 'Summary' dataframe.
+    df_updated_summary : df
+        The 'Updated Summary' dataframe.
+    df_subseq : df
+        The 'Subsequent Matches' dataframe. Only needed if ``nrel`` is True.
+    nrel : bool
+        If True, the function will also check polymer count of the first well
+        individually.
+    n : int
+        The number of top matches for each file. Equal to `top_n` in
+        `openspi_main`. Default is 5.
+
+    Returns
+    -------
+    df : df
+        The 'Matches Checked' dataframe.
+
+    """
+
+    sum_len = len(df_summary)
     upd_sum_len = len(df_updated_summary)
+    triaged = "triage" in df_summary.columns
 
     poly_count_init, nonpoly_count_init, empty_count_init = count_matches(df_summary)
 
     poly_count_upd, nonpoly_count_upd, empty_count_upd = count_matches(df_updated_summary)
 
     data = [['Initial', poly_count_init, nonpoly_count_init, empty_count_init, sum_len], ['Updated', poly_count_upd, nonpoly_count_upd, empty_count_upd, upd_sum_len]]
-    
-    if nrel == True:
-        # Open the Subsequent Matches sheet into a pandas dataframe
-        xlsx_file = pd.ExcelFile(excel_path)
-        df_subseq = pd.read_excel(xlsx_file, "Subsequent Matches")
 
+    if triaged == True:
+        data[0][4:4] = [count_triaged(df_summary), count_failed(df_summary)]
+        data[1][4:4] = [count_triaged(df_updated_summary), count_failed(df_updated_summary)]
+
+    if nrel == True:
         df_first_well = df_subseq.head(n)
 
         poly_count, nonpoly_count, empty_count = count_matches(df_first_well)
 
         first_well_data = ['First Well', poly_count, nonpoly_count, empty_count, n]
-        
+
+        if triaged == True:
+            first_well_data[4:4] = [count_triaged(df_first_well), count_failed(df_first_well)]
+
         data.append(first_well_data)
 
 
     # Pull version num from __version__.py
     from openspi.__version__ import __version__
 
-    # package_info = [['-', '-', '-', '-', '-'], ["Processed with openspi v" + __version__, ' ', ' ', ' ', ' ']]
-    # data.append(package_info)[0]
-    # data.append(package_info)[1]
-
     data.append(["Processed with openspi v" + __version__])
 
-    df = pd.DataFrame(data, columns=['-', 'Polymer', 'Nonpolymer', 'Empty Wells', 'Sample Size'])
+    columns = ['-', 'Polymer', 'Nonpolymer', 'Empty Wells', 'Sample Size']
+    if triaged == True:
+        columns[4:4] = ['Triaged', 'Saturated or Dead']
 
-    print(df)
+    df = pd.DataFrame(data, columns=columns)
 
-    # Send df to Excel workbook
-    save_df_to_excel(excel_path, df, "Matches Checked")
+    return df
 
-    print("Workbook saved to " + excel_path)
 
-    _xlsx_metadata(excel_path)
+# The triage labels of spectra that failed on the instrument rather than
+# being negatives (see openspi.triage)
+FAILED_TRIAGE = ("saturated", "dead")
 
 
 def count_matches(df):
+    # Saturated and dead spectra are not counted as nonpolymer
+    failed = _failed(df)
+
     df_plastic = df[df["plastic_or_not"] == "plastic"]
-    df_not_plastic = df[df["plastic_or_not"] == "not plastic"]
+    df_not_plastic = df[(df["plastic_or_not"] == "not plastic") & ~failed]
     df_empty = df[df["spectrum_identity"] == "empty well"]
 
     poly_count = len(df_plastic)
@@ -367,6 +612,33 @@ def count_matches(df):
     return poly_count, nonpoly_count, empty_count
 
 
+def count_triaged(df):
+    """
+    Counts the rows of a dataframe that were reported by the triage instead of
+    being matched (see ``openspi.triage``).
+    """
+    return int((df["triage"].fillna("") != "").sum())
+
+
+def _failed(df):
+    """
+    Returns a boolean series that is True for the rows of saturated or dead
+    spectra (see ``FAILED_TRIAGE``).
+    """
+    if "triage" not in df.columns:
+        return pd.Series(False, index=df.index)
+
+    return df["triage"].isin(FAILED_TRIAGE)
+
+
+def count_failed(df):
+    """
+    Counts the rows of a dataframe for saturated or dead spectra, which the
+    triage reported as instrument failures (see ``openspi.triage``).
+    """
+    return int(_failed(df).sum())
+
+
 def list_to_df_to_sheet(df_lst, columns_list, excel_path, sheet_name):
     """
     Converts a nested list into a Pandas dataframe, which is then saved to an
@@ -31,6 +31,9 @@ setup(
         "Operating System :: OS Independent",
     ],
     install_requires=required,
+    entry_points={
+        "console_scripts": ["openspi-batch=openspi.batch:main"],
+    },
     build_requires=build_required,
     license="MIT",
     url="https://github.com/KrisHeathNREL/OpenSpecy-Python-Interface",